@@ -0,0 +1,83 @@
+import pandas as pd
+import numpy as np
+import torch
+import os
+import sys
+import pickle
+import subprocess
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssfitter import NeuralStateSpaceSimulator
+from torchid.ssmodels import NeuralStateSpaceModel
+from torchid.export import export_model, load_model
+
+# Export a trained CSTR model to a self-contained inference artifact (TorchScript + metadata), working in the
+# original units of the data with the scaling of CSTR_scale.py. The artifact is checked against the simulation
+# of the original model on the validation dataset, and its cold-start time is measured in a fresh process
+# that imports torch only.
+
+COLD_START_CODE = """
+import sys
+import time
+import json
+import torch
+time_start = time.perf_counter()
+extra_files = {'meta.json': ''}
+model = torch.jit.load(sys.argv[1], _extra_files=extra_files)
+meta = json.loads(extra_files['meta.json'])
+time_load = time.perf_counter() - time_start
+with torch.no_grad(), torch.jit.optimized_execution(False):  # skip the profiling runs of the graph executor
+    x_next = model(torch.zeros(meta['n_x']), torch.zeros(meta['n_u']))
+time_first = time.perf_counter() - time_start
+print(f"{time_load*1e3:.1f} {time_first*1e3:.1f}")
+"""
+
+if __name__ == '__main__':
+
+    model_type = '1step_nonoise'
+
+    COL_T = ['time']
+    COL_X = ['Ca', 'T']
+    COL_U = ['q']
+
+    # Load the scaler (see CSTR_scale.py) and the model trained on the scaled dataset
+    with open(os.path.join("data", "fit_scaler.pkl"), 'rb') as fp:
+        scaler = pickle.load(fp)
+    COLUMNS_SCALE = ['Ca', 'T', 'q']  # columns scaled by the scaler, in this order
+    idx_x = [COLUMNS_SCALE.index(col) for col in COL_X]
+    idx_u = [COLUMNS_SCALE.index(col) for col in COL_U]
+
+    df_X = pd.read_csv(os.path.join("data", "CSTR_data_val.csv"))
+    time_data = np.array(df_X[COL_T], dtype=np.float32)
+    Ts = float(time_data[1, 0] - time_data[0, 0])
+
+    ss_model = NeuralStateSpaceModel(n_x=2, n_u=1, n_feat=64)
+    ss_model.load_state_dict(torch.load(os.path.join("models", f"model_SS_{model_type}.pkl")))
+
+    # Export
+    artifact_filename = os.path.join("models", f"model_SS_{model_type}.pt")
+    export_model(ss_model, artifact_filename, n_x=2, n_u=1, Ts=Ts,
+                 x_mean=scaler.mean_[idx_x], x_scale=scaler.scale_[idx_x],
+                 u_mean=scaler.mean_[idx_u], u_scale=scaler.scale_[idx_u],
+                 x_cols=COL_X, u_cols=COL_U, method='euler')  # integration method of the training simulation
+
+    # Check: simulation of the artifact in original units vs. simulation of the model in scaled units
+    x_scaled = np.array(df_X[COL_X], dtype=np.float32)
+    u_scaled = np.array(df_X[COL_U], dtype=np.float32)
+    x = (x_scaled * scaler.scale_[idx_x] + scaler.mean_[idx_x]).astype(np.float32)
+    u = (u_scaled * scaler.scale_[idx_u] + scaler.mean_[idx_u]).astype(np.float32)
+
+    nn_solution = NeuralStateSpaceSimulator(ss_model)
+    exported_model, meta = load_model(artifact_filename)
+    with torch.no_grad():
+        x_sim_scaled = nn_solution.f_sim(torch.tensor(x_scaled[0]), torch.tensor(u_scaled)).numpy()
+        x_sim_exported = exported_model.simulate(torch.tensor(x[0]), torch.tensor(u)).numpy()
+    x_sim = x_sim_scaled * scaler.scale_[idx_x] + scaler.mean_[idx_x]
+    rel_err = np.max(np.abs(x_sim_exported - x_sim), axis=0) / np.std(x, axis=0)
+    print(f"Metadata: {meta}")
+    print(f"Max relative difference, artifact vs. model: {rel_err}")
+
+    # Cold start in a fresh process, without torchid
+    result = subprocess.run([sys.executable, "-c", COLD_START_CODE, artifact_filename],
+                            capture_output=True, text=True, check=True)
+    time_load, time_first = [float(val) for val in result.stdout.split()]
+    print(f"Cold start: load {time_load:.1f} ms, load + first step {time_first:.1f} ms")
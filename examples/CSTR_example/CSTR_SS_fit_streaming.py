@@ -0,0 +1,87 @@
+import os
+import numpy as np
+import torch
+import time
+import matplotlib.pyplot as plt
+import sys
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssfitter import NeuralStateSpaceSimulator
+from torchid.ssmodels import NeuralStateSpaceModel
+from torchid.data import convert_csv, open_record
+from torchid.training import StreamingStateSpaceTrainer
+
+# SS model, multistep simulation error minimization in streaming mode: the record is memory-mapped from disk
+# (torchid.data), the hidden state and its optimizer state are paged in and out per chunk. The memory used by
+# the training depends on chunk_len only, hence the same script applies to records larger than RAM.
+
+
+class ScaledSignal(object):
+    """ Lazily scaled view of a memory-mapped signal, sliced by the trainer one chunk at a time """
+    def __init__(self, x, scale):
+        self.x = x
+        self.scale = scale
+        self.shape = x.shape
+
+    def __getitem__(self, idx):
+        return self.x[idx] * self.scale
+
+
+if __name__ == '__main__':
+
+    # Set seed for reproducibility
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    # Overall parameters
+    num_iter = 5000  # gradient-based optimization steps
+    chunk_len = 2000  # samples of a chunk in memory
+    iters_per_chunk = 100  # iterations on a chunk before paging in the next one
+    seq_len = 64  # subsequence length m
+    batch_size = 32  # number of subsequences q
+    lr = 1e-3  # learning rate
+    test_freq = 100  # print message every test_freq iterations
+
+    # Column names
+    COL_T = 'time'
+    COL_X = ['Ca', 'T']
+    COL_U = ['q']
+
+    # Convert the dataset once to the memory-mapped format
+    data_path = os.path.join("data", "cstr")
+    if not os.path.exists(os.path.join(data_path, "meta.json")):
+        convert_csv(os.path.join("data", "cstr.dat"), data_path, u_cols=COL_U, x_cols=COL_X, time_col=COL_T,
+                    header=None, sep="\t", names=['time', 'q', 'Ca', 'T', 'None'])
+    record = open_record(data_path)
+
+    # Scaled signals, as in the other CSTR examples. Only the chunks being paged in are read and scaled
+    u = ScaledSignal(record.u, torch.tensor([1/100]))
+    x = ScaledSignal(record.x, torch.tensor([10.0, 1/400]))
+
+    # Setup neural model structure
+    ss_model = NeuralStateSpaceModel(n_x=2, n_u=1, n_feat=64)
+    nn_solution = NeuralStateSpaceSimulator(ss_model)
+
+    trainer = StreamingStateSpaceTrainer(nn_solution, u, x, os.path.join("models", "hidden_SS_streaming"),
+                                         chunk_len=chunk_len, iters_per_chunk=iters_per_chunk,
+                                         seq_len=seq_len, batch_size=batch_size, lr=lr, test_freq=test_freq)
+    print(f"Record: {record.num_samples} samples, {len(trainer.chunk_start)} chunks of {chunk_len} samples")
+
+    start_time = time.time()
+    trainer.train(num_iter)
+    train_time = time.time() - start_time
+    print(f"\nTrain time: {train_time:.2f}")
+
+    # Save model
+    model_filename = f"model_SS_{seq_len}step_streaming.pkl"
+    torch.save(nn_solution.ss_model.state_dict(), os.path.join("models", model_filename))
+
+    # Loss plot
+    LOSS = trainer.get_loss()
+    fig, ax = plt.subplots(1, 1)
+    ax.plot(LOSS[:, 0], 'k', label='TOT')
+    ax.plot(LOSS[:, 2], 'r', label='CONSISTENCY')
+    ax.plot(LOSS[:, 1], 'b', label='FIT')
+    ax.grid(True)
+    ax.legend(loc='upper right')
+    ax.set_ylabel("Loss (-)")
+    ax.set_xlabel("Iteration (-)")
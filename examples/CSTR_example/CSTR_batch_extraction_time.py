@@ -0,0 +1,72 @@
+import numpy as np
+import torch
+import matplotlib.pyplot as plt
+import os
+import sys
+import time
+sys.path.append(os.path.join("..", ".."))
+from torchid.util import SubsequenceDataset
+
+# Compare the per-iteration cost of the minibatch extraction with the SubsequenceDataset (torch sampling of the start
+# indices and zero-copy unfold windows) and with the previous implementation (np.random.choice over the whole range
+# of start indices and fancy indexing of the numpy record, then torch.tensor) for increasing record length N
+
+
+def get_batch_numpy(x, u, batch_size, seq_len):
+    """ Reference implementation: O(N) sampling and copy/conversion of the batch """
+    num_samples = x.shape[0]
+    batch_start = np.random.choice(np.arange(num_samples - seq_len, dtype=np.int64), batch_size, replace=False)
+    batch_idx = batch_start[:, np.newaxis] + np.arange(seq_len)
+    batch_x0 = torch.tensor(x[batch_start])
+    batch_x = torch.tensor(x[batch_idx])
+    batch_u = torch.tensor(u[batch_idx])
+    return batch_x0, batch_u, batch_x
+
+
+if __name__ == '__main__':
+
+    # Set seed for reproducibility
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    # Overall parameters
+    batch_size = 32  # number of subsequences q
+    seq_len = 64  # subsequence length m
+    num_rep = 200  # repetitions for each record length
+    N_SAMPLES = [10**3, 10**4, 10**5, 10**6, 10**7]  # record length N
+
+    TIME_NUMPY = []
+    TIME_DATASET = []
+
+    for num_samples in N_SAMPLES:
+        x = np.random.randn(num_samples, 2).astype(np.float32)
+        u = np.random.randn(num_samples, 1).astype(np.float32)
+        dataset = SubsequenceDataset(torch.from_numpy(x), torch.from_numpy(u), seq_len=seq_len, batch_size=batch_size)
+
+        time_start = time.perf_counter()
+        for _ in range(num_rep):
+            get_batch_numpy(x, u, batch_size, seq_len)
+        TIME_NUMPY.append((time.perf_counter() - time_start) / num_rep)
+
+        time_start = time.perf_counter()
+        for _ in range(num_rep):
+            batch_start, (batch_x, batch_u) = dataset.get_batch()
+            batch_x0 = batch_x[:, 0, :]
+        TIME_DATASET.append((time.perf_counter() - time_start) / num_rep)
+
+    TIME_NUMPY = np.array(TIME_NUMPY)
+    TIME_DATASET = np.array(TIME_DATASET)
+    for idx, num_samples in enumerate(N_SAMPLES):
+        print(f'N = {num_samples:8d} | numpy {TIME_NUMPY[idx]*1e6:9.1f} us  '
+              f'dataset {TIME_DATASET[idx]*1e6:7.1f} us (x{TIME_NUMPY[idx]/TIME_DATASET[idx]:.1f})')
+
+    # Plot
+    fig, ax = plt.subplots(1, 1)
+    ax.plot(N_SAMPLES, TIME_NUMPY*1e6, '*r', label='np.random.choice + torch.tensor')
+    ax.plot(N_SAMPLES, TIME_DATASET*1e6, '*b', label='SubsequenceDataset')
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.set_xlabel("Record length N (-)")
+    ax.set_ylabel("Time batch extraction ($\mu$s)")
+    ax.legend()
+    ax.grid(True)
@@ -0,0 +1,77 @@
+import os
+import pandas as pd
+import numpy as np
+import torch
+import time
+import sys
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssfitter import NeuralStateSpaceSimulator
+from torchid.ssmodels import NeuralStateSpaceModel
+from torchid.iofitter import NeuralIOSimulator
+from torchid.iomodels import NeuralIOModel
+from torchid.training import NeuralStateSpaceTrainer, NeuralIOTrainer
+
+# Time per training iteration of the SS and IO trainers (multi-step simulation error) in eager mode and with the
+# whole training step compiled (compile=True). The compilation time is paid by the first compiled iteration and
+# it is reported separately. Both trainers start from the same model and draw the same batches, thus their losses
+# coincide up to rounding errors.
+
+if __name__ == '__main__':
+
+    # Set seed for reproducibility
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    num_iter = 200  # timed iterations
+    lr = 1e-3  # learning rate
+
+    COL_T = ['time']
+    COL_Y = ['Ca']
+    COL_X = ['Ca', 'T']
+    COL_U = ['q']
+
+    df_X = pd.read_csv(os.path.join("data", "cstr.dat"), header=None, sep="\t")
+    df_X.columns = ['time', 'q', 'Ca', 'T', 'None']
+
+    df_X['q'] = df_X['q'] / 100
+    df_X['Ca'] = df_X['Ca'] * 10
+    df_X['T'] = df_X['T'] / 400
+
+    y = np.array(df_X[COL_Y], dtype=np.float32)
+    x = np.array(df_X[COL_X], dtype=np.float32)
+    u = np.array(df_X[COL_U], dtype=np.float32)
+    u_torch = torch.from_numpy(u)
+    y_torch = torch.from_numpy(y)
+    x_torch = torch.from_numpy(x)
+    num_samples = u.shape[0]
+
+    def get_trainer(structure, compile):
+        torch.manual_seed(0)
+        if structure == 'SS':  # settings of CSTR_SS_fit_multistep.py
+            seq_len = 128
+            nn_solution = NeuralStateSpaceSimulator(NeuralStateSpaceModel(n_x=2, n_u=1, n_feat=64))
+            return NeuralStateSpaceTrainer(nn_solution, u_torch, x_torch, mode='multistep', seq_len=seq_len,
+                                           batch_size=num_samples//seq_len, lr=lr, compile=compile, test_freq=0)
+        else:  # settings of CSTR_IO_ident_minibatch.py
+            seq_len = 32
+            io_solution = NeuralIOSimulator(NeuralIOModel(n_a=2, n_b=2, n_feat=64))
+            return NeuralIOTrainer(io_solution, u_torch, y_torch, mode='multistep', seq_len=seq_len,
+                                   batch_size=num_samples//seq_len, lr=lr, compile=compile, test_freq=0)
+
+    for structure in ['SS', 'IO']:
+        TIME = {}
+        LOSS = {}
+        for compile in [False, True]:
+            trainer = get_trainer(structure, compile)
+            time_start = time.perf_counter()
+            trainer.train(1)  # warm up (compilation)
+            time_first = time.perf_counter() - time_start
+
+            time_start = time.perf_counter()
+            trainer.train(num_iter)
+            TIME[compile] = (time.perf_counter() - time_start) / num_iter
+            LOSS[compile] = trainer.get_loss()
+
+        print(f"{structure} q {trainer.batch_size} m {trainer.seq_len} | compilation time {time_first:.1f} s | "
+              f"eager {TIME[False]*1e3:.2f} ms/iter | compiled {TIME[True]*1e3:.2f} ms/iter "
+              f"(x{TIME[False]/TIME[True]:.2f}) | max loss difference {np.max(np.abs(LOSS[True] - LOSS[False])):.1e}")
@@ -0,0 +1,85 @@
+import pandas as pd
+import numpy as np
+import torch
+import multiprocessing
+import resource
+import tempfile
+import os
+import sys
+import time
+sys.path.append(os.path.join("..", ".."))
+from torchid.data import convert_csv, open_record
+
+# Compare the open time and the peak memory of a large identification record loaded from CSV with pandas (as in the
+# examples) and opened from the memory-mapped float32 columnar format of torchid.data. The record is obtained by
+# repeating cstr.dat. Each case runs in a fresh process, so that the increase of peak resident memory (ru_maxrss)
+# can be attributed to the data loading only. Linux only.
+
+COL_T = 'time'
+COL_X = ['Ca', 'T']
+COL_U = ['q']
+CSV_KWARGS = {'header': None, 'sep': "\t", 'names': ['time', 'q', 'Ca', 'T', 'None']}
+
+
+def peak_memory_MB():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is in kB on Linux
+
+
+def run_case(method, path, batch_size, seq_len, queue):
+
+    np.random.seed(0)
+    mem_start = peak_memory_MB()
+    time_start = time.perf_counter()
+    if method == 'csv':
+        df_X = pd.read_csv(path, **CSV_KWARGS)
+        x = torch.tensor(np.array(df_X[COL_X], dtype=np.float32))
+        u = torch.tensor(np.array(df_X[COL_U], dtype=np.float32))
+    else:
+        record = open_record(path)
+        x = record.x
+        u = record.u
+    time_open = time.perf_counter() - time_start
+
+    # Extract a random batch of subsequences, as in a training iteration
+    batch_start = torch.randint(x.shape[0] - seq_len, (batch_size,))
+    batch_idx = batch_start[:, None] + torch.arange(seq_len)
+    batch_x = x[batch_idx]
+    batch_u = u[batch_idx]
+    mem_open = peak_memory_MB() - mem_start
+
+    queue.put((time_open, mem_open))
+
+
+if __name__ == '__main__':
+
+    num_copies = 500  # number of repetitions of cstr.dat in the large record
+    batch_size = 32  # number of subsequences q
+    seq_len = 64  # subsequence length m
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        # Build the large CSV record
+        csv_path = os.path.join(tmp_dir, "cstr_large.dat")
+        with open(os.path.join("data", "cstr.dat")) as f:
+            cstr_data = f.read()
+        with open(csv_path, "w") as f:
+            for _ in range(num_copies):
+                f.write(cstr_data)
+        size_csv = os.path.getsize(csv_path) / 2**20
+
+        # Convert it once to the memory-mapped format
+        data_path = os.path.join(tmp_dir, "cstr_large")
+        time_start = time.perf_counter()
+        record = convert_csv(csv_path, data_path, u_cols=COL_U, x_cols=COL_X, time_col=COL_T, **CSV_KWARGS)
+        time_convert = time.perf_counter() - time_start
+        print(f"Record: {record.num_samples} samples, CSV {size_csv:.1f} MB, conversion time {time_convert:.2f} s")
+        del record
+
+        ctx = multiprocessing.get_context('spawn')
+        for method, path in [('csv', csv_path), ('mmap', data_path)]:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_case, args=(method, path, batch_size, seq_len, queue))
+            proc.start()
+            time_open, mem_open = queue.get()
+            proc.join()
+            print(f"{method:>5s} | open time {time_open*1e3:10.2f} ms | peak memory increase {mem_open:8.1f} MB")
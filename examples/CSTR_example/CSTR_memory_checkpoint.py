@@ -0,0 +1,94 @@
+import pandas as pd
+import numpy as np
+import torch
+import multiprocessing
+import resource
+import os
+import sys
+import time
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssfitter import NeuralStateSpaceSimulator
+from torchid.ssmodels import NeuralStateSpaceModel
+from torchid.iofitter import NeuralIOSimulator
+from torchid.iomodels import NeuralIOModel
+
+# Compare the peak memory and the time of the multi-step simulation with gradients (forward and backward pass),
+# with the full autograd graph and with checkpointed segments of checkpoint_every steps, for the SS and the IO
+# model structures over long subsequences (as in the longest case of CSTR_computational_time.py).
+# Each case runs in a fresh process, so that the increase of peak resident memory (ru_maxrss) can be attributed
+# to the gradient computation only. Linux only.
+
+
+def peak_memory_MB():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is in kB on Linux
+
+
+def run_case(structure, checkpoint_every, batch_size, seq_len, queue):
+
+    np.random.seed(0)
+    torch.manual_seed(0)
+    torch.set_num_threads(1)
+
+    COL_X = ['Ca', 'T']
+    COL_U = ['q']
+    df_X = pd.read_csv(os.path.join("data", "cstr.dat"), header=None, sep="\t")
+    df_X.columns = ['time', 'q', 'Ca', 'T', 'None']
+    df_X['q'] = df_X['q'] / 100
+    df_X['Ca'] = df_X['Ca'] * 10
+    df_X['T'] = df_X['T'] / 400
+    x = np.array(df_X[COL_X], dtype=np.float32)
+    u = np.array(df_X[COL_U], dtype=np.float32)
+    num_samples = x.shape[0]
+
+    batch_start = np.random.randint(1, num_samples - seq_len, batch_size)
+    batch_idx = batch_start[:, np.newaxis] + np.arange(seq_len)
+    batch_u = torch.tensor(u[batch_idx])
+    batch_x = torch.tensor(x[batch_idx])
+
+    if structure == 'SS':
+        ss_model = NeuralStateSpaceModel(n_x=2, n_u=1, n_feat=64)
+        nn_solution = NeuralStateSpaceSimulator(ss_model)
+        batch_x0 = torch.tensor(x[batch_start], requires_grad=True)  # hidden initial state
+
+        def f_sim(u_seq, checkpoint_every):
+            return nn_solution.f_sim_multistep(batch_x0, u_seq, checkpoint_every=checkpoint_every)
+    else:
+        io_model = NeuralIOModel(n_a=1, n_b=1, n_feat=64)
+        io_solution = NeuralIOSimulator(io_model)
+        batch_x = batch_x[..., [0]]
+        batch_y_seq = torch.tensor(x[batch_start - 1, 0:1], requires_grad=True)  # hidden initial condition
+        batch_u_seq = torch.tensor(u[batch_start - 1])
+
+        def f_sim(u_seq, checkpoint_every):
+            return io_solution.f_sim_multistep(u_seq, batch_y_seq, batch_u_seq, checkpoint_every=checkpoint_every)
+
+    # Warm up on a short sequence (allocator and thread pool initialization)
+    torch.mean(f_sim(batch_u[:, :8, :], checkpoint_every) ** 2).backward()
+
+    mem_start = peak_memory_MB()
+    time_start = time.perf_counter()
+    batch_x_sim = f_sim(batch_u, checkpoint_every)
+    loss = torch.mean((batch_x_sim - batch_x) ** 2)
+    loss.backward()
+    time_grad = time.perf_counter() - time_start
+    mem_grad = peak_memory_MB() - mem_start
+
+    queue.put((mem_grad, time_grad))
+
+
+if __name__ == '__main__':
+
+    seq_len = 7000  # subsequence length m
+    batch_size = 16  # number of subsequences q
+    CHECKPOINT_EVERY = [None, 1000, 100]
+
+    ctx = multiprocessing.get_context('spawn')
+    for structure in ['SS', 'IO']:
+        for checkpoint_every in CHECKPOINT_EVERY:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_case, args=(structure, checkpoint_every, batch_size, seq_len, queue))
+            proc.start()
+            mem_grad, time_grad = queue.get()
+            proc.join()
+            print(f"{structure} | checkpoint_every {str(checkpoint_every):>4s} | q {batch_size} | m {seq_len} | "
+                  f"peak memory increase {mem_grad:8.1f} MB | time {time_grad:.2f} s")
@@ -0,0 +1,109 @@
+import pandas as pd
+import numpy as np
+import torch
+import multiprocessing
+import resource
+import os
+import sys
+import time
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssfitter import NeuralStateSpaceSimulator
+from torchid.ssmodels import NeuralStateSpaceModel
+
+# Compare the peak memory of the multi-step simulation writing into a preallocated output tensor
+# (allocated internally or caller-supplied with out=) and collecting the steps in a list + torch.stack. Each case runs in a fresh process,
+# so that the increase of peak resident memory (ru_maxrss) can be attributed to the simulation only. Linux only.
+
+
+def f_sim_multistep_stack(ss_model, x0_batch, U_batch):
+    """ Reference implementation: collect the steps in a list, then copy them with torch.stack """
+    X_sim_list = []
+    xstep = x0_batch
+    for i in range(U_batch.shape[1]):
+        X_sim_list += [xstep]
+        dx = ss_model(xstep, U_batch[:, i, :])
+        xstep = xstep + dx
+    X_sim = torch.stack(X_sim_list, 1)
+    return X_sim
+
+
+def peak_memory_MB():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is in kB on Linux
+
+
+def current_memory_MB():
+    with open("/proc/self/statm") as f:
+        rss_pages = int(f.read().split()[1])
+    return rss_pages * resource.getpagesize() / 2**20
+
+
+def run_case(method, grad, batch_size, seq_len, queue):
+
+    np.random.seed(0)
+    torch.manual_seed(0)
+    torch.set_num_threads(1)
+
+    COL_X = ['Ca', 'T']
+    COL_U = ['q']
+    df_X = pd.read_csv(os.path.join("data", "cstr.dat"), header=None, sep="\t")
+    df_X.columns = ['time', 'q', 'Ca', 'T', 'None']
+    df_X['q'] = df_X['q'] / 100
+    df_X['Ca'] = df_X['Ca'] * 10
+    df_X['T'] = df_X['T'] / 400
+    x = np.array(df_X[COL_X], dtype=np.float32)
+    u = np.array(df_X[COL_U], dtype=np.float32)
+    num_samples = x.shape[0]
+
+    ss_model = NeuralStateSpaceModel(n_x=2, n_u=1, n_feat=64)
+    nn_solution = NeuralStateSpaceSimulator(ss_model)
+
+    batch_start = np.random.randint(0, num_samples - seq_len, batch_size)
+    batch_idx = batch_start[:, np.newaxis] + np.arange(seq_len)
+    batch_x0 = torch.tensor(x[batch_start])
+    batch_u = torch.tensor(u[batch_idx])
+    batch_x = torch.tensor(x[batch_idx])
+    out = torch.zeros((batch_size, seq_len, 2)) if method == 'out' else None
+
+    # Warm up on a short sequence (allocator and thread pool initialization)
+    with torch.no_grad():
+        nn_solution.f_sim_multistep(batch_x0, batch_u[:, :8, :])
+
+    mem_start = current_memory_MB()
+    time_start = time.perf_counter()
+    with torch.set_grad_enabled(grad):
+        if method == 'stack':
+            batch_x_sim = f_sim_multistep_stack(ss_model, batch_x0, batch_u)
+        else:
+            batch_x_sim = nn_solution.f_sim_multistep(batch_x0, batch_u, out=out)
+        if grad:
+            loss = torch.mean((batch_x_sim - batch_x) ** 2)
+            loss.backward()
+    time_sim = time.perf_counter() - time_start
+    mem_sim = peak_memory_MB() - mem_start
+
+    queue.put((mem_sim, time_sim))
+
+
+if __name__ == '__main__':
+
+    seq_len = 7000  # subsequence length m, as in the longest case of CSTR_computational_time.py
+    batch_size_nograd = 256  # number of subsequences q for the simulation without gradients
+    batch_size_grad = 16  # number of subsequences q for the simulation with gradients
+
+    size_traj = batch_size_nograd * seq_len * 2 * 4 / 2**20
+    print(f"Simulated state trajectory size (no grad): {size_traj:.1f} MB")
+
+    ctx = multiprocessing.get_context('spawn')
+    CASES = [('stack', False, batch_size_nograd),
+             ('prealloc', False, batch_size_nograd),
+             ('out', False, batch_size_nograd),
+             ('stack', True, batch_size_grad),
+             ('out', True, batch_size_grad)]
+    for method, grad, batch_size in CASES:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_case, args=(method, grad, batch_size, seq_len, queue))
+        proc.start()
+        mem_sim, time_sim = queue.get()
+        proc.join()
+        print(f"{method:>8s} | grad {str(grad):>5s} | q {batch_size:4d} | "
+              f"peak memory increase {mem_sim:8.1f} MB | time {time_sim:.2f} s")
@@ -11,6 +11,7 @@ import sys
 sys.path.append(os.path.join("..", ".."))
 from torchid.ssfitter import NeuralStateSpaceSimulator
 from torchid.ssmodels import CTSNeuralStateSpaceModel
+from torchid.util import get_batch_windows
 
 
 if __name__ == '__main__':
@@ -26,6 +27,7 @@ if __name__ == '__main__':
     alpha = 0.5  # fit/consistency trade-off constant
     lr = 1e-4  # learning rate
     test_freq = 100  # print message every test_freq iterations
+    sparse_hidden = False  # if True, the hidden state is optimized by SparseAdam (only the rows in the batch)
 
     # Load dataset
     df_data = pd.read_csv(os.path.join("data", "dataBenchmark.csv"))
@@ -50,10 +52,17 @@ if __name__ == '__main__':
     # Setup optimizer
     params_net = list(nn_solution.ss_model.parameters())
     params_hidden = [x_hidden_fit]
-    optimizer = optim.Adam([
-        {'params': params_net,    'lr': lr},
-        {'params': params_hidden, 'lr': lr},
-    ], lr=10*lr)
+    if sparse_hidden:
+        # The hidden state has sparse gradients (only the rows of the batch): it is optimized by SparseAdam, which
+        # updates only those rows, thus the cost of an iteration does not depend on the record length
+        optimizer = optim.Adam(params_net, lr=lr)
+        optimizer_hidden = optim.SparseAdam(params_hidden, lr=lr)
+    else:
+        optimizer = optim.Adam([
+            {'params': params_net,    'lr': lr},
+            {'params': params_hidden, 'lr': lr},
+        ], lr=10*lr)
+        optimizer_hidden = None
 
     # Batch extraction funtion
     def get_batch(batch_size, seq_len):
@@ -66,8 +75,12 @@ if __name__ == '__main__':
 
         # Extract batch data
         batch_t = torch.tensor(time_fit[batch_idx])
-        batch_x0_hidden = x_hidden_fit[batch_start, :]
-        batch_x_hidden = x_hidden_fit[[batch_idx]]
+        if sparse_hidden:
+            batch_x_hidden = get_batch_windows(x_hidden_fit, batch_start, seq_len, sparse_grad=True)
+            batch_x0_hidden = batch_x_hidden[:, 0, :]
+        else:
+            batch_x0_hidden = x_hidden_fit[batch_start, :]
+            batch_x_hidden = x_hidden_fit[[batch_idx]]
         batch_u = torch.tensor(u_fit[batch_idx])
         batch_y = torch.tensor(y_fit[batch_idx])
 
@@ -91,6 +104,8 @@ if __name__ == '__main__':
     for itr in range(0, num_iter):
 
         optimizer.zero_grad()
+        if optimizer_hidden is not None:
+            optimizer_hidden.zero_grad()
 
         # Simulate
         batch_t, batch_x0_hidden, batch_u, batch_y, batch_x_hidden = get_batch(batch_size, seq_len)
@@ -121,6 +136,8 @@ if __name__ == '__main__':
         # Optimize
         loss.backward()
         optimizer.step()
+        if optimizer_hidden is not None:
+            optimizer_hidden.step()
 
     train_time = time.time() - start_time
     print(f"\nTrain time: {train_time:.2f}") # 182 seconds
@@ -0,0 +1,136 @@
+import os
+import pandas as pd
+import numpy as np
+import torch
+import torch.optim as optim
+import time
+import matplotlib.pyplot as plt
+import sys
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssfitter import NeuralStateSpaceSimulator
+from torchid.ssmodels import CTSNeuralStateSpaceModel
+from torchid.shooting import NodeShootingLoss, get_shooting_nodes
+from torchid.util import get_torch_random_batch_start
+
+
+if __name__ == '__main__':
+
+    # Set seed for reproducibility
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    # Overall parameters
+    num_iter = 10000  # gradient-based optimization steps
+    seq_len = 64  # length m of the shooting segments
+    batch_size = 8  # number of shooting segments simulated at each iteration
+    alpha = 0.5  # fit/consistency trade-off constant
+    lr = 1e-4  # learning rate
+    test_freq = 100  # print message every test_freq iterations
+
+    # Load dataset
+    df_data = pd.read_csv(os.path.join("data", "dataBenchmark.csv"))
+    u_id = np.array(df_data[['uEst']]).astype(np.float32)
+    y_id = np.array(df_data[['yEst']]).astype(np.float32)
+    ts = df_data['Ts'][0].astype(np.float32)
+    time_exp = np.arange(y_id.size).astype(np.float32)*ts
+
+    x_est = np.zeros((time_exp.shape[0], 2), dtype=np.float32)
+    x_est[:, 0] = np.copy(y_id[:, 0])
+
+    # Hidden state variable, at the shooting nodes only. It is an optimization variable
+    x_hidden_fit = get_shooting_nodes(torch.tensor(x_est, dtype=torch.float32), seq_len).requires_grad_(True)
+    y_fit = y_id
+    u_fit = u_id
+    u_fit_torch = torch.tensor(u_fit)
+    y_fit_torch = torch.tensor(y_fit)
+
+    # Setup neural model structure
+    ss_model = CTSNeuralStateSpaceModel(n_x=2, n_u=1, n_feat=64, ts=ts)
+    nn_solution = NeuralStateSpaceSimulator(ss_model)
+
+    # Multiple shooting criterion with the hidden state at the (N-1)//seq_len + 1 shooting nodes only: the hidden
+    # variables take O(N/seq_len) memory, instead of O(N) as in CTS_SS_fit_multiple_shooting.py
+    criterion = NodeShootingLoss(nn_solution, u_fit_torch, y_fit_torch, x_hidden_fit,
+                                 seq_len=seq_len, alpha=alpha, y_idx=[0])
+    print(f"Shooting segments: {criterion.num_segments} of {seq_len} steps, "
+          f"{x_hidden_fit.numel()} hidden variables instead of {x_est.size}")
+
+    # Setup optimizer
+    params_net = list(nn_solution.ss_model.parameters())
+    params_hidden = [x_hidden_fit]
+    optimizer = optim.Adam([
+        {'params': params_net,    'lr': lr},
+        {'params': params_hidden, 'lr': 10*lr},
+    ], lr=lr)
+
+    LOSS_TOT = []
+    LOSS_FIT = []
+    LOSS_CONSISTENCY = []
+    start_time = time.time()
+    # Training loop
+    for itr in range(0, num_iter):
+
+        optimizer.zero_grad()
+
+        # Simulate a random batch of shooting segments and compute the losses
+        segment_idx = get_torch_random_batch_start(criterion.num_segments, batch_size)
+        loss, loss_fit, loss_consistency = criterion(segment_idx)
+
+        LOSS_TOT.append(loss.item())
+        LOSS_FIT.append(loss_fit.item())
+        LOSS_CONSISTENCY.append(loss_consistency.item())
+        if itr % test_freq == 0:
+            print(f'Iter {itr} | Tradeoff Loss {loss:.4f}   Consistency Loss {loss_consistency:.4f}   Fit Loss {loss_fit:.4f}')
+
+        # Optimize
+        loss.backward()
+        optimizer.step()
+
+    train_time = time.time() - start_time
+    print(f"\nTrain time: {train_time:.2f}")
+
+    # Save model
+    if not os.path.exists("models"):
+        os.makedirs("models")
+
+    model_filename = f"model_SS_nodes_{seq_len}step.pkl"
+    hidden_filename = f"hidden_SS_nodes_{seq_len}step.pkl"
+
+    torch.save(nn_solution.ss_model.state_dict(), os.path.join("models", model_filename))
+    torch.save(x_hidden_fit, os.path.join("models", hidden_filename))
+
+    # Plot figures
+    if not os.path.exists("fig"):
+        os.makedirs("fig")
+
+    # Loss plot
+    fig, ax = plt.subplots(1, 1)
+    ax.plot(LOSS_TOT, 'k', label='TOT')
+    ax.plot(LOSS_CONSISTENCY, 'r', label='CONSISTENCY')
+    ax.plot(LOSS_FIT, 'b', label='FIT')
+    ax.grid(True)
+    ax.legend(loc='upper right')
+    ax.set_ylabel("Loss (-)")
+    ax.set_xlabel("Iteration (-)")
+
+    fig_name = f"CTS_SS_loss_nodes_{seq_len}step.pdf"
+    fig.savefig(os.path.join("fig", fig_name), bbox_inches='tight')
+
+    # Open-loop simulation over the whole record, from the estimated initial state
+    x0_torch_val = x_hidden_fit[0, :].detach()
+    with torch.no_grad():
+        x_sim_torch = nn_solution.f_sim(x0_torch_val[None, :], u_fit_torch[:, None, :])
+        y_sim = x_sim_torch[:, 0, [0]].numpy()
+
+    # Simulation plot
+    fig, ax = plt.subplots(2, 1, sharex=True, figsize=(6, 7.5))
+    ax[0].plot(time_exp, y_fit, 'k', label='$y_{\mathrm{meas}}$')
+    ax[0].plot(time_exp, y_sim, 'r', label='$\hat y_{\mathrm{sim}}$')
+    ax[0].legend(loc='upper right')
+    ax[0].grid(True)
+    ax[0].set_ylabel("Voltage (V)")
+
+    ax[1].plot(time_exp, u_id, 'k', label='$u_{in}$')
+    ax[1].set_xlabel("Time (s)")
+    ax[1].set_ylabel("Voltage (V)")
+    ax[1].grid(True)
@@ -23,6 +23,7 @@ if __name__ == '__main__':
     num_iter = 10000  # gradient-based optimization steps
     lr = 1e-4  # learning rate
     test_freq = 10  # print message every test_freq iterations
+    checkpoint_every = 256  # checkpointed backward over segments of checkpoint_every steps. None: full autograd graph
 
     # Load dataset
     df_data = pd.read_csv(os.path.join("data", "dataBenchmark.csv"))
@@ -81,7 +82,7 @@ if __name__ == '__main__':
         x0_torch = x_hidden_fit[0, :]
 
         # Perform open-loop simulation
-        x_sim = nn_solution.f_sim(x0_torch, u_fit_torch)
+        x_sim = nn_solution.f_sim(x0_torch, u_fit_torch, checkpoint_every=checkpoint_every)
 
         # Compute fit loss
         err_fit = x_sim[:, [0]] - y_fit_torch
@@ -0,0 +1,67 @@
+import pandas as pd
+import numpy as np
+import torch
+import multiprocessing
+import resource
+import os
+import sys
+import time
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssfitter import NeuralStateSpaceSimulator
+from torchid.ssmodels import CTSNeuralStateSpaceModel
+
+# Compare the peak memory and the time of one simulation error gradient (open-loop simulation over the whole record,
+# forward and backward pass) with the full autograd graph and with checkpointed segments of checkpoint_every steps.
+# The record is obtained by repeating the CTS benchmark input. Each case runs in a fresh process, so that the increase
+# of peak resident memory (ru_maxrss) can be attributed to the gradient computation only. Linux only.
+
+
+def peak_memory_MB():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is in kB on Linux
+
+
+def run_case(checkpoint_every, num_samples, queue):
+
+    np.random.seed(0)
+    torch.manual_seed(0)
+    torch.set_num_threads(1)
+
+    df_data = pd.read_csv(os.path.join("data", "dataBenchmark.csv"))
+    u_id = np.array(df_data[['uEst']]).astype(np.float32)
+    ts = df_data['Ts'][0].astype(np.float32)
+    u = np.tile(u_id, (num_samples // u_id.shape[0] + 1, 1))[:num_samples]
+    u_torch = torch.tensor(u)
+
+    ss_model = CTSNeuralStateSpaceModel(n_x=2, n_u=1, n_feat=64, ts=ts)
+    nn_solution = NeuralStateSpaceSimulator(ss_model)
+    x0 = torch.zeros(2, requires_grad=True)
+
+    # Warm up on a short sequence (allocator and thread pool initialization)
+    x_sim = nn_solution.f_sim(x0, u_torch[:8], checkpoint_every=checkpoint_every)
+    torch.mean(x_sim**2).backward()
+
+    mem_start = peak_memory_MB()
+    time_start = time.perf_counter()
+    x_sim = nn_solution.f_sim(x0, u_torch, checkpoint_every=checkpoint_every)
+    loss = torch.mean(x_sim**2)
+    loss.backward()
+    time_grad = time.perf_counter() - time_start
+    mem_grad = peak_memory_MB() - mem_start
+
+    queue.put((mem_grad, time_grad))
+
+
+if __name__ == '__main__':
+
+    num_samples = 100000  # length N of the simulated record
+    CHECKPOINT_EVERY = [None, 10000, 1000, 100]
+
+    ctx = multiprocessing.get_context('spawn')
+    for checkpoint_every in CHECKPOINT_EVERY:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_case, args=(checkpoint_every, num_samples, queue))
+        proc.start()
+        mem_grad, time_grad = queue.get()
+        proc.join()
+        print(f"checkpoint_every {str(checkpoint_every):>5s} | N {num_samples} | "
+              f"peak memory increase {mem_grad:8.1f} MB | time {time_grad:.2f} s")
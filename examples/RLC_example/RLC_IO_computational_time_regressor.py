@@ -0,0 +1,91 @@
+import numpy as np
+import torch
+import matplotlib.pyplot as plt
+import os
+import sys
+import time
+sys.path.append(os.path.join("..", ".."))
+from torchid.iofitter import NeuralIOSimulator
+from torchid.iomodels import NeuralIOModel
+
+# Compare the computational time of the IO multi-step simulation with the circular regressor buffer
+# (current implementation) and with the in-place shift of the regressor (previous implementation)
+# for increasing number of lags n_a = n_b
+
+
+def f_sim_multistep_shift(io_model, batch_u, batch_y_seq, batch_u_seq):
+    """ Reference implementation: shift the whole regressor at each step """
+    batch_y_seq = batch_y_seq.clone()
+    batch_u_seq = batch_u_seq.clone()
+    Y_sim_list = []
+    for i in range(batch_u.shape[1]):
+        phi = torch.cat((batch_y_seq, batch_u_seq), -1)
+        yi = io_model(phi)
+        Y_sim_list += [yi]
+
+        # y shift
+        batch_y_seq[:, 1:] = batch_y_seq[:, 0:-1].clone()
+        batch_y_seq[:, [0]] = yi[:]
+
+        # u shift
+        batch_u_seq[:, 1:] = batch_u_seq[:, 0:-1].clone()
+        batch_u_seq[:, [0]] = batch_u[:, i]
+
+    Y_sim = torch.stack(Y_sim_list, 1)
+    return Y_sim
+
+
+if __name__ == '__main__':
+
+    # Set seed for reproducibility
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    # Overall parameters
+    batch_size = 32  # number of subsequences q
+    seq_len = 64  # subsequence length m
+    num_rep = 20  # repetitions for each number of lags
+    N_LAGS = [1, 2, 4, 8, 16, 32, 64, 128]  # n_a = n_b
+
+    TIME_SHIFT = []
+    TIME_BUFFER = []
+
+    for n_lags in N_LAGS:
+        io_model = NeuralIOModel(n_a=n_lags, n_b=n_lags, n_feat=64)
+        io_solution = NeuralIOSimulator(io_model)
+
+        batch_u = torch.randn(batch_size, seq_len, 1)
+        batch_y_seq = torch.randn(batch_size, n_lags, requires_grad=True)  # hidden initial conditions
+        batch_u_seq = torch.randn(batch_size, n_lags)
+
+        # Same results with both implementations
+        with torch.no_grad():
+            batch_y_sim_shift = f_sim_multistep_shift(io_model, batch_u, batch_y_seq, batch_u_seq)
+            batch_y_sim = io_solution.f_sim_multistep(batch_u, batch_y_seq, batch_u_seq)
+            assert torch.allclose(batch_y_sim_shift, batch_y_sim)
+
+        for f_sim, TIME in [(lambda: f_sim_multistep_shift(io_model, batch_u, batch_y_seq, batch_u_seq), TIME_SHIFT),
+                            (lambda: io_solution.f_sim_multistep(batch_u, batch_y_seq, batch_u_seq), TIME_BUFFER)]:
+            time_start = time.perf_counter()
+            for _ in range(num_rep):
+                batch_y_sim = f_sim()
+                loss = torch.mean(batch_y_sim ** 2)
+                loss.backward()
+            TIME.append((time.perf_counter() - time_start) / num_rep)
+            io_model.zero_grad()
+
+    TIME_SHIFT = np.array(TIME_SHIFT)
+    TIME_BUFFER = np.array(TIME_BUFFER)
+    for idx, n_lags in enumerate(N_LAGS):
+        print(f'n_a = n_b = {n_lags:3d} | shift {TIME_SHIFT[idx]*1e3:.2f} ms  '
+              f'circular buffer {TIME_BUFFER[idx]*1e3:.2f} ms (x{TIME_SHIFT[idx]/TIME_BUFFER[idx]:.2f})')
+
+    # Plot
+    fig, ax = plt.subplots(1, 1)
+    ax.plot(N_LAGS, TIME_SHIFT*1e3, '*r', label='Regressor shift')
+    ax.plot(N_LAGS, TIME_BUFFER*1e3, '*b', label='Circular buffer')
+    ax.set_xscale('log', base=2)
+    ax.set_xlabel("Number of lags $n_a = n_b$ (-)")
+    ax.set_ylabel("Time forward and backward pass (ms)")
+    ax.legend()
+    ax.grid(True)
@@ -6,11 +6,11 @@ import time
 import matplotlib.pyplot as plt
 import os
 import sys
-import scipy.linalg
 
 sys.path.append(os.path.join("..", '..'))
 from torchid.iofitter import NeuralIOSimulator
 from torchid.iomodels import NeuralIOModel
+from torchid.util import get_torch_io_regressor
 
 
 if __name__ == '__main__':
@@ -58,9 +58,7 @@ if __name__ == '__main__':
     u_fit = u[0:n_fit]
     y_fit = y[0:n_fit]
     y_meas_fit = y_noise[0:n_fit]
-    phi_fit_y = scipy.linalg.toeplitz(y_meas_fit, y_meas_fit[0:n_a])[n_max - 1:-1, :] # regressor 1
-    phi_fit_u = scipy.linalg.toeplitz(u_fit, u_fit[0:n_a])[n_max - 1:-1, :]
-    phi_fit = np.hstack((phi_fit_y, phi_fit_u))
+    phi_fit_torch = get_torch_io_regressor(torch.from_numpy(y_meas_fit), torch.from_numpy(u_fit), n_a, n_b)
 
     # Neglect initial values
     y_fit = y_fit[n_max:,:]
@@ -68,7 +66,6 @@ if __name__ == '__main__':
     u_fit = u_fit[n_max:, :]
 
     # Build fit data
-    phi_fit_torch = torch.from_numpy(phi_fit)
     y_meas_fit_torch = torch.from_numpy(y_meas_fit)
 
     # Setup neural model structure
@@ -7,9 +7,9 @@ import matplotlib.pyplot as plt
 import os
 import sys
 sys.path.append(os.path.join("..", ".."))
-import scipy.linalg
 from torchid.iofitter import NeuralIOSimulator
 from torchid.iomodels import NeuralIOModel
+from torchid.util import get_torch_regressor_mat
 
 if __name__ == '__main__':
 
@@ -65,7 +65,7 @@ if __name__ == '__main__':
     y_hidden_fit_init_true = np.vstack((np.zeros(n_a).reshape(-1, 1), np.copy(y_fit))).astype(np.float32)  # not used, just for reference
     v_fit = np.copy(u_fit)
     v_fit = np.vstack((np.zeros(n_b).reshape(-1, 1), v_fit)).astype(np.float32)
-    phi_fit_u = scipy.linalg.toeplitz(v_fit, v_fit[0:n_a])[n_max - 1:-1, :]  # used for the initial conditions on u
+    phi_fit_u = get_torch_regressor_mat(torch.from_numpy(v_fit), n_b)  # used for the initial conditions on u
 
     # To pytorch tensors
     y_hidden_fit_torch = torch.tensor(y_hidden_fit_init, requires_grad=True)  # hidden state. It is an optimization variable!
@@ -98,7 +98,7 @@ if __name__ == '__main__':
 
         # Extract batch data
         batch_y_hidden_initial_cond = y_hidden_fit_torch[[batch_idx_initial_cond_y + n_a]].squeeze()  # hidden y initial condition for all batch instances
-        batch_u_initial_cond = torch.tensor(phi_fit_u[batch_start])  # u initial condition for all batch instances
+        batch_u_initial_cond = phi_fit_u[batch_start]  # u initial condition for all batch instances
         batch_y_meas = torch.tensor(y_meas_fit[batch_idx])
         batch_u = torch.tensor(u_fit[batch_idx])
         batch_y_hidden = y_hidden_fit_torch[[batch_idx + n_a]]
@@ -116,7 +116,7 @@ if __name__ == '__main__':
 
         # Extract batch data
         batch_y_hidden_initial_cond = y_hidden_fit_torch[[batch_idx_initial_cond_y + n_a]].squeeze()  # hidden y initial condition for all batch instances
-        batch_u_initial_cond = torch.tensor(phi_fit_u[batch_start])  # u initial condition for all batch instances
+        batch_u_initial_cond = phi_fit_u[batch_start]  # u initial condition for all batch instances
         batch_y_meas = torch.tensor(y_meas_fit[batch_idx]) # batch measured output
         batch_u = torch.tensor(u_fit[batch_idx])           # batch input
         batch_y_hidden = y_hidden_fit_torch[[batch_idx + n_a]]    # batch hidden output
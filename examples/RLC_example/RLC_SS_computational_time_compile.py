@@ -0,0 +1,67 @@
+import os
+import pandas as pd
+import numpy as np
+import torch
+import time
+import sys
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssfitter import NeuralStateSpaceSimulator
+from torchid.ssmodels import NeuralStateSpaceModel
+from torchid.training import NeuralStateSpaceTrainer
+
+# Time per training iteration of NeuralStateSpaceTrainer (multi-step simulation error, settings of
+# RLC_SS_fit_multistep.py) in eager mode and with the whole training step compiled (compile=True).
+# The compilation time is paid by the first compiled iteration and it is reported separately.
+# Both trainers start from the same model and draw the same batches, thus their losses coincide up to rounding errors.
+
+if __name__ == '__main__':
+
+    # Set seed for reproducibility
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    # Overall parameters
+    num_iter = 500  # timed iterations
+    seq_len = 64  # subsequence length m
+    t_fit = 2e-3  # fitting on t_fit ms of data
+    lr = 1e-3  # learning rate
+
+    # Column names in the dataset
+    COL_T = ['time']
+    COL_X = ['V_C', 'I_L']
+    COL_U = ['V_IN']
+
+    # Load dataset
+    df_X = pd.read_csv(os.path.join("data", "RLC_data_id.csv"))
+    t = np.array(df_X[COL_T], dtype=np.float32)
+    x = np.array(df_X[COL_X], dtype=np.float32)
+    u = np.array(df_X[COL_U], dtype=np.float32)
+
+    # Get fit data
+    Ts = float(t[1, 0] - t[0, 0])
+    n_fit = int(t_fit // Ts)
+    batch_size = n_fit // seq_len
+    u_torch_fit = torch.from_numpy(u[0:n_fit])
+    x_meas_torch_fit = torch.from_numpy(x[0:n_fit])
+
+    TIME = {}
+    LOSS = {}
+    for compile in [False, True]:
+        torch.manual_seed(0)
+        nn_solution = NeuralStateSpaceSimulator(NeuralStateSpaceModel(n_x=2, n_u=1, n_feat=64))
+        trainer = NeuralStateSpaceTrainer(nn_solution, u_torch_fit, x_meas_torch_fit, mode='multistep',
+                                          seq_len=seq_len, batch_size=batch_size, lr=lr, lr_hidden=10*lr,
+                                          compile=compile, test_freq=0)
+        time_start = time.perf_counter()
+        trainer.train(1)  # warm up (compilation)
+        time_first = time.perf_counter() - time_start
+
+        time_start = time.perf_counter()
+        trainer.train(num_iter)
+        TIME[compile] = (time.perf_counter() - time_start) / num_iter
+        LOSS[compile] = trainer.get_loss()
+        if compile:
+            print(f"Compilation time: {time_first:.1f} s")
+
+    print(f"q {batch_size} m {seq_len} | eager {TIME[False]*1e3:.2f} ms/iter | compiled {TIME[True]*1e3:.2f} ms/iter "
+          f"(x{TIME[False]/TIME[True]:.2f}) | max loss difference {np.max(np.abs(LOSS[True] - LOSS[False])):.1e}")
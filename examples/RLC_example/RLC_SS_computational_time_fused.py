@@ -0,0 +1,68 @@
+import numpy as np
+import torch
+import os
+import sys
+import time
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssfitter import NeuralStateSpaceSimulator
+from torchid.ssmodels import NeuralStateSpaceModel, NeuralStateSpaceModelLin, DeepNeuralStateSpaceModel,\
+    StateSpaceModelLin, CartPoleStateSpaceModel, CartPoleDeepStateSpaceModel, CTSNeuralStateSpaceModel
+
+# Microbenchmark of the multi-step simulation with the fused step function of the models (fused=True, default)
+# and with the model forward (fused=False), for each model class of torchid.ssmodels. The computational time
+# is measured with and without gradients (forward + backward pass, forward pass only).
+
+if __name__ == '__main__':
+
+    # Set seed for reproducibility
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    # Overall parameters
+    batch_size = 32  # number of subsequences q
+    seq_len = 256  # subsequence length m
+    num_rep = 20  # repetitions for each case
+    Ts = 1e-2
+
+    A_nominal = np.array([[0.0, 1.0], [-1.0, -0.1]]) * Ts
+    B_nominal = np.array([[0.0], [1.0]]) * Ts
+    MODELS = [NeuralStateSpaceModel(n_x=2, n_u=1, n_feat=64),
+              NeuralStateSpaceModelLin(A_nominal, B_nominal),
+              DeepNeuralStateSpaceModel(n_x=2, n_u=1, n_feat=64),
+              StateSpaceModelLin(A_nominal, B_nominal),
+              CartPoleStateSpaceModel(Ts),
+              CartPoleDeepStateSpaceModel(Ts),
+              CTSNeuralStateSpaceModel(n_x=2, n_u=1, n_feat=64, ts=Ts)]
+
+    for ss_model in MODELS:
+        n_x = 4 if isinstance(ss_model, (CartPoleStateSpaceModel, CartPoleDeepStateSpaceModel)) else 2
+        batch_x0 = torch.randn(batch_size, n_x, requires_grad=True)
+        batch_u = torch.randn(batch_size, seq_len, 1)
+
+        TIME = {}
+        for fused in [False, True]:
+            nn_solution = NeuralStateSpaceSimulator(ss_model, fused=fused)
+
+            time_start = time.perf_counter()
+            for _ in range(num_rep):
+                batch_x_sim = nn_solution.f_sim_multistep(batch_x0, batch_u)
+                loss = torch.mean(batch_x_sim ** 2)
+                loss.backward()
+            TIME[fused, True] = (time.perf_counter() - time_start) / num_rep
+
+            with torch.no_grad():
+                time_start = time.perf_counter()
+                for _ in range(num_rep):
+                    nn_solution.f_sim_multistep(batch_x0, batch_u)
+                TIME[fused, False] = (time.perf_counter() - time_start) / num_rep
+
+        with torch.no_grad():
+            batch_x_sim = NeuralStateSpaceSimulator(ss_model, fused=False).f_sim_multistep(batch_x0, batch_u)
+            batch_x_sim_fused = NeuralStateSpaceSimulator(ss_model, fused=True).f_sim_multistep(batch_x0, batch_u)
+            err = torch.max(torch.abs(batch_x_sim - batch_x_sim_fused))
+
+        print(f"{type(ss_model).__name__:>28s} | "
+              f"grad {TIME[False, True]*1e3:6.1f} -> {TIME[True, True]*1e3:6.1f} ms "
+              f"(x{TIME[False, True]/TIME[True, True]:.2f}) | "
+              f"no grad {TIME[False, False]*1e3:6.1f} -> {TIME[True, False]*1e3:6.1f} ms "
+              f"(x{TIME[False, False]/TIME[True, False]:.2f}) | max abs difference {err:.1e}")
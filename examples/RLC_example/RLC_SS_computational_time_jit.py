@@ -0,0 +1,102 @@
+import pandas as pd
+import numpy as np
+import torch
+import matplotlib.pyplot as plt
+import os
+import sys
+import time
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssfitter import NeuralStateSpaceSimulator
+from torchid.ssmodels import NeuralStateSpaceModel
+from torchid.util import get_random_batch_idx
+
+# Compare the computational time of the eager and the TorchScript-compiled multi-step simulation
+
+if __name__ == '__main__':
+
+    # Set seed for reproducibility
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    # Overall parameters
+    batch_size = 32  # number of subsequences q
+    num_rep = 20  # repetitions for each sequence length
+    SEQ_LEN = [16, 32, 64, 128, 256]  # subsequence lengths m
+
+    # Column names in the dataset
+    COL_X = ['V_C', 'I_L']
+    COL_U = ['V_IN']
+
+    # Load dataset
+    df_X = pd.read_csv(os.path.join("data", "RLC_data_id.csv"))
+    x = np.array(df_X[COL_X], dtype=np.float32)
+    u = np.array(df_X[COL_U], dtype=np.float32)
+    num_samples = x.shape[0]
+
+    # Setup neural model structure, eager and compiled simulators share the same parameters
+    ss_model = NeuralStateSpaceModel(n_x=2, n_u=1, n_feat=64)
+    nn_solution = NeuralStateSpaceSimulator(ss_model)
+    nn_solution_jit = NeuralStateSpaceSimulator(ss_model, jit=True)
+
+    TIME_EAGER_NOGRAD = []
+    TIME_JIT_NOGRAD = []
+    TIME_EAGER_GRAD = []
+    TIME_JIT_GRAD = []
+
+    for seq_len in SEQ_LEN:
+        batch_start, batch_idx = get_random_batch_idx(num_samples, batch_size, seq_len)
+        batch_x0 = torch.tensor(x[batch_start])
+        batch_u = torch.tensor(u[batch_idx])
+        batch_x = torch.tensor(x[batch_idx])
+
+        # Same results in eager and compiled mode
+        with torch.no_grad():
+            batch_x_sim = nn_solution.f_sim_multistep(batch_x0, batch_u)
+            batch_x_sim_jit = nn_solution_jit.f_sim_multistep(batch_x0, batch_u)
+            assert torch.allclose(batch_x_sim, batch_x_sim_jit)
+
+        for solution, TIME_NOGRAD, TIME_GRAD in [(nn_solution, TIME_EAGER_NOGRAD, TIME_EAGER_GRAD),
+                                                 (nn_solution_jit, TIME_JIT_NOGRAD, TIME_JIT_GRAD)]:
+
+            # Warm up (the TorchScript profiling executor optimizes the graph during the first runs)
+            for _ in range(3):
+                batch_x_sim = solution.f_sim_multistep(batch_x0, batch_u)
+                torch.mean((batch_x_sim - batch_x) ** 2).backward()
+            ss_model.zero_grad()
+
+            time_start = time.perf_counter()
+            with torch.no_grad():
+                for _ in range(num_rep):
+                    batch_x_sim = solution.f_sim_multistep(batch_x0, batch_u)
+            TIME_NOGRAD.append((time.perf_counter() - time_start) / num_rep)
+
+            time_start = time.perf_counter()
+            for _ in range(num_rep):
+                batch_x_sim = solution.f_sim_multistep(batch_x0, batch_u)
+                loss = torch.mean((batch_x_sim - batch_x) ** 2)
+                loss.backward()
+            TIME_GRAD.append((time.perf_counter() - time_start) / num_rep)
+            ss_model.zero_grad()
+
+    TIME_EAGER_NOGRAD = np.array(TIME_EAGER_NOGRAD)
+    TIME_JIT_NOGRAD = np.array(TIME_JIT_NOGRAD)
+    TIME_EAGER_GRAD = np.array(TIME_EAGER_GRAD)
+    TIME_JIT_GRAD = np.array(TIME_JIT_GRAD)
+
+    for idx, seq_len in enumerate(SEQ_LEN):
+        print(f'seq_len {seq_len:4d} | '
+              f'forward eager {TIME_EAGER_NOGRAD[idx]*1e3:.2f} ms  jit {TIME_JIT_NOGRAD[idx]*1e3:.2f} ms '
+              f'(x{TIME_EAGER_NOGRAD[idx]/TIME_JIT_NOGRAD[idx]:.2f}) | '
+              f'forward+backward eager {TIME_EAGER_GRAD[idx]*1e3:.2f} ms  jit {TIME_JIT_GRAD[idx]*1e3:.2f} ms '
+              f'(x{TIME_EAGER_GRAD[idx]/TIME_JIT_GRAD[idx]:.2f})')
+
+    # Plot
+    fig, ax = plt.subplots(1, 1)
+    ax.plot(SEQ_LEN, TIME_EAGER_NOGRAD*1e3, '*b', label='Forward pass, eager')
+    ax.plot(SEQ_LEN, TIME_JIT_NOGRAD*1e3, 'ob', label='Forward pass, TorchScript')
+    ax.plot(SEQ_LEN, TIME_EAGER_GRAD*1e3, '*r', label='Forward and backward pass, eager')
+    ax.plot(SEQ_LEN, TIME_JIT_GRAD*1e3, 'or', label='Forward and backward pass, TorchScript')
+    ax.set_xlabel("Sequence length (-)")
+    ax.set_ylabel("Time (ms)")
+    ax.legend()
+    ax.grid(True)
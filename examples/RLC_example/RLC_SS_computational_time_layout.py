@@ -0,0 +1,91 @@
+import numpy as np
+import torch
+import os
+import sys
+import time
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssfitter import NeuralStateSpaceSimulator
+from torchid.ssmodels import NeuralStateSpaceModel
+from torchid.iofitter import NeuralIOSimulator
+from torchid.iomodels import NeuralIOModel
+from torchid.training import NeuralStateSpaceTrainer
+
+# Microbenchmark of the batch-first (q, m, n) and of the time-major (m, q, n) layout (batch_first=False).
+# In the time-major layout, the input of each step is a contiguous slice of the batch, and the simulated state
+# of each step is written to a contiguous slice of the result. The multi-step simulation of the SS and IO models
+# is timed with and without gradients for several batch sizes q and subsequence lengths m, then a whole training
+# iteration of NeuralStateSpaceTrainer (batch extraction, simulation, loss, backward pass and optimizer step).
+
+if __name__ == '__main__':
+
+    # Set seed for reproducibility
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    num_rep = 20  # repetitions for each case
+    CASES = [(32, 64), (32, 256), (256, 64), (1024, 128)]  # (q, m)
+
+    def synchronize():
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+
+    def time_call(fun):
+        fun()  # warm up
+        synchronize()
+        time_start = time.perf_counter()
+        for _ in range(num_rep):
+            fun()
+        synchronize()
+        return (time.perf_counter() - time_start) / num_rep
+
+    ss_model = NeuralStateSpaceModel(n_x=2, n_u=1, n_feat=64).to(device)
+    nn_solution = NeuralStateSpaceSimulator(ss_model)
+    io_model = NeuralIOModel(n_a=2, n_b=2, n_feat=64).to(device)
+    io_solution = NeuralIOSimulator(io_model)
+
+    print(f"Device: {device}")
+    for batch_size, seq_len in CASES:
+        batch_x0 = torch.randn(batch_size, 2, device=device, requires_grad=True)
+        batch_y_seq = torch.randn(batch_size, 2, device=device, requires_grad=True)
+        batch_u_seq = torch.randn(batch_size, 2, device=device)
+        U = {True: torch.randn(batch_size, seq_len, 1, device=device)}
+        U[False] = U[True].transpose(0, 1).contiguous()
+
+        TIME = {}
+        for batch_first in [True, False]:
+            def ss_grad():
+                nn_solution.f_sim_multistep(batch_x0, U[batch_first], batch_first=batch_first).square().mean().backward()
+
+            def io_grad():
+                io_solution.f_sim_multistep(U[batch_first], batch_y_seq, batch_u_seq,
+                                            batch_first=batch_first).square().mean().backward()
+
+            def ss_nograd():
+                with torch.no_grad():
+                    nn_solution.f_sim_multistep(batch_x0, U[batch_first], batch_first=batch_first)
+
+            TIME['SS', True, batch_first] = time_call(ss_grad)
+            TIME['SS', False, batch_first] = time_call(ss_nograd)
+            TIME['IO', True, batch_first] = time_call(io_grad)
+
+        for model, grad in [('SS', True), ('SS', False), ('IO', True)]:
+            time_bf, time_tm = TIME[model, grad, True], TIME[model, grad, False]
+            print(f"{model} {'grad' if grad else 'no grad':>7s} | q {batch_size:4d} m {seq_len:4d} | "
+                  f"batch-first {time_bf*1e3:6.2f} ms | time-major {time_tm*1e3:6.2f} ms (x{time_bf/time_tm:.2f})")
+
+    # Whole training iteration
+    num_samples = 100000
+    u = torch.randn(num_samples, 1, device=device)
+    y = torch.randn(num_samples, 2, device=device)
+    for batch_size, seq_len in CASES:
+        TIME = {}
+        for batch_first in [True, False]:
+            torch.manual_seed(0)
+            trainer = NeuralStateSpaceTrainer(NeuralStateSpaceSimulator(NeuralStateSpaceModel(2, 1, 64).to(device)),
+                                              u, y, mode='multistep', seq_len=seq_len, batch_size=batch_size,
+                                              sparse_hidden=True, batch_first=batch_first, test_freq=0)
+            trainer.train(1)  # warm up
+            TIME[batch_first] = time_call(lambda: trainer.train(1))
+        print(f"Training iteration | q {batch_size:4d} m {seq_len:4d} | batch-first {TIME[True]*1e3:6.2f} ms | "
+              f"time-major {TIME[False]*1e3:6.2f} ms (x{TIME[True]/TIME[False]:.2f})")
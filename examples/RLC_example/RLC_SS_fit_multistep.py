@@ -2,13 +2,14 @@ import os
 import pandas as pd
 import numpy as np
 import torch
-import torch.optim as optim
 import time
 import matplotlib.pyplot as plt
 import sys
 sys.path.append(os.path.join("..", ".."))
 from torchid.ssfitter import NeuralStateSpaceSimulator
 from torchid.ssmodels import NeuralStateSpaceModel
+from torchid.training import NeuralStateSpaceTrainer
+from torchid.encoders import InitialStateEncoder
 
 if __name__ == '__main__':
 
@@ -24,6 +25,9 @@ if __name__ == '__main__':
     lr = 1e-3  # learning rate
     test_freq = 100  # print message every test_freq iterations
     add_noise = True
+    sparse_hidden = False  # if True, only the rows of the hidden state in the batch are updated at each iteration
+    use_encoder = False  # encode the initial state of each subsequence from the n_k previous samples
+    n_k = 10  # number of past samples of the encoder
 
     # Column names in the dataset
     COL_T = ['time']
@@ -66,81 +70,35 @@ if __name__ == '__main__':
     y_true_torch_fit = torch.from_numpy(y_fit)
     x_meas_torch_fit = torch.from_numpy(x_fit)
     time_torch_fit = torch.from_numpy(time_fit)
-    x_hidden_fit = torch.tensor(x_fit, requires_grad=True)  # hidden state is an optimization variable
 
     # Setup neural model structure
     ss_model = NeuralStateSpaceModel(n_x=2, n_u=1, n_feat=64)
     nn_solution = NeuralStateSpaceSimulator(ss_model)
 
-    # Setup optimizer
-    params_net = list(nn_solution.ss_model.parameters())
-    params_hidden = [x_hidden_fit]
-    optimizer = optim.Adam([
-        {'params': params_net,    'lr': lr},
-        {'params': params_hidden, 'lr': 10*lr},
-    ], lr=lr)
-
-    # Batch extraction function
-    def get_batch(batch_size, seq_len):
-
-        # Select batch indexes
-        num_train_samples = x_fit.shape[0]
-        batch_start = np.random.choice(np.arange(num_train_samples - seq_len, dtype=np.int64), batch_size, replace=False)  # batch start indices
-        batch_idx = batch_start[:, np.newaxis] + np.arange(seq_len)  # batch samples indices
-
-        # Extract batch data
-        batch_t = torch.tensor(time_fit[batch_idx])
-        batch_x0_hidden = x_hidden_fit[batch_start, :]
-        batch_x_hidden = x_hidden_fit[[batch_idx]]
-        batch_u = torch.tensor(u_fit[batch_idx])
-        batch_x = torch.tensor(x_fit[batch_idx])
-
-        return batch_t, batch_x0_hidden, batch_u, batch_x, batch_x_hidden
-
-    # Scale loss with respect to the initial one
-    with torch.no_grad():
-        batch_t, batch_x0_hidden, batch_u, batch_x, batch_x_hidden = get_batch(batch_size, seq_len)
-        batch_x_sim = nn_solution.f_sim_multistep(batch_x0_hidden, batch_u)
-        err_init = batch_x_sim - batch_x
-        scale_error = torch.sqrt(torch.mean(err_init**2, dim=(0, 1)))
+    # Setup trainer. The hidden state is an optimization variable, initialized with the measured state.
+    # The subsequences are drawn with np.random (numpy_sampling=True), as in the original training loop.
+    # With sparse_hidden=True, it is optimized by SparseAdam, which updates only the rows in the batch.
+    # With the encoder, there is no hidden state: the initial state of each subsequence is encoded from past data
+    if use_encoder:
+        encoder = InitialStateEncoder(n_x=2, n_y=2, n_u=1, n_k=n_k)
+        trainer = NeuralStateSpaceTrainer(nn_solution, u_torch_fit, x_meas_torch_fit, mode='multistep',
+                                          seq_len=seq_len, batch_size=batch_size, encoder=encoder,
+                                          lr=lr, test_freq=test_freq)
+    else:
+        trainer = NeuralStateSpaceTrainer(nn_solution, u_torch_fit, x_meas_torch_fit, mode='multistep',
+                                          seq_len=seq_len, batch_size=batch_size, numpy_sampling=True, alpha=alpha,
+                                          lr=lr, lr_hidden=10*lr, sparse_hidden=sparse_hidden, test_freq=test_freq)
 
-    LOSS = []
     start_time = time.time()
     # Training loop
-    for itr in range(0, num_iter):
-
-        optimizer.zero_grad()
-
-        # Simulate
-        batch_t, batch_x0_hidden, batch_u, batch_x, batch_x_hidden = get_batch(batch_size, seq_len)
-        batch_x_sim = nn_solution.f_sim_multistep(batch_x0_hidden, batch_u)
-
-        # Compute fit loss
-        err_fit = batch_x_sim - batch_x
-        err_fit_scaled = err_fit/scale_error
-        loss_fit = torch.mean(err_fit_scaled**2)
-
-        # Compute consistency loss
-        err_consistency = batch_x_sim - batch_x_hidden
-        err_consistency_scaled = err_consistency/scale_error
-        loss_consistency = torch.mean(err_consistency_scaled**2)
-
-        # Compute trade-off loss
-        loss = alpha*loss_fit + (1.0-alpha)*loss_consistency
-
-        # Statistics
-        LOSS.append(loss.item())
-        if itr % test_freq == 0:
-            with torch.no_grad():
-                print(f'Iter {itr} | Tradeoff Loss {loss:.4f}   Consistency Loss {loss_consistency:.4f}   Fit Loss {loss_fit:.4f}')
-
-        # Optimize
-        loss.backward()
-        optimizer.step()
+    trainer.train(num_iter)
 
     train_time = time.time() - start_time
     print(f"\nTrain time: {train_time:.2f}") # 182 seconds
 
+    LOSS = trainer.get_loss()[:, 0]
+    x_hidden_fit = trainer.x_hidden
+
     # Save model
     if not os.path.exists("models"):
         os.makedirs("models")
@@ -150,6 +108,8 @@ if __name__ == '__main__':
         model_filename = f"model_SS_{seq_len}step_nonoise.pkl"
 
     torch.save(nn_solution.ss_model.state_dict(), os.path.join("models", model_filename))
+    if use_encoder:
+        torch.save(encoder.state_dict(), os.path.join("models", "encoder_" + model_filename))
 
     t_val = 5e-3
     n_val = int(t_val // Ts)  # x.shape[0]
@@ -162,6 +122,11 @@ if __name__ == '__main__':
     x0_torch_val = torch.from_numpy(x0_val)
     u_torch_val = torch.tensor(input_data_val)
     x_true_torch_val = torch.from_numpy(state_data_val)
+    if use_encoder:  # initial state encoded from the first n_k measured samples, no optimization
+        with torch.no_grad():
+            x0_torch_val = encoder(torch.from_numpy(x_noise[None, :n_k]), u_torch_val[None, :n_k])[0]
+        u_torch_val = u_torch_val[n_k:]
+        x_true_torch_val = x_true_torch_val[n_k:]
 
     with torch.no_grad():
         x_sim_torch_val = nn_solution.f_sim(x0_torch_val, u_torch_val)
@@ -197,17 +162,18 @@ if __name__ == '__main__':
 
     fig.savefig(os.path.join("fig", fig_name), bbox_inches='tight')
 
-    x_hidden_fit_np = x_hidden_fit.detach().numpy()
-    fig, ax = plt.subplots(2, 1, sharex=True)
-    ax[0].plot(x_fit_nonoise[:, 0], 'k', label='True')
-    ax[0].plot(x_fit[:, 0], 'b', label='Measured')
-    ax[0].plot(x_hidden_fit_np[:, 0], 'r', label='Hidden')
-    ax[0].legend()
-    ax[0].grid(True)
-
-    ax[1].plot(x_fit_nonoise[:, 1], 'k', label='True')
-    ax[1].plot(x_fit[:, 1], 'b', label='Measured')
-    ax[1].plot(x_hidden_fit_np[:, 1], 'r', label='Hidden')
-    ax[1].legend()
-    ax[1].grid(True)
+    if not use_encoder:
+        x_hidden_fit_np = x_hidden_fit.detach().numpy()
+        fig, ax = plt.subplots(2, 1, sharex=True)
+        ax[0].plot(x_fit_nonoise[:, 0], 'k', label='True')
+        ax[0].plot(x_fit[:, 0], 'b', label='Measured')
+        ax[0].plot(x_hidden_fit_np[:, 0], 'r', label='Hidden')
+        ax[0].legend()
+        ax[0].grid(True)
+
+        ax[1].plot(x_fit_nonoise[:, 1], 'k', label='True')
+        ax[1].plot(x_fit[:, 1], 'b', label='Measured')
+        ax[1].plot(x_hidden_fit_np[:, 1], 'r', label='Hidden')
+        ax[1].legend()
+        ax[1].grid(True)
 
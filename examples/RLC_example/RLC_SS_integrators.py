@@ -0,0 +1,78 @@
+import pandas as pd
+import numpy as np
+import torch
+import torch.nn as nn
+import os
+import sys
+import time
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssfitter import NeuralStateSpaceSimulator
+from torchid.integrators import DormandPrince
+
+# Compare accuracy and computational time of the integration methods of NeuralStateSpaceSimulator on the true
+# (nonlinear) RLC dynamics, written in the same form as the neural SS models: state increment over one sample.
+# Forward Euler at the original sampling time Ts is compared with all methods at coarser sampling times
+# k*Ts, i.e., k times shorter rollouts. The reference is the Dormand-Prince method with tight tolerances at Ts.
+
+R_val = 3
+L_val = 50e-6
+C_val = 270e-9
+
+
+class RLCStateSpaceModel(nn.Module):
+    """ True RLC dynamics with saturating inductance, x = [V_C, I_L], u = [V_IN]. Returns the state increment
+        over one sample of length Ts (Euler approximation) """
+
+    def __init__(self, Ts):
+        super(RLCStateSpaceModel, self).__init__()
+        self.Ts = Ts
+        self.num_eval = 0
+
+    def forward(self, X, U):
+        self.num_eval += 1
+        v_C = X[..., 0:1]
+        i_L = X[..., 1:2]
+        sat_ratio = (1/np.pi*torch.atan(-5*(i_L.abs() - 5)) + 0.5)*0.9 + 0.1
+        L_mod = L_val*sat_ratio
+        dv_C = i_L/C_val
+        di_L = (-v_C - R_val*i_L + U)/L_mod
+        return torch.cat((dv_C, di_L), -1)*self.Ts
+
+
+if __name__ == '__main__':
+
+    num_samples = 2000  # length of the simulation at the coarsest sampling time
+    batch_size = 16  # number of trajectories simulated in batch with f_sim_multistep
+    K_COARSE = [1, 2, 4, 8]  # sampling time k*Ts
+    METHODS = ['euler', 'midpoint', 'rk4', 'dopri5']
+
+    # Input: measured V_IN, held over the coarsest sampling time (ZOH), so that it is the same signal for all k
+    df_X = pd.read_csv(os.path.join("data", "RLC_data_id.csv"))
+    Ts = float(df_X['time'][1] - df_X['time'][0])
+    k_max = max(K_COARSE)
+    v_in = np.array(df_X['V_IN'], dtype=np.float64)[::k_max][:num_samples]
+    u_coarse = torch.tensor(v_in).reshape(1, -1, 1).repeat(batch_size, 1, 1)
+    u_coarse = u_coarse * torch.linspace(0.5, 1.0, batch_size, dtype=torch.float64).reshape(-1, 1, 1)
+    x0 = torch.zeros((batch_size, 2), dtype=torch.float64)
+
+    # Reference solution, at the instants of the coarsest sampling time
+    u_fine = torch.repeat_interleave(u_coarse, k_max, 1)
+    nn_solution_ref = NeuralStateSpaceSimulator(RLCStateSpaceModel(Ts),
+                                                 method=DormandPrince(rtol=1e-9, atol=1e-9, max_steps=1000))
+    with torch.no_grad():
+        x_ref = nn_solution_ref.f_sim_multistep(x0, u_fine)[:, ::k_max, :]
+    scale_ref = torch.sqrt(torch.mean(x_ref**2, dim=(0, 1)))
+
+    for k in K_COARSE:
+        u_k = torch.repeat_interleave(u_coarse, k_max // k, 1)
+        for method in METHODS:
+            ss_model = RLCStateSpaceModel(k*Ts)
+            nn_solution = NeuralStateSpaceSimulator(ss_model, method=method)
+            time_start = time.perf_counter()
+            with torch.no_grad():
+                x_sim = nn_solution.f_sim_multistep(x0, u_k)[:, ::k_max // k, :]
+            time_sim = time.perf_counter() - time_start
+            err = torch.sqrt(torch.mean((x_sim - x_ref)**2, dim=(0, 1))) / scale_ref
+            err = float(torch.max(err)) if torch.all(torch.isfinite(err)) else float('inf')
+            print(f"Ts x {k} | {method:>8s} | steps {u_k.shape[1]:6d} | evaluations of f {ss_model.num_eval:6d} | "
+                  f"relative RMS error {err:.2e} | time {time_sim:.3f} s")
@@ -1,5 +1,3 @@
-from scipy.integrate import solve_ivp
-from scipy.interpolate import interp1d
 import numpy as np
 import matplotlib.pyplot as plt
 import control.matlab
@@ -7,6 +5,7 @@ import pandas as pd
 import os
 
 from examples.RLC_example.symbolic_RLC import fxu_ODE, fxu_ODE_mod
+from torchid.datagen import simulate
 
 if __name__ == '__main__':
 
@@ -35,26 +34,11 @@ if __name__ == '__main__':
     u = u /np.std(u) * std_input
     
     t_sim = np.arange(N_sim) * Ts
-    u_func = interp1d(t_sim, u, kind='zero', fill_value="extrapolate")
-
-
-    def f_ODE(t,x):
-        u = u_func(t).ravel()
-        return fxu_ODE(t, x, u)
-
-    def f_ODE_mod(t,x):
-        u = u_func(t).ravel()
-        return fxu_ODE_mod(t, x, u)
-
 
+    # Simulate with the input held constant over each sample (ZOH)
     x0 = np.zeros(2)
-    f_ODE(0.0,x0)
-    t_span = (t_sim[0],t_sim[-1])
-    y1 = solve_ivp(f_ODE, t_span, x0, t_eval = t_sim)
-    y2 = solve_ivp(f_ODE_mod, t_span, x0, t_eval = t_sim)
-    
-    x1 = y1.y.T
-    x2 = y2.y.T
+    x1 = simulate(fxu_ODE, x0, u, Ts, method='dopri5')
+    x2 = simulate(fxu_ODE_mod, x0, u, Ts, method='dopri5')
     
     # In[plot]
     fig, ax = plt.subplots(3,1, figsize=(10,10), sharex=True)
@@ -0,0 +1,62 @@
+import pandas as pd
+import numpy as np
+import os
+import sys
+import time
+import numba
+from scipy.integrate import solve_ivp
+from scipy.interpolate import interp1d
+sys.path.append(os.path.join("..", ".."))
+from examples.RLC_example.symbolic_RLC import fxu_ODE_mod
+from torchid.datagen import simulate, simulate_experiments
+
+# Compare the time and the accuracy of the data generation for the nonlinear RLC circuit with solve_ivp and a
+# zero-order-hold input interpolated by interp1d at each evaluation of the ODE (as in RLC_generate_id.py originally)
+# with the compiled integrators of torchid.datagen. Accuracy is measured w.r.t. a tight-tolerance solution.
+# Then, many experiments with different inputs are generated in parallel.
+
+if __name__ == '__main__':
+
+    num_exp = 32  # number of experiments generated in parallel
+
+    df_X = pd.read_csv(os.path.join("data", "RLC_data_id.csv"))
+    Ts = float(df_X['time'][1] - df_X['time'][0])
+    u = np.array(df_X[['V_IN']], dtype=np.float64)
+    N = u.shape[0]
+    t_sim = np.arange(N) * Ts
+    x0 = np.zeros(2)
+
+    x_ref = simulate(fxu_ODE_mod, x0, u, Ts, method='dopri5', rtol=1e-10, atol=1e-12)
+    scale_ref = np.max(np.abs(x_ref), axis=0)
+
+    # solve_ivp with interp1d
+    u_func = interp1d(t_sim, u[:, 0], kind='zero', fill_value="extrapolate")
+
+    def f_ODE(t, x):
+        return fxu_ODE_mod(t, x, u_func(t).ravel())
+
+    time_start = time.perf_counter()
+    x_ivp = solve_ivp(f_ODE, (t_sim[0], t_sim[-1]), x0, t_eval=t_sim).y.T
+    time_ivp = time.perf_counter() - time_start
+    err = np.max(np.max(np.abs(x_ivp - x_ref), axis=0) / scale_ref)
+    print(f"{'solve_ivp + interp1d':>24s} | N {N} | time {time_ivp:.3f} s | max relative error {err:.1e}")
+
+    # Compiled integrators
+    for method, num_substeps in [('euler', 10), ('rk4', 1), ('rk4', 10), ('dopri5', 1)]:
+        simulate(fxu_ODE_mod, x0, u[:2], Ts, method=method, num_substeps=num_substeps)  # compile
+        time_start = time.perf_counter()
+        x_sim = simulate(fxu_ODE_mod, x0, u, Ts, method=method, num_substeps=num_substeps)
+        time_sim = time.perf_counter() - time_start
+        err = np.max(np.max(np.abs(x_sim - x_ref), axis=0) / scale_ref)
+        print(f"{method + ' x ' + str(num_substeps):>24s} | N {N} | time {time_sim:.3f} s | "
+              f"max relative error {err:.1e} | speedup x{time_ivp/time_sim:.0f}")
+
+    # Many experiments in parallel: scaled and shifted copies of the input
+    u_exp = u[np.newaxis, :, :] * np.linspace(0.5, 1.5, num_exp)[:, np.newaxis, np.newaxis]
+    u_exp = np.stack([np.roll(u_exp[i], 100*i, axis=0) for i in range(num_exp)])
+    x0_exp = np.zeros((num_exp, 2))
+    simulate_experiments(fxu_ODE_mod, x0_exp[:1], u_exp[:1, :2], Ts, method='dopri5')  # compile
+    time_start = time.perf_counter()
+    x_exp = simulate_experiments(fxu_ODE_mod, x0_exp, u_exp, Ts, method='dopri5')
+    time_exp = time.perf_counter() - time_start
+    print(f"{num_exp} experiments, dopri5 | N {N} | time {time_exp:.3f} s | {numba.get_num_threads()} threads")
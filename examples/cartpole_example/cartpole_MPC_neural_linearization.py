@@ -0,0 +1,116 @@
+import numpy as np
+import torch
+import torch.nn as nn
+import scipy.sparse as sparse
+import os
+import sys
+import time
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssmodels import CartPoleStateSpaceModel
+from torchid.mpc import SuccessiveLinearizationMPC, linearize_trajectory
+from torchid.datagen import simulate
+from examples.cartpole_example.cartpole_dynamics import f_ODE_jit, M, m, b, ftheta, l, g, RAD_TO_DEG
+
+# Closed-loop simulation of the cart-pole (true dynamics, integrated with ZOH input) controlled by the
+# successive-linearization MPC based on the identified neural model: at each MPC step, the model is rolled out
+# over the horizon Np and linearized along the predicted trajectory with a single batched Jacobian evaluation.
+# The computational time per MPC step is compared with the budget 2*Ts_MPC of the MPC simulation scripts.
+# If the identified model is not available, the MPC uses the true dynamics written as a torch module.
+
+
+class CartPoleTrueModel(nn.Module):
+    """ True cart-pole dynamics (cartpole_dynamics.f_ODE_jit) as a state increment over one sample (Euler) """
+
+    def __init__(self, Ts):
+        super(CartPoleTrueModel, self).__init__()
+        self.Ts = Ts
+        self.dummy = nn.Parameter(torch.zeros(1), requires_grad=False)  # dtype of the model
+
+    def forward(self, X, U):
+        v, theta, omega, F = X[..., 1:2], X[..., 2:3], X[..., 3:4], U[..., 0:1]
+        sin, cos = torch.sin(theta), torch.cos(theta)
+        den = M + m * (1 - cos ** 2)
+        dv = (m * l * sin * omega ** 2 - m * g * sin * cos + m * ftheta * cos * omega + F - b * v) / den
+        domega = ((M + m) * (g * sin - ftheta * omega) - m * l * omega ** 2 * sin * cos - (F - b * v) * cos) / (l * den)
+        return torch.cat((v, dv, omega, domega), -1) * self.Ts
+
+
+if __name__ == '__main__':
+
+    Ts_MPC = 10e-3
+    len_sim = 10.0  # s
+    Np = 100
+    Nc = 50
+
+    model_filename = os.path.join("models", "model_SS_1step_nonoise.pkl")
+    if os.path.exists(model_filename):
+        ss_model = CartPoleStateSpaceModel(Ts=Ts_MPC)  # identified with sampling time 10 ms
+        ss_model.load_state_dict(torch.load(model_filename))
+    else:
+        print(f"{model_filename} not found: MPC based on the true dynamics")
+        ss_model = CartPoleTrueModel(Ts_MPC)
+
+    # Batched linearization vs. one Jacobian per time step
+    x_seq = torch.randn(Np, 4) * 0.1
+    u_seq = torch.randn(Np, 1)
+    linearize_trajectory(ss_model, x_seq, u_seq)
+    time_start = time.perf_counter()
+    A, B = linearize_trajectory(ss_model, x_seq, u_seq)
+    time_batched = time.perf_counter() - time_start
+    time_start = time.perf_counter()
+    for k in range(Np):
+        A_k, B_k = torch.autograd.functional.jacobian(ss_model, (x_seq[k], u_seq[k]))
+    time_loop = time.perf_counter() - time_start
+    print(f"Linearization over Np={Np} steps: batched {time_batched*1e3:.2f} ms, "
+          f"loop {time_loop*1e3:.2f} ms (x{time_loop/time_batched:.0f})")
+
+    # Closed-loop simulation: track a step of the cart position with the pendulum upright
+    nsim = int(len_sim / Ts_MPC)
+    t_ref = np.arange(nsim) * Ts_MPC
+    p_ref = np.where(t_ref > 1.0, 0.5, 0.0)
+    x0 = np.array([0.0, 0.0, 5.0 / RAD_TO_DEG, 0.0])
+    Qx = sparse.diags([1.0, 0, 5.0, 0])
+    K = SuccessiveLinearizationMPC(ss_model, Np=Np, Nc=Nc, x0=x0, xref=np.array([p_ref[0], 0.0, 0.0, 0.0]),
+                                   uminus1=np.array([0.0]), Qx=Qx, QxN=Qx, Qu=0.0 * sparse.eye(1),
+                                   QDu=1e-5 / (Ts_MPC ** 2) * sparse.eye(1), umin=np.array([-10.0]),
+                                   umax=np.array([10.0]))
+    K.setup(solve=True)
+
+    # The controller time of a step (output, update and solve) is measured without the plant simulation. If it
+    # exceeds the budget, the new solution is not available at the next sample: the input planned by the previous
+    # solution for that sample is applied instead
+    t_budget = 2 * Ts_MPC
+    x_vec = np.zeros((nsim, 4))
+    u_vec = np.zeros((nsim, 1))
+    t_calc_vec = np.zeros(nsim)
+    u_seq_late = None  # input sequence of the previous solution, if the last solve was over budget
+    num_late = 0
+    x_step = x0
+    for idx in range(nsim):
+        x_vec[idx] = x_step
+        time_calc_start = time.perf_counter()
+        u_MPC, info_MPC = K.output(return_u_seq=True, return_status=True)
+        t_calc = time.perf_counter() - time_calc_start
+        if info_MPC['status'] != 'solved':
+            print(f"MPC failed at step {idx}")
+            break
+        if u_seq_late is not None:
+            u_MPC = u_seq_late[1]  # previous plan, shifted by one sample
+            num_late += 1
+        u_vec[idx] = u_MPC
+
+        # plant over one MPC step (ZOH input), not timed
+        x_next = simulate(f_ODE_jit, x_step, np.vstack((u_MPC, u_MPC)), Ts_MPC, method='rk4', num_substeps=10)[1]
+
+        p_ref_next = p_ref[min(idx + 1, nsim - 1)]
+        time_calc_start = time.perf_counter()
+        K.update(x_next, u_MPC, xref=np.array([p_ref_next, 0.0, 0.0, 0.0]))  # solve at the next state
+        t_calc_vec[idx] = t_calc + time.perf_counter() - time_calc_start
+        u_seq_late = info_MPC['u_seq'] if t_calc_vec[idx] > t_budget else None
+        x_step = x_next
+
+    print(f"Controller time per MPC step: mean {np.mean(t_calc_vec)*1e3:.1f} ms, max {np.max(t_calc_vec)*1e3:.1f} ms, "
+          f"budget 2*Ts_MPC {t_budget*1e3:.0f} ms, steps over budget {np.sum(t_calc_vec > t_budget)} "
+          f"(previous plan applied {num_late} times)")
+    print(f"Final position {x_vec[-1, 0]:.3f} m (reference {p_ref[-1]:.3f} m), "
+          f"max angle {np.max(np.abs(x_vec[:, 2]))*RAD_TO_DEG:.1f} deg")
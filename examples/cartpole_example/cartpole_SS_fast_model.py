@@ -0,0 +1,70 @@
+import numpy as np
+import torch
+import os
+import sys
+import time
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssfitter import NeuralStateSpaceSimulator
+from torchid.ssmodels import CartPoleStateSpaceModel, CartPoleFastStateSpaceModel
+
+# Check that CartPoleFastStateSpaceModel reproduces CartPoleStateSpaceModel with the same state dict and compare
+# the computational time of a single model evaluation (as in a closed-loop MPC simulation, batch of 1) and of a
+# multi-step simulation.
+
+if __name__ == '__main__':
+
+    # Set seed for reproducibility
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    Ts = 10e-3
+    num_eval = 10000  # single evaluations of the model
+    batch_size = 32  # number of subsequences q
+    seq_len = 256  # subsequence length m
+    num_rep = 100
+
+    model_filename = os.path.join("models", "model_SS_1step_nonoise.pkl")
+    ss_model = CartPoleStateSpaceModel(Ts, init_small=False)
+    if os.path.exists(model_filename):
+        ss_model.load_state_dict(torch.load(model_filename))
+    ss_model_fast = CartPoleFastStateSpaceModel(Ts)
+    ss_model_fast.load_state_dict(ss_model.state_dict())
+
+    # Outputs and gradients
+    X = torch.randn(1000, 4)
+    U = torch.randn(1000, 1)
+    DX = ss_model(X, U)
+    DX_fast = ss_model_fast(X, U)
+    print(f"forward: max abs difference {torch.max(torch.abs(DX - DX_fast)):.1e}")
+
+    torch.sum(DX**2).backward()
+    torch.sum(DX_fast**2).backward()
+    grad_err = max(torch.max(torch.abs(p.grad - p_fast.grad)).item()
+                   for p, p_fast in zip(ss_model.net.parameters(), ss_model_fast.net.parameters()))
+    print(f"gradient: max abs difference {grad_err:.1e}")
+
+    batch_x0 = torch.randn(batch_size, 4)
+    batch_u = torch.randn(batch_size, seq_len, 1)
+    with torch.no_grad():
+        batch_x_sim = NeuralStateSpaceSimulator(ss_model).f_sim_multistep(batch_x0, batch_u)
+        batch_x_sim_fast = NeuralStateSpaceSimulator(ss_model_fast).f_sim_multistep(batch_x0, batch_u)
+    print(f"simulation: max abs difference {torch.max(torch.abs(batch_x_sim - batch_x_sim_fast)):.1e}")
+
+    # Computational time
+    x_step = torch.randn(1, 4)
+    u_step = torch.randn(1, 1)
+    for model in [ss_model, ss_model_fast]:
+        nn_solution = NeuralStateSpaceSimulator(model)
+        with torch.no_grad():
+            time_start = time.perf_counter()
+            for _ in range(num_eval):
+                model(x_step, u_step)
+            time_eval = (time.perf_counter() - time_start) / num_eval
+
+            time_start = time.perf_counter()
+            for _ in range(num_rep):
+                nn_solution.f_sim_multistep(batch_x0, batch_u)
+            time_sim = (time.perf_counter() - time_start) / num_rep
+
+        print(f"{type(model).__name__:>28s} | single evaluation {time_eval*1e6:6.1f} us | "
+              f"simulation q {batch_size} m {seq_len} {time_sim*1e3:6.1f} ms")
@@ -0,0 +1,55 @@
+import numpy as np
+import torch
+import os
+import sys
+import time
+sys.path.append(os.path.join("..", ".."))
+from torchid.ssfitter import NeuralStateSpaceSimulator
+from torchid.ssmodels import CartPoleStateSpaceModel
+from torchid.npmodels import convert_model
+
+# Open-loop simulation of the cart-pole model in a plain Python/NumPy loop, as in a controller or a state
+# estimator (see kalman.py), with the model called through torch and through the NumPy and numba step functions
+# obtained with torchid.npmodels.convert_model. The results are compared with the torch simulator.
+
+if __name__ == '__main__':
+
+    # Set seed for reproducibility
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    Ts = 10e-3
+    num_samples = 5000
+
+    model_filename = os.path.join("models", "model_SS_1step_nonoise.pkl")
+    ss_model = CartPoleStateSpaceModel(Ts)
+    if os.path.exists(model_filename):
+        ss_model.load_state_dict(torch.load(model_filename))
+
+    u = np.random.randn(num_samples, 1)
+    x0 = np.zeros(4)
+
+    nn_solution = NeuralStateSpaceSimulator(ss_model)
+    with torch.no_grad():
+        x_sim_torch = nn_solution.f_sim(torch.tensor(x0, dtype=torch.float32),
+                                        torch.tensor(u, dtype=torch.float32)).numpy()
+
+    def f_step_torch(x, u):
+        with torch.no_grad():
+            return ss_model(torch.tensor(x, dtype=torch.float32), torch.tensor(u, dtype=torch.float32)).numpy()
+
+    STEP_FUNCTIONS = {'torch': f_step_torch,
+                      'numpy': convert_model(ss_model, backend='numpy'),
+                      'numba': convert_model(ss_model, backend='numba')}
+
+    for backend, f_step in STEP_FUNCTIONS.items():
+        f_step(x0.astype(np.float32), u[0])  # compile (numba)
+        x_sim = np.empty((num_samples, 4), dtype=np.float32)
+        x_step = x0.astype(np.float32)
+        time_start = time.perf_counter()
+        for i in range(num_samples):
+            x_sim[i] = x_step
+            x_step = x_step + f_step(x_step, u[i])
+        time_step = (time.perf_counter() - time_start) / num_samples
+        err = np.max(np.abs(x_sim - x_sim_torch))
+        print(f"{backend:>5s} | time per step {time_step*1e6:6.2f} us | max abs difference vs. torch simulator {err:.1e}")
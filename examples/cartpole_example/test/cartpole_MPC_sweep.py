@@ -0,0 +1,48 @@
+import numpy as np
+import os
+import sys
+sys.path.append(os.path.join("..", "..", ".."))
+from torchid.sweep import make_grid, run_sweep, load_case
+from cartpole_MPC_sim_reference_id import simulate_pendulum_MPC, DEG_TO_RAD
+
+# Monte Carlo study of the closed-loop MPC of the cart-pole: simulate_pendulum_MPC is run over a grid of options
+# (seeds, measurement noise, prediction/control horizons, identified/nominal model) in a process pool.
+# The results are written to sweep_dir while the sweep runs. Running the script again resumes an interrupted
+# sweep: the cases already completed are skipped.
+# Note: simulate_pendulum_MPC seeds numpy with the option seed_val (default 42), hence seed_val is in the grid.
+
+
+def summary_MPC(simout):
+    """ Scalar performance indices of a closed-loop simulation """
+    x = simout['x']
+    x_ref = simout['x_ref']
+    return {'rms_pos': float(np.sqrt(np.mean((x[:, 0] - x_ref[:, 0])**2))),
+            'rms_angle_deg': float(np.sqrt(np.mean((x[:, 2] - x_ref[:, 2])**2)) / DEG_TO_RAD),
+            'emergency': bool(np.any(simout['emergency_fast'])),
+            't_calc_max': float(np.max(simout['t_calc']))}
+
+
+if __name__ == '__main__':
+
+    sweep_dir = os.path.join("data", "sweep_MPC")
+    num_workers = None  # one worker per CPU
+
+    cases = make_grid(seed_val=list(range(10)),
+                      std_npos=[0.0001, 0.001],
+                      std_nphi=[0.0001, 0.001],
+                      Np=[50, 100],
+                      use_NN_model=[False, True])
+    # Control horizon: half the prediction horizon
+    for sim_options in cases:
+        sim_options['Nc'] = sim_options['Np'] // 2
+
+    df_sweep = run_sweep(simulate_pendulum_MPC, cases, sweep_dir, num_workers=num_workers, summary_fun=summary_MPC)
+
+    # Aggregate over the seeds
+    df_done = df_sweep[df_sweep['status'] == 'done']
+    group_cols = ['opt_std_npos', 'opt_std_nphi', 'opt_Np', 'opt_use_NN_model']
+    print(df_done.groupby(group_cols)[['sum_rms_pos', 'sum_rms_angle_deg', 'sum_emergency', 'time']].mean())
+
+    # Full results of a single case
+    simout = load_case(sweep_dir, df_done['case_id'].iloc[0])
+    print(f"Arrays stored for each case: {list(simout.keys())}")
@@ -0,0 +1,184 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import torch
+
+ROLES = ['time', 'u', 'x', 'y']
+META_FILENAME = "meta.json"
+FORMAT_VERSION = 1
+
+
+def convert_csv(csv_path, data_path, u_cols=None, x_cols=None, y_cols=None, time_col=None, Ts=None,
+                chunksize=100000, **read_csv_kwargs):
+    """ Convert an identification record from CSV to the memory-mapped float32 columnar format.
+
+        The record is read in chunks of chunksize rows, so that the memory used by the conversion does not depend
+        on the record length. The columns of each role are written to a raw float32 file <role>.bin, row-major
+        with shape (N, n_role) (shape (N) for the time column). The sampling time, the column names of each role
+        and the shapes are stored in meta.json.
+
+    Parameters
+    ----------
+    csv_path: str
+              Path of the CSV file
+    data_path: str
+              Directory of the converted record. It is created if it does not exist
+    u_cols: list of str
+              Names of the input columns
+    x_cols: list of str
+              Names of the state columns
+    y_cols: list of str
+              Names of the output columns
+    time_col: str
+              Name of the time column
+    Ts: float
+              Sampling time. If None, it is taken as the difference of the first two samples of the time column
+    chunksize: int
+              Number of rows read at a time
+    **read_csv_kwargs
+              Additional arguments of pandas.read_csv (e.g., sep, header, names)
+
+    Returns
+    -------
+    IdentificationRecord
+        The converted record, opened memory-mapped
+
+    """
+    columns = {'time': [time_col] if time_col is not None else None, 'u': u_cols, 'x': x_cols, 'y': y_cols}
+    columns = {role: list(cols) for role, cols in columns.items() if cols}
+
+    os.makedirs(data_path, exist_ok=True)
+    files = {role: open(os.path.join(data_path, f"{role}.bin"), "wb") for role in columns}
+    num_samples = 0
+    time_start = []
+    try:
+        for df_chunk in pd.read_csv(csv_path, chunksize=chunksize, **read_csv_kwargs):
+            for role, cols in columns.items():
+                files[role].write(np.ascontiguousarray(df_chunk[cols], dtype=np.float32).tobytes())
+            if time_col is not None and len(time_start) < 2:
+                time_start += list(df_chunk[time_col][:2 - len(time_start)])
+            num_samples += len(df_chunk)
+    finally:
+        for f in files.values():
+            f.close()
+
+    if Ts is None:
+        if len(time_start) < 2:
+            raise ValueError("Ts must be given if the record has no time column")
+        Ts = time_start[1] - time_start[0]
+
+    meta = {
+        'version': FORMAT_VERSION,
+        'Ts': float(Ts),
+        'num_samples': num_samples,
+        'columns': columns,
+        'source': os.path.basename(csv_path),
+    }
+    with open(os.path.join(data_path, META_FILENAME), "w") as f:
+        json.dump(meta, f, indent=4)
+
+    return open_record(data_path)
+
+
+def open_record(data_path):
+    """ Open an identification record in the memory-mapped float32 columnar format (see convert_csv).
+
+        Only the metadata is read, hence the open time does not depend on the record length.
+
+    Parameters
+    ----------
+    data_path: str
+              Directory of the record
+
+    Returns
+    -------
+    IdentificationRecord
+        The opened record
+
+    """
+    with open(os.path.join(data_path, META_FILENAME)) as f:
+        meta = json.load(f)
+    if meta['version'] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported record format version {meta['version']}")
+    return IdentificationRecord(data_path, meta)
+
+
+class IdentificationRecord(object):
+    """ An identification record in the memory-mapped float32 columnar format.
+
+        The signals are returned as tensors sharing memory with a copy-on-write memory map of the files. Pages are
+        read from disk only when accessed, so that the resident memory stays bounded for records larger than RAM.
+        In-place changes to the tensors are private to the process and never written back to disk.
+
+     Attributes
+     ----------
+     data_path: str
+              Directory of the record
+     Ts: float
+              Sampling time
+     num_samples: int
+              Number of samples N of the record
+     columns: dict of list of str
+              Column names of each role ('time', 'u', 'x', 'y') stored in the record
+     """
+
+    def __init__(self, data_path, meta):
+        self.data_path = data_path
+        self.meta = meta
+        self.Ts = meta['Ts']
+        self.num_samples = meta['num_samples']
+        self.columns = meta['columns']
+        self._arrays = {}
+
+    def __contains__(self, role):
+        return role in self.columns
+
+    def get_array(self, role):
+        """ Get a signal of the record as a memory-mapped numpy array. Size: (N, n_role), or (N) for role 'time' """
+        if role not in self.columns:
+            raise KeyError(f"Role '{role}' not in record {self.data_path}")
+        if role not in self._arrays:
+            shape = (self.num_samples,) if role == 'time' else (self.num_samples, len(self.columns[role]))
+            self._arrays[role] = np.memmap(os.path.join(self.data_path, f"{role}.bin"),
+                                           dtype=np.float32, mode='c', shape=shape)
+        return self._arrays[role]
+
+    def get_tensor(self, role):
+        """ Get a signal of the record as a zero-copy tensor. Size: (N, n_role), or (N) for role 'time' """
+        return torch.from_numpy(self.get_array(role))
+
+    @property
+    def time(self):
+        return self.get_tensor('time')
+
+    @property
+    def u(self):
+        return self.get_tensor('u')
+
+    @property
+    def x(self):
+        return self.get_tensor('x')
+
+    @property
+    def y(self):
+        return self.get_tensor('y')
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, "data.csv")
+        N = 1000
+        Ts = 0.1
+        df = pd.DataFrame({'time': np.arange(N)*Ts, 'u': np.random.randn(N),
+                           'x1': np.random.randn(N), 'x2': np.random.randn(N)})
+        df.to_csv(csv_path, index=False)
+
+        record = convert_csv(csv_path, os.path.join(tmp_dir, "data"), u_cols=['u'], x_cols=['x1', 'x2'],
+                             y_cols=['x1'], time_col='time', chunksize=300)
+        assert record.num_samples == N and np.isclose(record.Ts, Ts)
+        assert np.allclose(record.x.numpy(), np.array(df[['x1', 'x2']], dtype=np.float32))
+        assert np.allclose(record.y.numpy(), np.array(df[['x1']], dtype=np.float32))
+        del record
@@ -0,0 +1,198 @@
+""" Compiled simulation of nonlinear plants for data generation
+
+    The plant is a numba-compiled ODE dx/dt = f_ODE(t, x, u), with the signature of the ODEs of the examples
+    (e.g., fxu_ODE in symbolic_RLC.py and f_ODE_jit in cartpole_dynamics.py):
+    float64[:](float64, float64[:], float64[:]). The input is a sampled sequence u_k held constant over each
+    sample interval [k*Ts, (k+1)*Ts) (zero-order hold). The integration never crosses a sample boundary, hence
+    the discontinuities of the input need no interpolation and no special handling by the adaptive method.
+
+    Integration methods:
+     * 'euler': forward Euler, num_substeps fixed sub-steps per sample
+     * 'rk4': classic Runge-Kutta, num_substeps fixed sub-steps per sample
+     * 'dopri5': Dormand-Prince 5(4) with adaptive sub-steps within each sample (rtol, atol)
+"""
+import numpy as np
+import numba
+
+METHOD_EULER = 0
+METHOD_RK4 = 1
+METHOD_DOPRI5 = 2
+METHODS = {'euler': METHOD_EULER, 'rk4': METHOD_RK4, 'dopri5': METHOD_DOPRI5}
+
+# Dormand-Prince 5(4) tableau
+DP_A = np.array([
+    [0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+    [1/5, 0.0, 0.0, 0.0, 0.0, 0.0],
+    [3/40, 9/40, 0.0, 0.0, 0.0, 0.0],
+    [44/45, -56/15, 32/9, 0.0, 0.0, 0.0],
+    [19372/6561, -25360/2187, 64448/6561, -212/729, 0.0, 0.0],
+    [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656, 0.0],
+    [35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84],
+])
+DP_C = np.array([0.0, 1/5, 3/10, 4/5, 8/9, 1.0, 1.0])
+DP_E = np.array([35/384 - 5179/57600, 0.0, 500/1113 - 7571/16695, 125/192 - 393/640,
+                 -2187/6784 + 92097/339200, 11/84 - 187/2100, -1/40])  # 5th minus 4th order weights
+DP_SAFETY = 0.9
+DP_MIN_FACTOR = 0.2
+DP_MAX_FACTOR = 10.0
+
+
+@numba.njit
+def _fixed_step(f_ODE, t, x, u, h, method):
+    if method == METHOD_EULER:
+        return x + h * f_ODE(t, x, u)
+    k1 = f_ODE(t, x, u)
+    k2 = f_ODE(t + h / 2, x + h / 2 * k1, u)
+    k3 = f_ODE(t + h / 2, x + h / 2 * k2, u)
+    k4 = f_ODE(t + h, x + h * k3, u)
+    return x + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+
+
+@numba.njit
+def _dopri5_interval(f_ODE, t0, x, u, Ts, h, rtol, atol, max_steps):
+    """ Integrate over one sample interval [t0, t0 + Ts]. Returns the state, the next sub-step size and a success
+        flag (False if more than max_steps sub-steps are needed) """
+    n_x = x.shape[0]
+    K = np.empty((7, n_x))
+    K[0] = f_ODE(t0, x, u)
+    t = 0.0
+    for _ in range(max_steps):
+        h_step = min(h, Ts - t)
+        for s in range(1, 7):
+            x_stage = x.copy()
+            for j in range(s):
+                if DP_A[s, j] != 0.0:
+                    x_stage += h_step * DP_A[s, j] * K[j]
+            K[s] = f_ODE(t0 + t + DP_C[s] * h_step, x_stage, u)
+        # x_stage is the 5th order solution (last row of DP_A), K[6] = f(x_new) (first same as last)
+        x_new = x_stage
+
+        err_norm = 0.0
+        for i in range(n_x):
+            err_i = 0.0
+            for s in range(7):
+                err_i += DP_E[s] * K[s, i]
+            scale = atol + rtol * max(abs(x[i]), abs(x_new[i]))
+            err_norm += (h_step * err_i / scale) ** 2
+        err_norm = np.sqrt(err_norm / n_x)
+
+        factor = DP_MAX_FACTOR if err_norm == 0.0 else DP_SAFETY * err_norm ** (-1 / 5)
+        h_new = h_step * min(DP_MAX_FACTOR, max(DP_MIN_FACTOR, factor))
+        if err_norm <= 1.0:
+            t += h_step
+            x = x_new
+            K[0] = K[6]
+            h = max(h, h_new) if h_step < h else h_new  # a step shortened to reach the sample end is not informative
+            if t >= Ts * (1 - 1e-9):
+                return x, h, True
+        else:
+            h = h_new
+    return x, h, False
+
+
+@numba.njit
+def _simulate(f_ODE, x0, u, Ts, method, num_substeps, rtol, atol, max_steps, x_out):
+    """ Simulate one experiment, writing the state at the sample instants into x_out. Returns a success flag """
+    x = x0.copy()
+    h = Ts
+    h_fixed = Ts / num_substeps
+    for k in range(u.shape[0]):
+        x_out[k] = x
+        t = k * Ts
+        if method == METHOD_DOPRI5:
+            x, h, success = _dopri5_interval(f_ODE, t, x, u[k], Ts, h, rtol, atol, max_steps)
+            if not success:
+                return False
+        else:
+            for j in range(num_substeps):
+                x = _fixed_step(f_ODE, t + j * h_fixed, x, u[k], h_fixed, method)
+    return True
+
+
+@numba.njit(parallel=True)
+def _simulate_many(f_ODE, x0, u, Ts, method, num_substeps, rtol, atol, max_steps, x_out):
+    success = np.empty(x0.shape[0], dtype=np.bool_)
+    for i in numba.prange(x0.shape[0]):
+        success[i] = _simulate(f_ODE, x0[i], u[i], Ts, method, num_substeps, rtol, atol, max_steps, x_out[i])
+    return success
+
+
+def _check_method(method, num_substeps):
+    if method not in METHODS:
+        raise ValueError(f"Unknown integration method {method}. Available methods: {list(METHODS)}")
+    if num_substeps < 1:
+        raise ValueError("num_substeps must be a positive integer")
+    return METHODS[method]
+
+
+def simulate(f_ODE, x0, u, Ts, method='rk4', num_substeps=1, rtol=1e-6, atol=1e-9, max_steps=1000):
+    """ Simulate a numba-compiled nonlinear plant with zero-order-hold input.
+
+    Parameters
+    ----------
+    f_ODE: numba.core.registry.CPUDispatcher
+           The plant dx/dt = f_ODE(t, x, u), compiled with numba in nopython mode
+    x0: np.array. Size: (n_x)
+           Initial state
+    u: np.array. Size: (N, n_u) or (N)
+           Input sequence, held constant over each sample interval
+    Ts: float
+           Sampling time
+    method: str
+           Integration method: 'euler', 'rk4' or 'dopri5'
+    num_substeps: int
+           Number of sub-steps per sample of the fixed-step methods ('euler', 'rk4')
+    rtol: float
+           Relative tolerance of the adaptive method ('dopri5')
+    atol: float
+           Absolute tolerance of the adaptive method ('dopri5')
+    max_steps: int
+           Maximum number of sub-steps (accepted or rejected) per sample of the adaptive method ('dopri5')
+
+    Returns
+    -------
+    np.array. Size: (N, n_x)
+        The state at the sample instants t_k = k*Ts, k = 0, ..., N-1, starting from x0
+
+    """
+    method_code = _check_method(method, num_substeps)
+    x0 = np.ascontiguousarray(x0, dtype=np.float64)
+    u = np.ascontiguousarray(u, dtype=np.float64).reshape(np.shape(u)[0], -1)
+    x_out = np.empty((u.shape[0], x0.shape[0]))
+    success = _simulate(f_ODE, x0, u, float(Ts), method_code, int(num_substeps), float(rtol), float(atol),
+                        int(max_steps), x_out)
+    if not success:
+        raise RuntimeError(f"Dormand-Prince: more than {max_steps} sub-steps in one sample")
+    return x_out
+
+
+def simulate_experiments(f_ODE, x0, u, Ts, method='rk4', num_substeps=1, rtol=1e-6, atol=1e-9, max_steps=1000):
+    """ Simulate several experiments of a numba-compiled nonlinear plant with zero-order-hold input, in parallel
+        over the available cores (see numba.set_num_threads). Same arguments as simulate, with a leading
+        experiment dimension.
+
+    Parameters
+    ----------
+    x0: np.array. Size: (n_exp, n_x)
+           Initial state of each experiment
+    u: np.array. Size: (n_exp, N, n_u) or (n_exp, N)
+           Input sequence of each experiment
+
+    Returns
+    -------
+    np.array. Size: (n_exp, N, n_x)
+        The state at the sample instants of each experiment
+
+    """
+    method_code = _check_method(method, num_substeps)
+    x0 = np.ascontiguousarray(x0, dtype=np.float64)
+    u = np.ascontiguousarray(u, dtype=np.float64).reshape(np.shape(u)[0], np.shape(u)[1], -1)
+    if x0.shape[0] != u.shape[0]:
+        raise ValueError("x0 and u must have the same number of experiments")
+    x_out = np.empty((u.shape[0], u.shape[1], x0.shape[1]))
+    success = _simulate_many(f_ODE, x0, u, float(Ts), method_code, int(num_substeps), float(rtol), float(atol),
+                             int(max_steps), x_out)
+    if not np.all(success):
+        raise RuntimeError(f"Dormand-Prince: more than {max_steps} sub-steps in one sample "
+                           f"(experiments {np.flatnonzero(~success).tolist()})")
+    return x_out
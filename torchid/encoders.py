@@ -0,0 +1,58 @@
+import torch
+import torch.nn as nn
+
+
+class InitialStateEncoder(nn.Module):
+    """ This class implements an encoder of the initial condition of a simulation from past data
+        x_0 = NN(y_{-n_k}, ..., y_{-1}, u_{-n_k}, ..., u_{-1})
+
+        It replaces the hidden initial conditions of the multi-step fitting: the encoder parameters do not depend on
+        the record length and the initial conditions of new records (e.g., validation) are obtained from their first
+        n_k samples, without any optimization. For the SS models, x_0 is the initial state. For the IO models,
+        x_0 is the initial regressor of the output (y_{-1}, ..., y_{-n_a}), and n_x = n_a.
+
+     Attributes
+     ----------
+     n_x : int.
+           number of encoded initial conditions
+     n_y : int.
+           number of outputs
+     n_u : int.
+           number of inputs
+     n_k : int.
+           number of past samples of y and u
+     n_feat : int.
+           number of units in the hidden layer
+     """
+
+    def __init__(self, n_x, n_y, n_u, n_k, n_feat=64):
+        super(InitialStateEncoder, self).__init__()
+        self.n_x = n_x
+        self.n_y = n_y
+        self.n_u = n_u
+        self.n_k = n_k
+        self.n_feat = n_feat
+        self.net = nn.Sequential(
+            nn.Linear(n_k*(n_y + n_u), n_feat),
+            nn.ReLU(),
+            nn.Linear(n_feat, n_x)
+        )
+
+    def forward(self, y_past, u_past):
+        """ Encode the initial conditions
+
+        Parameters
+        ----------
+        y_past: Tensor. Size: (q, n_k, n_y)
+             Past output samples y_{-n_k}, ..., y_{-1}
+        u_past: Tensor. Size: (q, n_k, n_u)
+             Past input samples u_{-n_k}, ..., u_{-1}
+
+        Returns
+        -------
+        Tensor. Size: (q, n_x)
+            Initial conditions
+
+        """
+        YU = torch.cat((y_past.flatten(-2), u_past.flatten(-2)), -1)
+        return self.net(YU)
@@ -0,0 +1,198 @@
+import copy
+import json
+import torch
+import torch.nn as nn
+from typing import List
+
+META_FILENAME = "meta.json"
+FORMAT_VERSION = 2  # version 2: integration method in the metadata (version 1 artifacts are forward Euler)
+EXPORT_METHODS = ('euler', 'midpoint', 'rk4')  # fixed-step integration methods of torchid.integrators
+
+
+class ExportedStateSpaceModel(nn.Module):
+    """ TorchScript-compatible inference wrapper of a neural SS model, in the engineering units of the data.
+
+        The model ss_model works on scaled signals x_s = (x - x_mean)/x_scale, u_s = (u - u_mean)/u_scale
+        (e.g., standardized as in CSTR_scale.py) and returns the state increment over one sample. The next state is
+        computed with the integration method of the simulation used in training (see torchid.integrators):
+        'euler' (x_s_{k+1} = x_s_k + ss_model(x_s_k, u_s_k)), 'midpoint' or 'rk4'.
+
+     Attributes
+     ----------
+     ss_model: nn.Module
+               The neural SS model. Must be compatible with torch.jit.script
+     x_mean, x_scale: Tensor. Size: (n_x)
+               Scaling of the state
+     u_mean, u_scale: Tensor. Size: (n_u)
+               Scaling of the input
+     method: str
+               Integration method: 'euler', 'midpoint' or 'rk4'
+     """
+
+    def __init__(self, ss_model, x_mean, x_scale, u_mean, u_scale, method='euler'):
+        super(ExportedStateSpaceModel, self).__init__()
+        if method not in EXPORT_METHODS:
+            raise ValueError(f"Integration method {method} is not supported by the exported model")
+        self.ss_model = ss_model
+        self.method = method
+        self.register_buffer('x_mean', torch.as_tensor(x_mean, dtype=torch.float32))
+        self.register_buffer('x_scale', torch.as_tensor(x_scale, dtype=torch.float32))
+        self.register_buffer('u_mean', torch.as_tensor(u_mean, dtype=torch.float32))
+        self.register_buffer('u_scale', torch.as_tensor(u_scale, dtype=torch.float32))
+
+    def step(self, x_s, u_s):
+        """ Next scaled state, with the integration method of the model """
+        k1 = self.ss_model(x_s, u_s)
+        if self.method == 'midpoint':
+            return x_s + self.ss_model(x_s + 0.5 * k1, u_s)
+        if self.method == 'rk4':
+            k2 = self.ss_model(x_s + 0.5 * k1, u_s)
+            k3 = self.ss_model(x_s + 0.5 * k2, u_s)
+            k4 = self.ss_model(x_s + k3, u_s)
+            return x_s + (k1 + 2 * k2 + 2 * k3 + k4) / 6
+        return x_s + k1
+
+    def forward(self, x, u):
+        """ One-step-ahead state
+
+        Parameters
+        ----------
+        x : Tensor. Size: (..., n_x)
+            Current state
+
+        u : Tensor. Size: (..., n_u)
+            Current input
+
+        Returns
+        -------
+        Tensor. Size: (..., n_x)
+            Next state
+
+        """
+        x_s = (x - self.x_mean) / self.x_scale
+        u_s = (u - self.u_mean) / self.u_scale
+        x_s = self.step(x_s, u_s)
+        return x_s * self.x_scale + self.x_mean
+
+    @torch.jit.export
+    def simulate(self, x0, u):
+        """ Open-loop simulation. The signals are scaled once, outside the simulation loop
+
+        Parameters
+        ----------
+        x0 : Tensor. Size: (n_x) or (q, n_x)
+             Initial state
+
+        u : Tensor. Size: (N, n_u) or (q, N, n_u)
+            Input sequence
+
+        Returns
+        -------
+        Tensor. Size: (N, n_x) or (q, N, n_x)
+            Simulated state, starting from x0
+
+        """
+        dim = u.dim() - 2
+        x_s = (x0 - self.x_mean) / self.x_scale
+        u_s = (u - self.u_mean) / self.u_scale
+        X_list: List[torch.Tensor] = []
+        for u_step in u_s.unbind(dim):
+            X_list.append(x_s)
+            x_s = self.step(x_s, u_step)
+        X = torch.stack(X_list, dim)
+        return X * self.x_scale + self.x_mean
+
+
+def export_model(ss_model, path, n_x, n_u, Ts=1.0, x_mean=None, x_scale=None, u_mean=None, u_scale=None,
+                 x_cols=None, u_cols=None, method='euler'):
+    """ Export a trained neural SS model to a self-contained inference artifact.
+
+        The artifact is a single TorchScript file holding the compiled step function and open-loop simulation
+        (see ExportedStateSpaceModel), the parameters and the metadata: format version, model class, n_x, n_u,
+        Ts, integration method, column names and scaling. It is loaded with torch only (see load_model), without
+        torchid, the model classes or the constructor arguments.
+
+    Parameters
+    ----------
+    ss_model: nn.Module
+              The trained neural SS model. Must be compatible with torch.jit.script
+    path: str
+              Path of the artifact
+    n_x: int
+              Number of states
+    n_u: int
+              Number of inputs
+    Ts: float
+              Sampling time of the model
+    x_mean, x_scale: array_like. Size: (n_x)
+              Scaling of the state. If None, no scaling (0 and 1)
+    u_mean, u_scale: array_like. Size: (n_u)
+              Scaling of the input. If None, no scaling (0 and 1)
+    x_cols: list of str
+              Names of the state columns
+    u_cols: list of str
+              Names of the input columns
+    method: str
+              Integration method of the simulation used in training (NeuralStateSpaceSimulator.method):
+              'euler', 'midpoint' or 'rk4'. The adaptive 'dopri5' and custom methods are not supported
+
+    Returns
+    -------
+    dict
+        The metadata stored in the artifact
+
+    """
+    if method not in EXPORT_METHODS:
+        raise ValueError(f"Integration method {method} is not supported by export_model, only {EXPORT_METHODS}")
+    x_mean = [0.0]*n_x if x_mean is None else [float(val) for val in x_mean]
+    x_scale = [1.0]*n_x if x_scale is None else [float(val) for val in x_scale]
+    u_mean = [0.0]*n_u if u_mean is None else [float(val) for val in u_mean]
+    u_scale = [1.0]*n_u if u_scale is None else [float(val) for val in u_scale]
+    if len(x_mean) != n_x or len(x_scale) != n_x or len(u_mean) != n_u or len(u_scale) != n_u:
+        raise ValueError("The scaling must have n_x elements for the state and n_u elements for the input")
+
+    meta = {
+        'version': FORMAT_VERSION,
+        'model_class': f"{type(ss_model).__module__}.{type(ss_model).__qualname__}",
+        'n_x': n_x,
+        'n_u': n_u,
+        'Ts': float(Ts),
+        'method': method,
+        'columns': {'x': x_cols, 'u': u_cols},
+        'scaling': {'x': {'mean': x_mean, 'scale': x_scale}, 'u': {'mean': u_mean, 'scale': u_scale}},
+    }
+
+    # inference only: the parameters of a copy of the model are frozen into the compiled graph as constants
+    exported_model = ExportedStateSpaceModel(copy.deepcopy(ss_model), x_mean, x_scale, u_mean, u_scale, method)
+    scripted_model = torch.jit.script(exported_model.eval())
+    scripted_model = torch.jit.freeze(scripted_model, preserved_attrs=['simulate'])
+    torch.jit.save(scripted_model, path, _extra_files={META_FILENAME: json.dumps(meta, indent=4)})
+    return meta
+
+
+def load_model(path, map_location=None):
+    """ Load an inference artifact created by export_model. Only torch is required.
+
+        For the shortest cold start, call the model within torch.jit.optimized_execution(False): the first calls
+        then skip the profiling and optimization passes of the TorchScript graph executor.
+
+    Parameters
+    ----------
+    path: str
+              Path of the artifact
+    map_location: str or torch.device
+              Device of the loaded parameters
+
+    Returns
+    -------
+    tuple (torch.jit.ScriptModule, dict)
+          The compiled model, with methods forward(x, u) (next state) and simulate(x0, u), and the metadata
+
+    """
+    extra_files = {META_FILENAME: ""}
+    model = torch.jit.load(path, map_location=map_location, _extra_files=extra_files)
+    meta = json.loads(extra_files[META_FILENAME])
+    if meta['version'] not in (1, FORMAT_VERSION):
+        raise ValueError(f"Unsupported artifact format version {meta['version']}")
+    meta.setdefault('method', 'euler')
+    return model, meta
@@ -0,0 +1,156 @@
+""" Integration methods for the SS model structure
+
+    The neural SS models return the state increment over one sample, dx = f(x, u), which the forward Euler method
+    adds to the state: x_{k+1} = x_k + f(x_k, u_k). The same f is interpreted here as a vector field with time
+    measured in samples, dx/dt = f(x, u), integrated over one sample with the input held constant (ZOH).
+    Forward Euler is the special case of a single first-order step; higher-order methods give the same
+    accuracy at a coarser sampling time, i.e., with fewer simulation steps.
+
+    An integration method is a callable step(f, x, u) returning the state after one sample. All methods operate
+    on batches of states, along the leading dimensions of x and u.
+"""
+import torch
+
+
+def euler_step(f, x, u):
+    """ Forward Euler: x + f(x, u). First order, one evaluation of f """
+    return x + f(x, u)
+
+
+def midpoint_step(f, x, u):
+    """ Explicit midpoint rule. Second order, two evaluations of f """
+    k1 = f(x, u)
+    k2 = f(x + 0.5 * k1, u)
+    return x + k2
+
+
+def rk4_step(f, x, u):
+    """ Classic Runge-Kutta method. Fourth order, four evaluations of f """
+    k1 = f(x, u)
+    k2 = f(x + 0.5 * k1, u)
+    k3 = f(x + 0.5 * k2, u)
+    k4 = f(x + k3, u)
+    return x + (k1 + 2 * k2 + 2 * k3 + k4) / 6
+
+
+class DormandPrince(object):
+    """ Dormand-Prince 5(4) embedded method with adaptive sub-steps within each sample
+
+        The sample interval is integrated in one or more sub-steps, whose size is adapted based on the difference
+        between the embedded 5th and 4th order solutions. The whole batch advances with the same sub-step size,
+        chosen on the worst-case error of the batch. The step size control uses detached error estimates,
+        while the accepted sub-steps are differentiated through as regular operations. The last proposed
+        sub-step size is kept as the initial guess for the next sample of the same rollout: reset() restores the
+        initial size of one sample, and NeuralStateSpaceSimulator calls it at the start of each rollout.
+
+        The accept/reject decision and the number of sub-steps are taken on the host, hence each sub-step
+        synchronizes with the device to read the error norm. On GPU, this stalls the pipeline once per sub-step:
+        the fixed-step methods ('rk4') are preferable for training there.
+
+     Attributes
+     ----------
+     rtol: float
+           Relative tolerance
+     atol: float
+           Absolute tolerance
+     max_steps: int
+           Maximum number of sub-steps (accepted or rejected) per sample
+     num_eval: int
+           Number of evaluations of f performed so far
+     """
+
+    A = [
+        [],
+        [1/5],
+        [3/40, 9/40],
+        [44/45, -56/15, 32/9],
+        [19372/6561, -25360/2187, 64448/6561, -212/729],
+        [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+        [35/384, 0.0, 500/1113, 125/192, -2187/6784, 11/84],
+    ]
+    B4 = [5179/57600, 0.0, 7571/16695, 393/640, -92097/339200, 187/2100, 1/40]
+
+    def __init__(self, rtol=1e-5, atol=1e-6, safety=0.9, min_factor=0.2, max_factor=10.0, max_steps=100):
+        self.rtol = rtol
+        self.atol = atol
+        self.safety = safety
+        self.min_factor = min_factor
+        self.max_factor = max_factor
+        self.max_steps = max_steps
+        self.E = [b5 - b4 for b5, b4 in zip(self.A[-1] + [0.0], self.B4)]  # error estimation weights
+        self.h = 1.0
+        self.num_eval = 0
+
+    def reset(self):
+        """ Restore the initial sub-step size (one sample) """
+        self.h = 1.0
+
+    def _combine(self, weights, k):
+        return sum(w * ki for w, ki in zip(weights, k) if w != 0.0)
+
+    def __call__(self, f, x, u):
+        t = 0.0
+        h = min(self.h, 1.0)
+        k1 = f(x, u)
+        self.num_eval += 1
+        for _ in range(self.max_steps):
+            h_step = min(h, 1.0 - t)
+            k = [k1]
+            for a in self.A[1:]:
+                k.append(f(x + h_step * self._combine(a, k), u))
+            self.num_eval += 6
+            x_new = x + h_step * self._combine(self.A[-1], k)  # 5th order solution, f(x_new) = k[6]
+
+            with torch.no_grad():
+                err = h_step * self._combine(self.E, k)
+                scale = self.atol + self.rtol * torch.max(x.abs(), x_new.abs())
+                err_norm = float(torch.max(torch.sqrt(torch.mean((err / scale) ** 2, dim=-1))))  # device sync
+
+            factor = self.max_factor if err_norm == 0.0 else self.safety * err_norm ** (-1 / 5)
+            h_new = h_step * min(self.max_factor, max(self.min_factor, factor))
+            if err_norm <= 1.0:
+                t += h_step
+                x = x_new
+                k1 = k[6]  # first same as last
+                h = max(h, h_new) if h_step < h else h_new  # a step shortened to reach t=1 is not informative
+                if t >= 1.0 - 1e-9:
+                    break
+            else:
+                h = h_new
+        else:
+            raise RuntimeError(f"Dormand-Prince: more than {self.max_steps} sub-steps in one sample")
+
+        self.h = h
+        return x
+
+
+INTEGRATORS = {
+    'euler': euler_step,
+    'midpoint': midpoint_step,
+    'rk4': rk4_step,
+    'dopri5': DormandPrince,
+}
+
+
+def get_integrator(method):
+    """ Get an integration method
+
+    Parameters
+    ----------
+    method: str or callable
+            One of 'euler', 'midpoint', 'rk4', 'dopri5' (DormandPrince with default tolerances),
+            or a callable step(f, x, u)
+
+    Returns
+    -------
+    callable
+        The integration method step(f, x, u)
+
+    """
+    if callable(method):
+        return method
+    if method not in INTEGRATORS:
+        raise ValueError(f"Unknown integration method {method}")
+    if method == 'dopri5':
+        return DormandPrince()
+    return INTEGRATORS[method]
@@ -1,6 +1,71 @@
 import torch
 import torch.nn as nn
 import numpy as np
+from torch.utils.checkpoint import checkpoint
+from torchid.util import StepBuffer, RaggedBatch
+
+
+class IORegressorBuffer(object):
+    """ Circular buffer holding the IO regressor phi = [y_{k-1}, ..., y_{k-n_a}, u_{k-1}, ..., u_{k-n_b}]
+        during a simulation.
+
+        Each signal is stored twice in a buffer of length 2n, so that the n most recent values are always
+        the contiguous window buf[..., head:head + n], most recent first. A new sample costs two element writes
+        regardless of n, instead of shifting the whole regressor. The initial regressors are copied, thus
+        the caller's tensors are not modified and may require gradients.
+
+     Attributes
+     ----------
+     n_a : int.
+           number of autoregressive lags in y
+     n_b : int.
+           number of autoregressive lags in u
+     """
+
+    def __init__(self, y_seq, u_seq):
+        self.n_a = y_seq.shape[-1]
+        self.n_b = u_seq.shape[-1]
+        self.y_buf = torch.cat((y_seq, y_seq), -1)
+        self.u_buf = torch.cat((u_seq, u_seq), -1)
+        self.y_head = 0
+        self.u_head = 0
+        self.phi_buf = None
+
+    def phi(self):
+        """ Current regressor. Size: (..., n_a + n_b) """
+        y_win = self.y_buf[..., self.y_head:self.y_head + self.n_a]
+        u_win = self.u_buf[..., self.u_head:self.u_head + self.n_b]
+        if torch.is_grad_enabled():
+            return torch.cat((y_win, u_win), -1)
+        # without gradients, the regressor tensor is allocated once and reused
+        if self.phi_buf is None:
+            self.phi_buf = torch.cat((y_win, u_win), -1)
+        else:
+            torch.cat((y_win, u_win), -1, out=self.phi_buf)
+        return self.phi_buf
+
+    def push(self, y, u):
+        """ Insert the new samples y and u. Size: (..., 1) """
+        self.y_head = (self.y_head - 1) % self.n_a
+        self.y_buf[..., self.y_head:self.y_head + 1] = y
+        self.y_buf[..., self.y_head + self.n_a:self.y_head + self.n_a + 1] = y
+
+        self.u_head = (self.u_head - 1) % self.n_b
+        self.u_buf[..., self.u_head:self.u_head + 1] = u
+        self.u_buf[..., self.u_head + self.n_b:self.u_head + self.n_b + 1] = u
+
+    def regressors(self):
+        """ Current regressors with past values of y and u. Size: (..., n_a), (..., n_b) """
+        y_win = self.y_buf[..., self.y_head:self.y_head + self.n_a]
+        u_win = self.u_buf[..., self.u_head:self.u_head + self.n_b]
+        return y_win, u_win
+
+    def narrow(self, batch_size):
+        """ Keep only the first batch_size regressors of a batch. Size: (q, ...) -> (batch_size, ...) """
+        self.y_buf = self.y_buf[:batch_size]
+        self.u_buf = self.u_buf[:batch_size]
+        if self.phi_buf is not None:
+            self.phi_buf = self.phi_buf[:batch_size]
 
 
 class NeuralIOSimulator:
@@ -33,7 +98,7 @@ class NeuralIOSimulator:
         Y_pred = self.io_model(PHI)
         return Y_pred
 
-    def f_sim(self, y_seq, u_seq, U):
+    def f_sim(self, y_seq, u_seq, U, out=None):
         """ Open-loop simulation
 
         Parameters
@@ -47,6 +112,9 @@ class NeuralIOSimulator:
         U : Tensor. Size: (N, n_u)
             Input sequence tensor
 
+        out : Tensor. Size: (N, n_y), optional
+              Preallocated tensor where the simulated output is written. If None, a new tensor is allocated
+
         Returns
         -------
         Tensor. Size: (N, n_y)
@@ -54,31 +122,27 @@ class NeuralIOSimulator:
 
         """
         N = np.shape(U)[0]
-        Y_list = []
+        Y_buf = StepBuffer(N, dim=0, out=out)
+        phi_buf = IORegressorBuffer(y_seq, u_seq)
 
         for i in range(N):
-            phi = torch.cat((y_seq, u_seq))
+            phi = phi_buf.phi()
             yi = self.io_model(phi)
-            Y_list += [yi]
+            Y_buf.append(yi)
 
             if i < N-1:
-                # y shift
-                y_seq[1:] = y_seq[0:-1]
-                y_seq[0] = yi
-
-                # u shift
-                u_seq[1:] = u_seq[0:-1]
-                u_seq[0] = U[i]
+                # y and u shift
+                phi_buf.push(yi, U[i])
 
-        Y = torch.stack(Y_list, 0)
+        Y = Y_buf.result()
         return Y
 
-    def f_sim_multistep(self, batch_u, batch_y_seq, batch_u_seq):
+    def f_sim_multistep(self, batch_u, batch_y_seq, batch_u_seq, out=None, checkpoint_every=None, batch_first=True):
         """ Multi-step simulation over (mini)batches
 
         Parameters
         ----------
-        batch_u: Tensor. Size: (q, m, n_u)
+        batch_u: Tensor. Size: (q, m, n_u), or (m, q, n_u) if batch_first=False
                  Input sequence for each subsequence in the minibatch
 
         batch_y_seq: Tensor. Size: (q, n_a)
@@ -87,31 +151,144 @@ class NeuralIOSimulator:
         batch_u_seq: Tensor. Size: (q, n_b)
                  Initial regressor with past values of u for each subsequence in the minibatch
 
+        out: Tensor. Size: (q, m, n_y), or (m, q, n_y) if batch_first=False, optional
+                 Preallocated tensor where the simulated output is written. If None, a new tensor is allocated
+
+        checkpoint_every: int, optional
+                 If given, and gradients are recorded, only the regressor every checkpoint_every steps is kept for
+                 the backward pass, where the segments are recomputed (see simulate_checkpoint)
+
+        batch_first: bool
+                 If False, the input and the simulated output are time-major: the input of a step is a contiguous
+                 slice of batch_u and the output of a step is written to a contiguous slice of the result
+
         Returns
         -------
-        Tensor. Size: (q, m, n_y)
+        Tensor. Size: (q, m, n_y), or (m, q, n_y) if batch_first=False
             Simulated output for all subsequences in the minibatch
 
         """
 
-        batch_size = batch_u.shape[0] # number of training samples in the batch
-        seq_len = batch_u.shape[1] # length of the training sequences
-        n_a = batch_y_seq.shape[1] # number of autoregressive terms on y
-        n_b = batch_u_seq.shape[1] # number of autoregressive terms on u
+        t_dim = 1 if batch_first else 0  # time dimension
+        if checkpoint_every is not None and torch.is_grad_enabled():
+            if out is not None:
+                raise ValueError("A preallocated output is not supported with checkpoint_every")
+            return self.simulate_checkpoint(batch_u, batch_y_seq, batch_u_seq, checkpoint_every, batch_first)
+
+        seq_len = batch_u.shape[t_dim] # length of the training sequences
+        u_steps = batch_u.unbind(t_dim)
 
-        Y_sim_list = []
+        Y_sim_buf = StepBuffer(seq_len, dim=t_dim, out=out)
+        phi_buf = IORegressorBuffer(batch_y_seq, batch_u_seq)
         for i in range(seq_len):
-            phi = torch.cat((batch_y_seq, batch_u_seq), -1)
+            phi = phi_buf.phi()
             yi = self.io_model(phi)
-            Y_sim_list += [yi]
+            Y_sim_buf.append(yi)
+
+            # y and u shift
+            phi_buf.push(yi, u_steps[i])
+
+        Y_sim = Y_sim_buf.result()
+        return Y_sim
+
+    def simulate_steps(self, batch_u, batch_y_seq, batch_u_seq, t_dim=1):
+        """ Simulate the steps of a batch of input sequences, along dimension t_dim of batch_u
+
+        Returns
+        -------
+        tuple (Tensor, Tensor, Tensor). Size: (q, m, n_y) for t_dim=1, (m, q, n_y) for t_dim=0, (q, n_a), (q, n_b)
+            Simulated output at the steps and regressors with past values of y and u after the last step
+
+        """
+        Y_list = []
+        phi_buf = IORegressorBuffer(batch_y_seq, batch_u_seq)
+        for u_step in batch_u.unbind(t_dim):
+            yi = self.io_model(phi_buf.phi())
+            Y_list.append(yi)
+            phi_buf.push(yi, u_step)
+        y_seq, u_seq = phi_buf.regressors()
+        return torch.stack(Y_list, t_dim), y_seq, u_seq
+
+    def simulate_checkpoint(self, batch_u, batch_y_seq, batch_u_seq, checkpoint_every, batch_first=True):
+        """ Multi-step simulation with checkpointed backward pass
+
+        The input sequences are split into segments of checkpoint_every steps, each simulated without recording
+        the autograd graph. Only the regressors at the beginning of each segment and the simulated outputs are
+        kept for the backward pass, where the graph of each segment is recorded again and back-propagated,
+        one segment at a time. The gradients must be computed with backward(), not with torch.autograd.grad.
 
-            # y shift
-            batch_y_seq[:, 1:] = batch_y_seq[:, 0:-1]
-            batch_y_seq[:, [0]] = yi[:]
+        Parameters
+        ----------
+        batch_u: Tensor. Size: (q, m, n_u), or (m, q, n_u) if batch_first=False
+                 Input sequence for each subsequence in the minibatch
+
+        batch_y_seq: Tensor. Size: (q, n_a)
+                 Initial regressor with past values of y for each subsequence in the minibatch
+
+        batch_u_seq: Tensor. Size: (q, n_b)
+                 Initial regressor with past values of u for each subsequence in the minibatch
+
+        checkpoint_every: int
+                 Number of steps of a checkpointed segment
 
-            # u shift
-            batch_u_seq[:, 1:] = batch_u_seq[:, 0:-1]
-            batch_u_seq[:, [0]] = batch_u[:, i]
+        batch_first: bool
+                 If False, the input and the simulated output are time-major
+
+        Returns
+        -------
+        Tensor. Size: (q, m, n_y), or (m, q, n_y) if batch_first=False
+            Simulated output for all subsequences in the minibatch
 
-        Y_sim = torch.stack(Y_sim_list, 1)
+        """
+        t_dim = 1 if batch_first else 0
+        seq_len = batch_u.shape[t_dim]
+        Y_seg_list = []
+        y_seq, u_seq = batch_y_seq, batch_u_seq
+        if not y_seq.requires_grad:
+            y_seq = y_seq.detach().requires_grad_(True)  # otherwise, the segments would not propagate gradients
+        for start in range(0, seq_len, checkpoint_every):
+            u_seg = batch_u.narrow(t_dim, start, min(checkpoint_every, seq_len - start))
+            Y_seg, y_seq, u_seq = checkpoint(self.simulate_steps, u_seg, y_seq, u_seq, t_dim, use_reentrant=True)
+            Y_seg_list.append(Y_seg)
+        Y_sim = torch.cat(Y_seg_list, t_dim)
         return Y_sim
+
+    def simulate_many(self, batch_y_seq, batch_u_seq, U_list):
+        """ Open-loop simulation of several experiments with ragged lengths, as one batched rollout
+
+        The experiments are sorted by decreasing length and the batch shrinks as the shorter ones end,
+        so that no padded steps are simulated.
+
+        Parameters
+        ----------
+        batch_y_seq: Tensor. Size: (E, n_a)
+                 Initial regressor with past values of y of each experiment
+
+        batch_u_seq: Tensor. Size: (E, n_b)
+                 Initial regressor with past values of u of each experiment
+
+        U_list: list of Tensor. Size: (N_e, n_u)
+                 Input sequence of each experiment
+
+        Returns
+        -------
+        list of Tensor. Size: (N_e, n_y)
+            Open-loop simulation of the output of each experiment
+
+        """
+
+        batch = RaggedBatch(U_list)
+        U_pad = batch.padded
+
+        Y_steps = []
+        phi_buf = IORegressorBuffer(batch.sort(batch_y_seq), batch.sort(batch_u_seq))
+        for i, num_active in enumerate(batch.num_active):
+            phi_buf.narrow(num_active)
+            phi = phi_buf.phi()
+            yi = self.io_model(phi)
+            Y_steps.append(yi)
+
+            # y and u shift
+            phi_buf.push(yi, U_pad[:num_active, i])
+
+        return batch.split(Y_steps)
@@ -0,0 +1,180 @@
+""" Model predictive control with the identified neural SS models
+
+    SuccessiveLinearizationMPC is a real-time-iteration MPC: at each time step, the neural model is rolled out
+    over the prediction horizon from the current state with the input sequence of the previous solution (shifted
+    by one step), it is linearized along the predicted trajectory with a single batched Jacobian evaluation,
+    and the resulting linear time-varying QP is solved once.
+"""
+import numpy as np
+import torch
+from scipy.optimize import lsq_linear
+from torchid.ssfitter import NeuralStateSpaceSimulator
+
+
+def linearize_trajectory(ss_model, x_seq, u_seq):
+    """ Linearize the discrete-time neural model x_{k+1} = x_k + ss_model(x_k, u_k) along a trajectory, with a
+        single vectorized Jacobian evaluation (torch.func.vmap of torch.func.jacrev) over all the time steps.
+
+    Parameters
+    ----------
+    ss_model: nn.Module
+              The neural SS model
+    x_seq: Tensor. Size: (N, n_x)
+              States of the trajectory
+    u_seq: Tensor. Size: (N, n_u)
+              Inputs of the trajectory
+
+    Returns
+    -------
+    tuple (Tensor, Tensor). Sizes: (N, n_x, n_x), (N, n_x, n_u)
+          Jacobians A_k = d x_{k+1} / d x_k and B_k = d x_{k+1} / d u_k at each time step, without autograd graph
+
+    """
+    x_seq = x_seq.detach()
+    u_seq = u_seq.detach()
+    with torch.no_grad():  # jacrev differentiates anyway, the graph w.r.t. the model parameters is not recorded
+        jac_x, jac_u = torch.func.vmap(torch.func.jacrev(ss_model, argnums=(0, 1)))(x_seq, u_seq)
+    A = jac_x + torch.eye(x_seq.shape[-1], dtype=jac_x.dtype, device=jac_x.device)
+    return A, jac_u
+
+
+def _sqrtm_psd(Q):
+    """ Symmetric square root of a positive semi-definite matrix (possibly scipy.sparse) """
+    Q = Q.toarray() if hasattr(Q, 'toarray') else np.atleast_2d(np.asarray(Q, dtype=np.float64))
+    w, V = np.linalg.eigh((Q + Q.T) / 2)
+    return (V * np.sqrt(np.maximum(w, 0.0))) @ V.T
+
+
+class SuccessiveLinearizationMPC(object):
+    """ Successive-linearization MPC based on a neural SS model, with the interface of pyMPC.MPCController
+        (setup, update, output).
+
+        Cost: sum_{k=1}^{Np-1} ||x_k - xref||^2_Qx + ||x_Np - xref||^2_QxN + sum_{k=0}^{Np-1} ||u_k - uref||^2_Qu
+        + ||u_k - u_{k-1}||^2_QDu, with u_{-1} = uminus1, subject to umin <= u_k <= umax.
+        The inputs after the control horizon are kept equal to u_{Nc-1}. The QP in the input sequence is solved
+        as a bounded least-squares problem. The state constraints and the input rate constraints of
+        pyMPC.MPCController are not supported: the input rate is penalized by QDu.
+
+     Attributes
+     ----------
+     ss_model: nn.Module
+           The neural SS model, x_{k+1} = x_k + ss_model(x_k, u_k), with sampling time equal to the MPC one
+     Np: int
+           Prediction horizon
+     Nc: int
+           Control horizon
+     status: str
+           Status of the last solution: 'solved' or 'failed'
+     """
+
+    def __init__(self, ss_model, Np, Nc=None, x0=None, xref=None, uref=None, uminus1=None,
+                 Qx=None, QxN=None, Qu=None, QDu=None, umin=None, umax=None):
+        self.ss_model = ss_model
+        self.nn_solution = NeuralStateSpaceSimulator(ss_model)
+        self.Np = Np
+        self.Nc = Np if Nc is None else Nc
+        self.dtype = next(ss_model.parameters()).dtype
+
+        self.x0 = np.asarray(x0, dtype=np.float64)
+        self.n_x = self.x0.shape[0]
+        self.uminus1 = np.atleast_1d(np.asarray(uminus1, dtype=np.float64))
+        self.n_u = self.uminus1.shape[0]
+        self.xref = np.zeros(self.n_x) if xref is None else np.asarray(xref, dtype=np.float64)
+        self.uref = np.zeros(self.n_u) if uref is None else np.atleast_1d(np.asarray(uref, dtype=np.float64))
+
+        n_x, n_u = self.n_x, self.n_u
+        self.Wx = _sqrtm_psd(np.zeros((n_x, n_x)) if Qx is None else Qx)
+        self.WxN = _sqrtm_psd(np.zeros((n_x, n_x)) if QxN is None else QxN)
+        self.Wu = _sqrtm_psd(np.zeros((n_u, n_u)) if Qu is None else Qu)
+        self.WDu = _sqrtm_psd(np.zeros((n_u, n_u)) if QDu is None else QDu)
+        umin = -np.inf*np.ones(n_u) if umin is None else np.atleast_1d(umin)
+        umax = np.inf*np.ones(n_u) if umax is None else np.atleast_1d(umax)
+        self.bounds = (np.tile(umin, self.Nc), np.tile(umax, self.Nc))
+
+        # Move blocking: U = M U_c
+        block_idx = np.minimum(np.arange(self.Np), self.Nc - 1)
+        self.M = np.kron(np.eye(self.Nc)[block_idx], np.eye(n_u))
+        # Input differences: D U - [uminus1, 0, ..., 0]
+        self.D = np.kron(np.eye(self.Np) - np.eye(self.Np, k=-1), np.eye(n_u))
+        # Weights of the state residuals for k = 1, ..., Np
+        self.Wx_all = np.kron(np.eye(self.Np), self.Wx)
+        self.Wx_all[-n_x:, -n_x:] = self.WxN
+        self.Wu_all = np.kron(np.eye(self.Np), self.Wu)
+        self.WDu_all = np.kron(np.eye(self.Np), self.WDu)
+
+        self.U_c = np.tile(np.clip(self.uminus1, umin, umax), self.Nc)  # current solution, control horizon
+        self.x_seq = None
+        self.status = None
+
+    def rollout(self, x0, U):
+        """ Simulate the neural model over the prediction horizon. Returns the states x_0, ..., x_Np """
+        U_ext = np.vstack((U, U[-1:]))
+        with torch.no_grad():
+            x_seq = self.nn_solution.f_sim(torch.tensor(x0, dtype=self.dtype), torch.tensor(U_ext, dtype=self.dtype))
+        return x_seq
+
+    def solve(self):
+        """ Solve the MPC problem at the current state, linearizing the model along the trajectory predicted
+            with the previous solution shifted by one step """
+        n_x, n_u, Np = self.n_x, self.n_u, self.Np
+        U_c_nom = np.concatenate((self.U_c[n_u:], self.U_c[-n_u:]))  # shift (warm start)
+        U_nom = (self.M @ U_c_nom).reshape(Np, n_u)
+        x_seq_nom = self.rollout(self.x0, U_nom)
+        A, B = linearize_trajectory(self.ss_model, x_seq_nom[:-1], torch.tensor(U_nom, dtype=self.dtype))
+        A = A.numpy().astype(np.float64)
+        B = B.numpy().astype(np.float64)
+        X_nom = x_seq_nom[1:].numpy().astype(np.float64).ravel()
+
+        # Prediction matrix: x_{k+1} - x_{k+1}^nom = G_{k+1} (U - U^nom), with G_0 = 0
+        G = np.zeros((Np * n_x, Np * n_u))
+        G_k = np.zeros((n_x, Np * n_u))
+        for k in range(Np):
+            G_k = A[k] @ G_k
+            G_k[:, k*n_u:(k+1)*n_u] = B[k]
+            G[k*n_x:(k+1)*n_x] = G_k
+
+        # Bounded least squares in U_c
+        xref = np.broadcast_to(self.xref, (Np, n_x)).ravel() if self.xref.ndim == 1 else self.xref[1:Np+1].ravel()
+        GM = G @ self.M
+        du_ref = np.zeros(Np * n_u)
+        du_ref[:n_u] = self.uminus1
+        A_ls = np.vstack((self.Wx_all @ GM, self.Wu_all @ self.M, self.WDu_all @ (self.D @ self.M)))
+        b_ls = np.concatenate((self.Wx_all @ (xref - X_nom + G @ U_nom.ravel()),
+                               self.Wu_all @ np.tile(self.uref, Np),
+                               self.WDu_all @ du_ref))
+        res = lsq_linear(A_ls, b_ls, bounds=self.bounds, method='bvls')
+        self.status = 'solved' if res.status > 0 else 'failed'
+        if self.status == 'solved':
+            self.U_c = res.x
+            X_pred = X_nom + G @ (self.M @ self.U_c - U_nom.ravel())
+            self.x_seq = np.vstack((self.x0, X_pred.reshape(Np, n_x)))
+        return self.status
+
+    def setup(self, solve=True):
+        if solve:
+            self.solve()
+
+    def update(self, x, u=None, xref=None, solve=True):
+        """ Update the current state, the last applied input and the reference, and solve the MPC problem """
+        self.x0 = np.asarray(x, dtype=np.float64)
+        if u is not None:
+            self.uminus1 = np.atleast_1d(np.asarray(u, dtype=np.float64))
+        if xref is not None:
+            self.xref = np.asarray(xref, dtype=np.float64)
+        if solve:
+            self.solve()
+
+    def output(self, return_x_seq=False, return_u_seq=False, return_status=False):
+        """ First input of the current solution u_0, and optionally a dict with the predicted states (x_seq),
+            the inputs (u_seq) and the status """
+        u_MPC = self.U_c[:self.n_u].copy()
+        info = {}
+        if return_x_seq:
+            info['x_seq'] = self.x_seq
+        if return_u_seq:
+            info['u_seq'] = (self.M @ self.U_c).reshape(self.Np, self.n_u)
+        if return_status:
+            info['status'] = self.status
+        if info:
+            return u_MPC, info
+        return u_MPC
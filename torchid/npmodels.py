@@ -0,0 +1,247 @@
+import numpy as np
+import torch.nn as nn
+from torchid.ssmodels import NeuralStateSpaceModel, NeuralStateSpaceModelLin, DeepNeuralStateSpaceModel,\
+    StateSpaceModelLin, CartPoleStateSpaceModel, CartPoleDeepStateSpaceModel, CTSNeuralStateSpaceModel
+from torchid.iomodels import NeuralIOModel, NeuralIOModelComplex
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# NumPy/numba inference backend
+#
+# A model is converted to the common structure
+#     out = MLP(z) + A @ x + B @ u
+# where z = [x, u] (FEATURE_CAT), or z = [v, w, sin(phi), cos(phi), u] for the cart-pole models with x = [p, v, phi, w]
+# (FEATURE_CARTPOLE), and MLP is a chain of linear layers with activations. Constant output scalings and fixed
+# linear output maps are folded into the last layer. For the IO models, x = phi and there is no input u.
+# All the parameters are stored in float32 and the computations are carried out in float32 as in torch.
+
+FEATURE_CAT = 0
+FEATURE_CARTPOLE = 1
+
+ACT_IDENTITY = 0
+ACT_RELU = 1
+ACT_TANH = 2
+ACT_ELU = 3
+
+ACTIVATIONS = {nn.ReLU: ACT_RELU, nn.Tanh: ACT_TANH, nn.ELU: ACT_ELU}
+
+
+def _to_numpy(param):
+    return np.ascontiguousarray(param.detach().cpu().numpy(), dtype=np.float32)
+
+
+def get_mlp_layers(net, out_map=None, out_scale=1.0):
+    """ Extract the weights, biases and activations of a nn.Sequential of nn.Linear layers and activations.
+
+    Parameters
+    ----------
+    net: nn.Sequential
+              The network
+    out_map: np.array. Size: (n_out, n_net_out)
+              Fixed linear map applied to the output of the network, folded into the last layer
+    out_scale: float
+              Constant scaling of the output of the network, folded into the last layer
+
+    Returns
+    -------
+    tuple (list of np.array, list of np.array, list of int)
+          Weights, biases and activation codes of the layers
+
+    """
+    weights, biases, activations = [], [], []
+    for module in net:
+        if isinstance(module, nn.Linear):
+            weights.append(_to_numpy(module.weight))
+            biases.append(_to_numpy(module.bias) if module.bias is not None
+                          else np.zeros(module.out_features, dtype=np.float32))
+            activations.append(ACT_IDENTITY)
+        elif type(module) in ACTIVATIONS and weights and activations[-1] == ACT_IDENTITY:
+            if type(module) is nn.ELU and module.alpha != 1.0:
+                raise ValueError("Only nn.ELU with alpha=1.0 is supported")
+            activations[-1] = ACTIVATIONS[type(module)]
+        else:
+            raise ValueError(f"Unsupported layer {module}")
+
+    if out_map is not None:
+        weights[-1] = np.ascontiguousarray(out_map @ weights[-1], dtype=np.float32)
+        biases[-1] = np.ascontiguousarray(out_map @ biases[-1], dtype=np.float32)
+    if out_scale != 1.0:
+        weights[-1] = weights[-1] * np.float32(out_scale)
+        biases[-1] = biases[-1] * np.float32(out_scale)
+    return weights, biases, activations
+
+
+def get_model_spec(model):
+    """ Convert a model of torchid.ssmodels or torchid.iomodels to the common structure of the NumPy backend.
+
+    Parameters
+    ----------
+    model: nn.Module
+              The model
+
+    Returns
+    -------
+    dict
+        The model structure, with keys 'feature', 'weights', 'biases', 'activations', 'A', 'B', 'io'
+
+    """
+    feature = FEATURE_CAT
+    A = None
+    B = None
+    io = False
+    if isinstance(model, (CartPoleStateSpaceModel, CartPoleDeepStateSpaceModel)):
+        feature = FEATURE_CARTPOLE
+        weights, biases, activations = get_mlp_layers(model.net, out_map=_to_numpy(model.WL.weight))
+        A = _to_numpy(model.AL.weight)
+    elif isinstance(model, NeuralStateSpaceModelLin):
+        weights, biases, activations = get_mlp_layers(model.net)
+        A = _to_numpy(model.AL.weight)
+        B = _to_numpy(model.BL.weight)
+    elif isinstance(model, StateSpaceModelLin):
+        # no network: a zero layer
+        n_x, n_u = model.AL.weight.shape[0], model.BL.weight.shape[1]
+        weights, biases, activations = [np.zeros((n_x, n_x + n_u), dtype=np.float32)],\
+            [np.zeros(n_x, dtype=np.float32)], [ACT_IDENTITY]
+        A = _to_numpy(model.AL.weight)
+        B = _to_numpy(model.BL.weight)
+    elif isinstance(model, DeepNeuralStateSpaceModel):
+        weights, biases, activations = get_mlp_layers(model.net, out_scale=model.scale_dx)
+    elif isinstance(model, CTSNeuralStateSpaceModel):
+        weights, biases, activations = get_mlp_layers(model.net, out_scale=model.ts)
+    elif isinstance(model, NeuralStateSpaceModel):
+        weights, biases, activations = get_mlp_layers(model.net)
+    elif isinstance(model, (NeuralIOModel, NeuralIOModelComplex)):
+        weights, biases, activations = get_mlp_layers(model.net)
+        A = _to_numpy(model.const.t())
+        io = True
+    else:
+        raise ValueError(f"Unsupported model class {type(model).__name__}")
+
+    n_x = weights[-1].shape[0] if A is None else A.shape[1]
+    n_out = weights[-1].shape[0]
+    n_u = weights[0].shape[1] - (4 if feature == FEATURE_CARTPOLE else n_x)
+    if A is None:
+        A = np.zeros((n_out, n_x), dtype=np.float32)
+    if B is None:
+        B = np.zeros((n_out, n_u), dtype=np.float32)
+
+    return {'feature': feature, 'weights': tuple(weights), 'biases': tuple(biases),
+            'activations': np.array(activations, dtype=np.int64), 'A': A, 'B': B, 'io': io}
+
+
+def _activation_numpy(z, act):
+    if act == ACT_RELU:
+        return np.maximum(z, 0)
+    elif act == ACT_TANH:
+        return np.tanh(z)
+    elif act == ACT_ELU:
+        return np.where(z > 0, z, np.expm1(np.minimum(z, 0)))
+    return z
+
+
+def _step_numpy(x, u, feature, weights, biases, activations, A, B):
+    x = np.asarray(x, dtype=np.float32)
+    u = np.asarray(u, dtype=np.float32)
+    u = np.broadcast_to(u, x.shape[:-1] + u.shape[-1:])
+    if feature == FEATURE_CARTPOLE:
+        z = np.concatenate((x[..., 1::2], np.sin(x[..., 2:3]), np.cos(x[..., 2:3]), u), -1)
+    else:
+        z = np.concatenate((x, u), -1)
+    for weight, bias, act in zip(weights, biases, activations):
+        z = _activation_numpy(z @ weight.T + bias, act)
+    return z + x @ A.T + u @ B.T
+
+
+def _step_numba(x, u, feature, weights, biases, activations, A, B):
+    n_u = u.shape[0]
+    if feature == FEATURE_CARTPOLE:
+        z = np.empty(4 + n_u, dtype=np.float32)
+        z[0] = x[1]
+        z[1] = x[3]
+        z[2] = np.sin(np.float32(x[2]))
+        z[3] = np.cos(np.float32(x[2]))
+        for j in range(n_u):
+            z[4 + j] = u[j]
+    else:
+        n_x = x.shape[0]
+        z = np.empty(n_x + n_u, dtype=np.float32)
+        for j in range(n_x):
+            z[j] = x[j]
+        for j in range(n_u):
+            z[n_x + j] = u[j]
+
+    for k in range(len(weights)):
+        weight = weights[k]
+        bias = biases[k]
+        act = activations[k]
+        h = np.empty(weight.shape[0], dtype=np.float32)
+        for i in range(weight.shape[0]):
+            acc = bias[i]
+            for j in range(weight.shape[1]):
+                acc += weight[i, j] * z[j]
+            if act == ACT_RELU:
+                acc = max(acc, np.float32(0.0))
+            elif act == ACT_TANH:
+                acc = np.tanh(acc)
+            elif act == ACT_ELU and acc <= 0:
+                acc = np.expm1(acc)
+            h[i] = acc
+        z = h
+
+    out = np.empty(A.shape[0], dtype=np.float32)
+    for i in range(A.shape[0]):
+        acc = z[i]
+        for j in range(A.shape[1]):
+            acc += A[i, j] * np.float32(x[j])
+        for j in range(B.shape[1]):
+            acc += B[i, j] * np.float32(u[j])
+        out[i] = acc
+    return out
+
+
+if numba is not None:
+    _step_numba = numba.njit(_step_numba, cache=True)
+
+
+def convert_model(model, backend='numba'):
+    """ Convert a model of torchid.ssmodels or torchid.iomodels to a NumPy step function, for single-sample
+        evaluations in plain Python/NumPy loops (e.g., controllers and state estimators) without torch dispatch.
+
+        The parameters are copied: later changes of the model are not reflected in the step function.
+
+    Parameters
+    ----------
+    model: nn.Module
+              The model
+    backend: str
+              'numba': step function compiled with numba (1D inputs only). 'numpy': NumPy implementation, supporting
+              batched inputs with the leading dimensions as in the torch model. If numba is not installed, 'numpy'
+              is used
+
+    Returns
+    -------
+    function
+        step(x, u) -> dx for SS models and step(phi) -> y for IO models, with float32 np.array outputs equal to the
+        ones of model.forward up to float32 rounding
+
+    """
+    if backend not in ['numba', 'numpy']:
+        raise ValueError(f"Unknown backend '{backend}'. Available backends: 'numba', 'numpy'")
+    spec = get_model_spec(model)
+    feature, weights, biases, activations, A, B = spec['feature'], spec['weights'], spec['biases'],\
+        spec['activations'], spec['A'], spec['B']
+
+    f_step = _step_numba if (backend == 'numba' and numba is not None) else _step_numpy
+    if spec['io']:
+        u_empty = np.zeros(0, dtype=np.float32)
+
+        def step(phi):
+            return f_step(phi, u_empty, feature, weights, biases, activations, A, B)
+    else:
+        def step(x, u):
+            return f_step(x, u, feature, weights, biases, activations, A, B)
+    return step
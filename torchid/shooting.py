@@ -0,0 +1,276 @@
+import torch
+from torchid.util import get_shooting_segments, get_batch_windows
+
+
+def get_shooting_scales(get_errors, y_idx=None, scale_error=None, scale_consistency=None):
+    """ Scales of the fit and consistency errors of a multiple shooting loss
+
+    Parameters
+    ----------
+    get_errors : callable
+        Function returning the fit and consistency errors at the current hidden state
+    y_idx : list of int or None
+        Indices of the measured state variables. If None, the full state is measured
+    scale_error : Tensor. Size: (n_y), optional
+        Scale of the fit error. If None, the RMS of the initial fit error is used
+    scale_consistency : Tensor. Size: (n_x), optional
+        Scale of the consistency error. If None, scale_error is used (its mean, if only part of the state is measured)
+
+    Returns
+    -------
+    tuple (Tensor, Tensor)
+        Scale of the fit error, scale of the consistency error
+
+    """
+    if scale_error is None:
+        with torch.no_grad():
+            err_fit, _ = get_errors()
+            scale_error = torch.sqrt(torch.mean(err_fit ** 2, dim=(0, 1)))
+    if scale_consistency is None:
+        scale_consistency = scale_error if y_idx is None else torch.mean(scale_error)
+    return scale_error, scale_consistency
+
+
+def get_shooting_loss(err_fit, err_consistency, scale_error, scale_consistency, alpha=0.5):
+    """ Multiple shooting loss from the fit and consistency errors
+
+    Parameters
+    ----------
+    err_fit : Tensor
+        Fit error, last dimension of size n_y
+    err_consistency : Tensor
+        Consistency error, last dimension of size n_x
+    scale_error : Tensor. Size: (n_y)
+        Scale of the fit error
+    scale_consistency : Tensor. Size: (n_x)
+        Scale of the consistency error
+    alpha : float
+        Fit/consistency trade-off constant
+
+    Returns
+    -------
+    tuple (Tensor, Tensor, Tensor)
+        Trade-off loss, fit loss, consistency loss
+
+    """
+    # Compute fit loss
+    err_fit_scaled = err_fit / scale_error
+    loss_fit = torch.mean(err_fit_scaled ** 2)
+
+    # Compute consistency loss
+    err_consistency_scaled = err_consistency / scale_consistency
+    loss_consistency = torch.mean(err_consistency_scaled ** 2)
+
+    # Compute trade-off loss
+    loss = alpha * loss_fit + (1.0 - alpha) * loss_consistency
+    return loss, loss_fit, loss_consistency
+
+
+
+class MultipleShootingLoss(object):
+    """ This class implements the multiple shooting fit criterion for the SS model structure
+
+        The record is split into K consecutive shooting segments of seq_len steps, sharing their boundary samples.
+        All segments are simulated as one batch with f_sim_multistep, each one starting from the hidden state
+        at its first sample. The fit loss penalizes the discrepancy between simulated and measured output, the
+        consistency loss the discrepancy between simulated and hidden state. Since segment k ends at the first
+        sample of segment k+1, the consistency loss also enforces the continuity between segments.
+
+     Attributes
+     ----------
+     nn_solution: NeuralStateSpaceSimulator
+                  The simulator of the neural SS model to be fitted
+     u : Tensor. Size: (N, n_u)
+         Input sequence tensor
+     y : Tensor. Size: (N, n_y)
+         Measured output sequence tensor
+     x_hidden : Tensor. Size: (N, n_x)
+         Hidden state sequence tensor. It is an optimization variable (requires_grad=True)
+     seq_len : int
+         Number of steps m of each shooting segment
+     alpha : float
+         Fit/consistency trade-off constant
+     y_idx : list of int or None
+         Indices of the measured state variables. If None, the full state is measured
+     scale_error : Tensor. Size: (n_y)
+         Scale of the fit error. If None, the RMS of the initial fit error is used
+     scale_consistency: Tensor. Size: (n_x)
+         Scale of the consistency error. If None, scale_error is used (its mean, if only part of the state is measured)
+     batch_first : bool
+         If False, the segments are simulated in the time-major layout and the errors have size (m + 1, K, n)
+     """
+
+    def __init__(self, nn_solution, u, y, x_hidden, seq_len, alpha=0.5, y_idx=None,
+                 scale_error=None, scale_consistency=None, batch_first=True):
+        self.nn_solution = nn_solution
+        self.u = u
+        self.y = y
+        self.x_hidden = x_hidden
+        self.seq_len = seq_len
+        self.alpha = alpha
+        self.y_idx = y_idx
+        self.batch_first = batch_first
+        self.num_segments = (u.shape[0] - 1) // seq_len
+
+        # Scale loss with respect to the initial one
+        self.scale_error, self.scale_consistency = get_shooting_scales(self.get_errors, y_idx,
+                                                                       scale_error, scale_consistency)
+
+    def get_errors(self):
+        """ Simulate all the shooting segments and compute the fit and consistency errors
+
+        Returns
+        -------
+        tuple (Tensor, Tensor). Size: (K, m + 1, n_y), (K, m + 1, n_x), time-major if batch_first=False
+            Fit error and consistency error
+
+        """
+        t_dim = 1 if self.batch_first else 0
+        batch_u = get_shooting_segments(self.u, self.seq_len, batch_first=self.batch_first)
+        batch_y = get_shooting_segments(self.y, self.seq_len, batch_first=self.batch_first)
+        batch_x_hidden = get_shooting_segments(self.x_hidden, self.seq_len, batch_first=self.batch_first)
+        batch_x0_hidden = batch_x_hidden.select(t_dim, 0)
+
+        batch_x_sim = self.nn_solution.f_sim_multistep(batch_x0_hidden, batch_u, batch_first=self.batch_first)
+        batch_y_sim = batch_x_sim if self.y_idx is None else batch_x_sim[..., self.y_idx]
+
+        err_fit = batch_y_sim - batch_y
+        err_consistency = batch_x_sim - batch_x_hidden
+        return err_fit, err_consistency
+
+    def __call__(self):
+        """ Compute the multiple shooting loss
+
+        Returns
+        -------
+        tuple (Tensor, Tensor, Tensor)
+            Trade-off loss, fit loss, consistency loss
+
+        """
+        err_fit, err_consistency = self.get_errors()
+        return get_shooting_loss(err_fit, err_consistency, self.scale_error, self.scale_consistency, self.alpha)
+
+
+def get_shooting_nodes(x, seq_len):
+    """ Samples of a sequence at the shooting nodes k*seq_len, k = 0, ..., K, with K = (N - 1) // seq_len
+
+    Parameters
+    ----------
+    x : Tensor. Size: (N, n)
+        Sequence tensor
+
+    seq_len : int
+        Number of steps between two shooting nodes
+
+    Returns
+    -------
+    Tensor. Size: (K + 1, n)
+        Samples of x at the shooting nodes
+
+    """
+    num_segments = (x.shape[0] - 1) // seq_len
+    return x[0:num_segments*seq_len + 1:seq_len]
+
+
+class NodeShootingLoss(object):
+    """ This class implements the multiple shooting fit criterion with the hidden state at the shooting nodes only
+
+        The record is split into K consecutive shooting segments of seq_len steps, as in MultipleShootingLoss.
+        The hidden state is stored only at the K + 1 shooting nodes k*seq_len, thus the hidden variables (and their
+        optimizer moments) take O(N/seq_len) memory instead of O(N). Each segment is simulated from the hidden
+        state at its first node. The fit loss penalizes the discrepancy between simulated and measured output
+        along the segment, the consistency loss the discrepancy between the simulated state at the end of the
+        segment and the hidden state at the next node.
+
+     Attributes
+     ----------
+     nn_solution: NeuralStateSpaceSimulator
+                  The simulator of the neural SS model to be fitted
+     u : Tensor. Size: (N, n_u)
+         Input sequence tensor
+     y : Tensor. Size: (N, n_y)
+         Measured output sequence tensor
+     x_nodes : Tensor. Size: (K + 1, n_x)
+         Hidden state at the shooting nodes. It is an optimization variable (requires_grad=True)
+     seq_len : int
+         Number of steps m between two shooting nodes
+     alpha : float
+         Fit/consistency trade-off constant
+     y_idx : list of int or None
+         Indices of the measured state variables. If None, the full state is measured
+     scale_error : Tensor. Size: (n_y)
+         Scale of the fit error. If None, the RMS of the initial fit error is used
+     scale_consistency: Tensor. Size: (n_x)
+         Scale of the consistency error. If None, scale_error is used (its mean, if only part of the state is measured)
+     batch_first : bool
+         If False, the segments are simulated in the time-major layout and the fit error has size (m + 1, q, n_y)
+     """
+
+    def __init__(self, nn_solution, u, y, x_nodes, seq_len, alpha=0.5, y_idx=None,
+                 scale_error=None, scale_consistency=None, batch_first=True):
+        self.nn_solution = nn_solution
+        self.u = u
+        self.y = y
+        self.x_nodes = x_nodes
+        self.seq_len = seq_len
+        self.alpha = alpha
+        self.y_idx = y_idx
+        self.batch_first = batch_first
+        self.num_segments = (u.shape[0] - 1) // seq_len
+        if x_nodes.shape[0] != self.num_segments + 1:
+            raise ValueError(f"x_nodes must have {self.num_segments + 1} rows, one per shooting node")
+
+        # Scale loss with respect to the initial one
+        self.scale_error, self.scale_consistency = get_shooting_scales(self.get_errors, y_idx,
+                                                                       scale_error, scale_consistency)
+
+    def get_errors(self, segment_idx=None):
+        """ Simulate the shooting segments from their first node and compute the fit and consistency errors
+
+        Parameters
+        ----------
+        segment_idx : Tensor. Size: (q), optional
+            Indices of the segments to be simulated. If None, all the K segments are simulated
+
+        Returns
+        -------
+        tuple (Tensor, Tensor). Size: (q, m + 1, n_y) or (m + 1, q, n_y) if batch_first=False, (q, n_x)
+            Fit error and consistency error
+
+        """
+        t_dim = 1 if self.batch_first else 0
+        if segment_idx is None:
+            batch_u = get_shooting_segments(self.u, self.seq_len, batch_first=self.batch_first)
+            batch_y = get_shooting_segments(self.y, self.seq_len, batch_first=self.batch_first)
+            batch_x0_hidden = self.x_nodes[:-1]
+            batch_x1_hidden = self.x_nodes[1:]
+        else:
+            batch_start = segment_idx * self.seq_len
+            batch_u = get_batch_windows(self.u, batch_start, self.seq_len + 1, batch_first=self.batch_first)
+            batch_y = get_batch_windows(self.y, batch_start, self.seq_len + 1, batch_first=self.batch_first)
+            batch_x0_hidden = self.x_nodes[segment_idx]
+            batch_x1_hidden = self.x_nodes[segment_idx + 1]
+
+        batch_x_sim = self.nn_solution.f_sim_multistep(batch_x0_hidden, batch_u, batch_first=self.batch_first)
+        batch_y_sim = batch_x_sim if self.y_idx is None else batch_x_sim[..., self.y_idx]
+
+        err_fit = batch_y_sim - batch_y
+        err_consistency = batch_x_sim.select(t_dim, -1) - batch_x1_hidden
+        return err_fit, err_consistency
+
+    def __call__(self, segment_idx=None):
+        """ Compute the multiple shooting loss
+
+        Parameters
+        ----------
+        segment_idx : Tensor. Size: (q), optional
+            Indices of the segments to be simulated. If None, all the K segments are simulated
+
+        Returns
+        -------
+        tuple (Tensor, Tensor, Tensor)
+            Trade-off loss, fit loss, consistency loss
+
+        """
+        err_fit, err_consistency = self.get_errors(segment_idx)
+        return get_shooting_loss(err_fit, err_consistency, self.scale_error, self.scale_consistency, self.alpha)
@@ -1,6 +1,11 @@
 import torch
 import torch.nn as nn
 import numpy as np
+from torch.utils.checkpoint import checkpoint
+from torchid.ssfitter_jit import script_simulators
+from torchid.util import StepBuffer, RaggedBatch
+from torchid.integrators import get_integrator, DormandPrince
+from torchid.ssmodels import supports_fused
  
         
 class NeuralStateSpaceSimulator:
@@ -12,12 +17,42 @@ class NeuralStateSpaceSimulator:
                The neural SS model to be fitted
      Ts: float
          model sampling time
+     jit: bool
+         if True, the simulation loops of f_sim and f_sim_multistep are compiled with TorchScript.
+         Only supported with the 'euler' method
+     method: str or callable
+         integration method: 'euler' (default), 'midpoint', 'rk4', 'dopri5' or a callable step(f, x, u).
+         See torchid.integrators
+     fused: bool
+         if True, and the model supports it, the simulation uses the fused step function of the model,
+         with the input projected for all the steps at once (see torchid.ssmodels)
 
      """
 
-    def __init__(self, ss_model, Ts=1.0):
+    def __init__(self, ss_model, Ts=1.0, jit=False, method='euler', fused=True):
         self.ss_model = ss_model
         self.Ts = Ts
+        self.jit = jit
+        self.method = method
+        self.step = get_integrator(method)
+        self.fused = fused and supports_fused(ss_model)
+        if self.jit and method != 'euler':
+            raise ValueError("TorchScript compilation (jit=True) is only supported with the 'euler' method")
+        if self.jit:
+            self.f_sim_jit, self.f_sim_multistep_jit = script_simulators(ss_model)
+
+    def reset_step(self):
+        """ Reset the state of the integration method at the start of a rollout (sub-step size of DormandPrince),
+            so that the result does not depend on the previous simulations """
+        if hasattr(self.step, 'reset'):
+            self.step.reset()
+
+    def get_step_function(self, U):
+        """ Step function f(x, u) of the model and its input sequence: the fused step function with the projected
+            input if enabled, the model itself with U otherwise """
+        if self.fused:
+            return self.ss_model.fused_step(U)
+        return self.ss_model, U
 
     def f_onestep(self, X, U):
         """ Naive one-step prediction
@@ -37,14 +72,15 @@ class NeuralStateSpaceSimulator:
 
         """
 
+        self.reset_step()
         X_pred = torch.empty(X.shape)
         X_pred[0, :] = X[0, :]
-        DX = self.ss_model(X[0:-1], U[0:-1])
-        X_pred[1:,:] = X[0:-1, :] + DX
+        f, UP = self.get_step_function(U[0:-1])
+        X_pred[1:,:] = self.step(f, X[0:-1], UP)
 
         return X_pred
 
-    def f_sim(self, x0, u):
+    def f_sim(self, x0, u, out=None, checkpoint_every=None):
         """ Open-loop simulation
 
         Parameters
@@ -55,6 +91,14 @@ class NeuralStateSpaceSimulator:
         U : Tensor. Size: (N, n_u)
             Input sequence tensor
 
+        out : Tensor. Size: (N, n_x), optional
+              Preallocated tensor where the simulated state is written. If None, a new tensor is allocated
+
+        checkpoint_every : int, optional
+              If given, and gradients are recorded, the simulation is split into segments of checkpoint_every steps
+              whose intermediate results are not stored, but recomputed during the backward pass
+              (see simulate_checkpoint)
+
         Returns
         -------
         Tensor. Size: (N, n_x)
@@ -62,23 +106,32 @@ class NeuralStateSpaceSimulator:
 
         """
 
+        if checkpoint_every is not None and torch.is_grad_enabled():
+            if out is not None:
+                raise ValueError("A preallocated output is not supported with checkpoint_every")
+            return self.simulate_checkpoint(x0, u, checkpoint_every, dim=0)
+
+        if self.jit and out is None:
+            return self.f_sim_jit(x0, u)
+
+        self.reset_step()
         N = np.shape(u)[0]
         nx = np.shape(x0)[0]
 
-        X_list = []
+        f, up = self.get_step_function(u)
+        up_steps = up.unbind(0)  # a single backward node, instead of one per step
+        X_buf = StepBuffer(N, dim=0, out=out)
         xstep = x0
         for i in range(N):
-            X_list += [xstep]
-            #X[i,:] = xstep
-            ustep = u[i]
-            dx = self.ss_model(xstep, ustep)
-            xstep = xstep + dx
+            X_buf.append(xstep)
+            ustep = up_steps[i]
+            xstep = self.step(f, xstep, ustep)
 
-        X = torch.stack(X_list, 0)
+        X = X_buf.result()
 
         return X
 
-    def f_sim_multistep(self, x0_batch, U_batch):
+    def f_sim_multistep(self, x0_batch, U_batch, out=None, checkpoint_every=None, batch_first=True):
         """ Multi-step simulation over (mini)batches
 
         Parameters
@@ -86,30 +139,161 @@ class NeuralStateSpaceSimulator:
         x0_batch: Tensor. Size: (q, n_x)
              Initial state for each subsequence in the minibatch
 
-        U_batch: Tensor. Size: (q, m, n_u)
+        U_batch: Tensor. Size: (q, m, n_u), or (m, q, n_u) if batch_first=False
             Input sequence for each subsequence in the minibatch
 
+        out: Tensor. Size: (q, m, n_x), or (m, q, n_x) if batch_first=False, optional
+            Preallocated tensor where the simulated state is written. If None, a new tensor is allocated
+
+        checkpoint_every: int, optional
+            If given, and gradients are recorded, only the state every checkpoint_every steps is kept for the
+            backward pass, where the segments are recomputed (see simulate_checkpoint)
+
+        batch_first: bool
+            If False, the input and the simulated state are time-major: the input of a step is a contiguous
+            slice of U_batch and the state of a step is written to a contiguous slice of the result
+
         Returns
         -------
-        Tensor. Size: (q, m, n_x)
+        Tensor. Size: (q, m, n_x), or (m, q, n_x) if batch_first=False
             Simulated state for all subsequences in the minibatch
 
         """
 
-        batch_size = x0_batch.shape[0]
-        n_x = x0_batch.shape[1]
-        seq_len = U_batch.shape[1]
+        t_dim = 1 if batch_first else 0  # time dimension
+        if checkpoint_every is not None and torch.is_grad_enabled():
+            if out is not None:
+                raise ValueError("A preallocated output is not supported with checkpoint_every")
+            return self.simulate_checkpoint(x0_batch, U_batch, checkpoint_every, dim=t_dim)
+
+        if self.jit and out is None:
+            if not batch_first:
+                return self.f_sim_jit(x0_batch, U_batch)  # the open-loop simulator loops over dim 0
+            return self.f_sim_multistep_jit(x0_batch, U_batch)
 
-        X_sim_list = []
+        self.reset_step()
+        seq_len = U_batch.shape[t_dim]
+
+        f, UP_batch = self.get_step_function(U_batch)
+        UP_steps = UP_batch.unbind(t_dim)
+        X_sim_buf = StepBuffer(seq_len, dim=t_dim, out=out)
         xstep = x0_batch
         for i in range(seq_len):
-            X_sim_list += [xstep] #X_sim[:, i, :] = xstep
-            ustep = U_batch[:, i, :]
-            dx = self.ss_model(xstep, ustep)
-            xstep = xstep + dx
+            X_sim_buf.append(xstep)
+            ustep = UP_steps[i]
+            xstep = self.step(f, xstep, ustep)
 
-        X_sim = torch.stack(X_sim_list, 1)#.squeeze(2)
+        X_sim = X_sim_buf.result()
         return X_sim
 
+    def simulate_steps(self, x0, u, dim=0):
+        """ Simulate the steps of an input sequence along dimension dim of u
+
+        Returns
+        -------
+        tuple (Tensor, Tensor)
+            Simulated state at the steps (stacked along dim) and state after the last step
+
+        """
+        f, up = self.get_step_function(u)
+        X_list = []
+        xstep = x0
+        for ustep in up.unbind(dim):
+            X_list.append(xstep)
+            xstep = self.step(f, xstep, ustep)
+        return torch.stack(X_list, dim), xstep
+
+    def simulate_checkpoint(self, x0, u, checkpoint_every, dim=0):
+        """ Simulation with checkpointed backward pass
+
+        The input sequence is split into segments of checkpoint_every steps, each simulated without recording the
+        autograd graph. Only the state at the beginning of each segment and the simulated states are kept for
+        the backward pass, where the graph of each segment is recorded again and back-propagated, one segment
+        at a time. The memory used by the autograd graph is thus reduced to the one of a single segment,
+        at the cost of one additional forward pass. A deterministic integration method is required, since each
+        segment is simulated twice. For the adaptive DormandPrince method, the initial sub-step size of each segment
+        is saved and restored when the segment is recomputed. The gradients must be computed with backward(),
+        not with torch.autograd.grad.
+
+        Parameters
+        ----------
+        x0 : Tensor. Size: (..., n_x)
+             Initial state
+
+        u : Tensor. Size: (N, n_u) or (N, q, n_u) for dim=0, (q, N, n_u) for dim=1
+            Input sequence tensor
+
+        checkpoint_every : int
+            Number of steps of a checkpointed segment
+
+        dim : int
+            Time dimension of u and of the result
+
+        Returns
+        -------
+        Tensor. Size: (N, n_x) or (N, q, n_x) for dim=0, (q, N, n_x) for dim=1
+            Simulated state
+
+        """
+        self.reset_step()
+        N = u.shape[dim]
+        adaptive = isinstance(self.step, DormandPrince)
+
+        def simulate_segment(x0_seg, u_seg, h_seg):
+            if adaptive:
+                h = self.step.h
+                self.step.h = h_seg  # same initial sub-step size in the forward pass and in the recomputation
+            X_seg, x_end = self.simulate_steps(x0_seg, u_seg, dim)
+            if adaptive and torch.is_grad_enabled():
+                self.step.h = h  # recomputation in the backward pass: keep the sub-step size of the last forward pass
+            return X_seg, x_end
+
+        X_seg_list = []
+        xstep = x0
+        if not xstep.requires_grad:
+            xstep = xstep.detach().requires_grad_(True)  # otherwise, the segments would not propagate gradients
+        for start in range(0, N, checkpoint_every):
+            u_seg = u.narrow(dim, start, min(checkpoint_every, N - start))
+            h_seg = self.step.h if adaptive else None
+            X_seg, xstep = checkpoint(simulate_segment, xstep, u_seg, h_seg, use_reentrant=True)
+            X_seg_list.append(X_seg)
+        X = torch.cat(X_seg_list, dim)
+        return X
+
+    def simulate_many(self, x0_batch, U_list):
+        """ Open-loop simulation of several experiments with ragged lengths, as one batched rollout
+
+        The experiments are sorted by decreasing length and the batch shrinks as the shorter ones end,
+        so that no padded steps are simulated.
+
+        Parameters
+        ----------
+        x0_batch: Tensor. Size: (E, n_x)
+             Initial state of each experiment
+
+        U_list: list of Tensor. Size: (N_e, n_u)
+            Input sequence of each experiment
+
+        Returns
+        -------
+        list of Tensor. Size: (N_e, n_x)
+            Open-loop model simulation of each experiment
+
+        """
+
+        self.reset_step()
+        batch = RaggedBatch(U_list)
+        f, U_pad = self.get_step_function(batch.padded)
+        U_steps = U_pad.unbind(1)
+
+        X_steps = []
+        xstep = batch.sort(x0_batch)
+        for i, num_active in enumerate(batch.num_active):
+            xstep = xstep[:num_active]
+            X_steps.append(xstep)
+            xstep = self.step(f, xstep, U_steps[i][:num_active])
+
+        return batch.split(X_steps)
+
 #    def f_residual_fullyobserved(self, X_batch, U_batch):
 #        X_increment = X_batch[:, -1, :] - X_batch[:, 0, :]
@@ -0,0 +1,108 @@
+import torch
+import torch.nn as nn
+from typing import List
+
+
+class NeuralStateSpaceSimulator(nn.Module):
+    """ TorchScript-compatible open-loop simulator for the SS model structure.
+        The whole simulation loop is compiled by torch.jit.script, removing the Python interpreter overhead
+
+     Attributes
+     ----------
+     ss_model: nn.Module
+               The neural SS model. Must be compatible with torch.jit.script
+     """
+
+    def __init__(self, ss_model):
+        super(NeuralStateSpaceSimulator, self).__init__()
+        self.ss_model = ss_model
+
+    def forward(self, x0, u):
+        """ Open-loop simulation
+
+        Parameters
+        ----------
+        x0 : Tensor. Size: (n_x)
+             Initial state
+
+        u : Tensor. Size: (N, n_u)
+            Input sequence tensor
+
+        Returns
+        -------
+        Tensor. Size: (N, n_x)
+            Open-loop model simulation over N steps
+
+        """
+
+        X_list: List[torch.Tensor] = []
+        xstep = x0
+        for i in range(u.shape[0]):
+            X_list.append(xstep)
+            dx = self.ss_model(xstep, u[i])
+            xstep = xstep + dx
+
+        X = torch.stack(X_list, 0)
+        return X
+
+
+class NeuralStateSpaceMultistepSimulator(nn.Module):
+    """ TorchScript-compatible multi-step simulator over (mini)batches for the SS model structure
+
+     Attributes
+     ----------
+     ss_model: nn.Module
+               The neural SS model. Must be compatible with torch.jit.script
+     """
+
+    def __init__(self, ss_model):
+        super(NeuralStateSpaceMultistepSimulator, self).__init__()
+        self.ss_model = ss_model
+
+    def forward(self, x0_batch, U_batch):
+        """ Multi-step simulation over (mini)batches
+
+        Parameters
+        ----------
+        x0_batch: Tensor. Size: (q, n_x)
+             Initial state for each subsequence in the minibatch
+
+        U_batch: Tensor. Size: (q, m, n_u)
+            Input sequence for each subsequence in the minibatch
+
+        Returns
+        -------
+        Tensor. Size: (q, m, n_x)
+            Simulated state for all subsequences in the minibatch
+
+        """
+
+        X_sim_list: List[torch.Tensor] = []
+        xstep = x0_batch
+        for i in range(U_batch.shape[1]):
+            X_sim_list.append(xstep)
+            dx = self.ss_model(xstep, U_batch[:, i, :])
+            xstep = xstep + dx
+
+        X_sim = torch.stack(X_sim_list, 1)
+        return X_sim
+
+
+def script_simulators(ss_model):
+    """ Compile the open-loop and the multi-step simulation loops of a neural SS model with TorchScript.
+        The compiled modules share the parameters of ss_model, thus they can be used for training.
+
+    Parameters
+    ----------
+    ss_model: nn.Module
+              The neural SS model
+
+    Returns
+    -------
+    tuple (torch.jit.ScriptModule, torch.jit.ScriptModule)
+          The compiled open-loop and multi-step simulators
+
+    """
+    f_sim_jit = torch.jit.script(NeuralStateSpaceSimulator(ss_model))
+    f_sim_multistep_jit = torch.jit.script(NeuralStateSpaceMultistepSimulator(ss_model))
+    return f_sim_jit, f_sim_multistep_jit
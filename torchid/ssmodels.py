@@ -6,10 +6,38 @@ Created on Mon Aug  5 11:00:29 2019
 """
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import numpy as np
 from torch.jit import Final
 
 
+# Fused step functions
+#
+# The models below optionally implement fused_step(U), returning a pair (step, UP) for a simulation with input U:
+#  * UP is the part of the model depending on the input only, typically U @ W_u^T + b, where W = [W_x, W_u]
+#    is the weight of the first layer split by columns. It is computed for all the steps at once.
+#  * step(X, UP_k) is a function equal to forward(X, U_k). The weights are split/transposed once per simulation,
+#    the per-step concatenation torch.cat((X, U), -1) is avoided and the first layer reduces to a single
+#    addmm X @ W_x^T + UP_k. Constant output scalings and fixed linear output maps are folded into the last layer.
+# The simulators use the fused step function when available (see supports_fused).
+
+
+def supports_fused(ss_model):
+    """ True if the model implements fused_step in the same class as forward, i.e., it is not inherited
+        by a subclass that overrides forward """
+    for cls in type(ss_model).__mro__:
+        if 'forward' in cls.__dict__:
+            return 'fused_step' in cls.__dict__
+    return False
+
+
+def fused_linear(X, UP, weight_x_t):
+    """ First layer of a fused step function: X @ weight_x_t + UP """
+    if X.dim() == 2 and UP.dim() == 2:
+        return torch.addmm(UP, X, weight_x_t)
+    return UP + torch.matmul(X, weight_x_t)
+
+
 class NeuralStateSpaceModel(nn.Module):
 
     """ This class implements a state-space neural model with structure
@@ -47,6 +75,18 @@ class NeuralStateSpaceModel(nn.Module):
         DX = self.net(XU)
         return DX
 
+    def fused_step(self, U):
+        weight_x, weight_u = self.net[0].weight.split([self.n_x, self.n_u], dim=1)
+        UP = F.linear(U, weight_u, self.net[0].bias)
+        weight_x_t = weight_x.t()
+        weight_out, bias_out = self.net[2].weight, self.net[2].bias
+
+        def step(X, UP_k):
+            H = torch.relu(fused_linear(X, UP_k, weight_x_t))
+            DX = F.linear(H, weight_out, bias_out)
+            return DX
+        return step, UP
+
 
 class NeuralStateSpaceModelLin(nn.Module):
     """ This class implements a state-space neural model with structure
@@ -85,6 +125,21 @@ class NeuralStateSpaceModelLin(nn.Module):
         DX += self.AL(X) + self.BL(U)
         return DX   
 
+    def fused_step(self, U):
+        # the linear part BL(U) is added to the bias of the output layer
+        weight_x, weight_u = self.net[0].weight.split([2, 1], dim=1)
+        UP = torch.cat((F.linear(U, weight_u, self.net[0].bias), self.BL(U) + self.net[2].bias), -1)
+        n_feat = self.net[0].out_features
+        weight_x_t = weight_x.t()
+        weight_out_t = self.net[2].weight.t()
+        weight_AL_t = self.AL.weight.t()
+
+        def step(X, UP_k):
+            H = torch.relu(fused_linear(X, UP_k[..., :n_feat], weight_x_t))
+            DX = fused_linear(H, UP_k[..., n_feat:], weight_out_t) + torch.matmul(X, weight_AL_t)
+            return DX
+        return step, UP
+
 
 class DeepNeuralStateSpaceModel(nn.Module):
     n_x: Final[int]
@@ -119,6 +174,20 @@ class DeepNeuralStateSpaceModel(nn.Module):
         dx = dx * self.scale_dx
         return dx
 
+    def fused_step(self, in_u):
+        weight_x, weight_u = self.net[0].weight.split([self.n_x, self.n_u], dim=1)
+        in_up = F.linear(in_u, weight_u, self.net[0].bias)
+        weight_x_t = weight_x.t()
+        weight_hidden, bias_hidden = self.net[2].weight, self.net[2].bias
+        weight_out, bias_out = self.net[4].weight * self.scale_dx, self.net[4].bias * self.scale_dx
+
+        def step(in_x, in_up_k):
+            h = torch.relu(fused_linear(in_x, in_up_k, weight_x_t))
+            h = torch.relu(F.linear(h, weight_hidden, bias_hidden))
+            dx = F.linear(h, weight_out, bias_out)
+            return dx
+        return step, in_up
+
 class StateSpaceModelLin(nn.Module):
     def __init__(self, AL, BL):
         super(StateSpaceModelLin, self).__init__()
@@ -132,6 +201,15 @@ class StateSpaceModelLin(nn.Module):
         DX = self.AL(X) + self.BL(U)
         return DX   
 
+    def fused_step(self, U):
+        UP = self.BL(U)
+        weight_AL_t = self.AL.weight.t()
+
+        def step(X, UP_k):
+            DX = fused_linear(X, UP_k, weight_AL_t)
+            return DX
+        return step, UP
+
 
 class CartPoleStateSpaceModel(nn.Module):
     def __init__(self, Ts, init_small=True):
@@ -160,12 +238,68 @@ class CartPoleStateSpaceModel(nn.Module):
                                                           [0., 1.]]), requires_grad=False)
 
     def forward(self, X, U):
-        X_feat = torch.cat((X[..., [1, 3]], torch.sin(X[..., [2]]), torch.cos(X[..., [2]])), dim=-1) # takes p, w, sin(phi), cos(phi)
+        X_feat = torch.cat((X[..., 1:2], X[..., 3:4], torch.sin(X[..., 2:3]), torch.cos(X[..., 2:3])), dim=-1) # takes p, w, sin(phi), cos(phi)
         XU = torch.cat((X_feat,U),-1)
         FX_TMP = self.net(XU)
         DX = (self.WL(FX_TMP) + self.AL(X))
         return DX
 
+    def fused_step(self, U):
+        # the fixed output map WL is folded into the last layer
+        weight_x, weight_u = self.net[0].weight.split([4, 1], dim=1)
+        UP = F.linear(U, weight_u, self.net[0].bias)
+        weight_x_t = weight_x.t()
+        weight_out = torch.matmul(self.WL.weight, self.net[2].weight)
+        bias_out = torch.matmul(self.WL.weight, self.net[2].bias)
+        weight_AL_t = self.AL.weight.t()
+
+        def step(X, UP_k):
+            X_feat = torch.cat((X[..., 1:2], X[..., 3:4], torch.sin(X[..., 2:3]), torch.cos(X[..., 2:3])), dim=-1) # takes p, w, sin(phi), cos(phi)
+            H = torch.tanh(fused_linear(X_feat, UP_k, weight_x_t))
+            DX = F.linear(H, weight_out, bias_out) + torch.matmul(X, weight_AL_t)
+            return DX
+        return step, UP
+
+
+class CartPoleFastStateSpaceModel(CartPoleStateSpaceModel):
+    """ Same model as CartPoleStateSpaceModel, with the same parameters and state dict, written to minimize the
+        per-call overhead (e.g., for closed-loop simulations and MPC). The fixed kinematic part
+        dp = Ts*v, dphi = Ts*w (AL) and the mapping of the two network outputs to dv, dw (WL) are applied
+        by slicing instead of dense matrix products.
+
+        x = [p, v, phi, w], u = [F]
+    """
+
+    def __init__(self, Ts, init_small=True):
+        super(CartPoleFastStateSpaceModel, self).__init__(Ts, init_small)
+        self.Ts = float(Ts)
+
+    def forward(self, X, U):
+        VW = X[..., 1::2]  # v, w
+        phi = X[..., 2:3]
+        XU = torch.cat((VW, torch.sin(phi), torch.cos(phi), U), -1)
+        H = torch.tanh(F.linear(XU, self.net[0].weight, self.net[0].bias))
+        FX_TMP = F.linear(H, self.net[2].weight, self.net[2].bias)
+        DX = torch.stack((self.Ts*VW, FX_TMP), -1).flatten(-2)  # Ts*v, FX_0, Ts*w, FX_1
+        return DX
+
+    def fused_step(self, U):
+        weight_x, weight_u = self.net[0].weight.split([4, 1], dim=1)
+        UP = F.linear(U, weight_u, self.net[0].bias)
+        weight_x_t = weight_x.t()
+        weight_out, bias_out = self.net[2].weight, self.net[2].bias
+        Ts = self.Ts
+
+        def step(X, UP_k):
+            VW = X[..., 1::2]  # v, w
+            phi = X[..., 2:3]
+            X_feat = torch.cat((VW, torch.sin(phi), torch.cos(phi)), -1)
+            H = torch.tanh(fused_linear(X_feat, UP_k, weight_x_t))
+            FX_TMP = F.linear(H, weight_out, bias_out)
+            DX = torch.stack((Ts*VW, FX_TMP), -1).flatten(-2)  # Ts*v, FX_0, Ts*w, FX_1
+            return DX
+        return step, UP
+
 
 class CartPoleDeepStateSpaceModel(nn.Module):
     def __init__(self, Ts, init_small=True):
@@ -198,12 +332,30 @@ class CartPoleDeepStateSpaceModel(nn.Module):
                                                           [0., 1.]]), requires_grad=False)
 
     def forward(self, X, U):
-        X_feat = torch.cat((X[..., [1, 3]], torch.sin(X[..., [2]]), torch.cos(X[..., [2]])), dim=-1) # takes p, w, sin(phi), cos(phi)
+        X_feat = torch.cat((X[..., 1:2], X[..., 3:4], torch.sin(X[..., 2:3]), torch.cos(X[..., 2:3])), dim=-1) # takes p, w, sin(phi), cos(phi)
         XU = torch.cat((X_feat, U), -1)
         FX_TMP = self.net(XU)
         DX = (self.WL(FX_TMP) + self.AL(X))
         return DX
 
+    def fused_step(self, U):
+        # the fixed output map WL is folded into the last layer
+        weight_x, weight_u = self.net[0].weight.split([4, 1], dim=1)
+        UP = F.linear(U, weight_u, self.net[0].bias)
+        weight_x_t = weight_x.t()
+        weight_hidden, bias_hidden = self.net[2].weight, self.net[2].bias
+        weight_out = torch.matmul(self.WL.weight, self.net[4].weight)
+        bias_out = torch.matmul(self.WL.weight, self.net[4].bias)
+        weight_AL_t = self.AL.weight.t()
+
+        def step(X, UP_k):
+            X_feat = torch.cat((X[..., 1:2], X[..., 3:4], torch.sin(X[..., 2:3]), torch.cos(X[..., 2:3])), dim=-1) # takes p, w, sin(phi), cos(phi)
+            H = torch.relu(fused_linear(X_feat, UP_k, weight_x_t))
+            H = torch.relu(F.linear(H, weight_hidden, bias_hidden))
+            DX = F.linear(H, weight_out, bias_out) + torch.matmul(X, weight_AL_t)
+            return DX
+        return step, UP
+
 
 class CTSNeuralStateSpaceModel(nn.Module):
     """ This class implements a state-space neural model with structure
@@ -240,4 +392,17 @@ class CTSNeuralStateSpaceModel(nn.Module):
     def forward(self, X, U):
         XU = torch.cat((X, U), -1)
         DX = self.net(XU) * self.ts
-        return DX
\ No newline at end of file
+        return DX
+
+    def fused_step(self, U):
+        # the scaling ts is folded into the last layer
+        weight_x, weight_u = self.net[0].weight.split([self.n_x, self.n_u], dim=1)
+        UP = F.linear(U, weight_u, self.net[0].bias)
+        weight_x_t = weight_x.t()
+        weight_out, bias_out = self.net[2].weight * self.ts, self.net[2].bias * self.ts
+
+        def step(X, UP_k):
+            H = torch.relu(fused_linear(X, UP_k, weight_x_t))
+            DX = F.linear(H, weight_out, bias_out)
+            return DX
+        return step, UP
\ No newline at end of file
@@ -0,0 +1,207 @@
+""" Monte Carlo experiment runner
+
+    A sweep runs a simulation function sim_fun(sim_options) -> simout (dict) over a grid of option dicts in a
+    process pool. The results are written incrementally to the output directory, one case at a time:
+     * <case_id>.npz: the array-valued entries of simout, one column per key (written atomically)
+     * index.jsonl: one line per completed case with its options, seed, computational time, status and summary
+    An interrupted sweep is resumed by running it again with the same output directory: the cases already
+    completed are skipped. Each case is identified by a hash of its options, hence the results do not depend on
+    the order of the cases, on the number of workers, or on the cases added to the grid later.
+"""
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import itertools
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+
+INDEX_FILENAME = "index.jsonl"
+
+
+def make_grid(base_options=None, **axes):
+    """ Cartesian product of option values.
+
+    Parameters
+    ----------
+    base_options: dict
+              Options shared by all the cases
+    **axes: list
+              Values of each option in the grid, e.g., seed_val=[0, 1, 2], Np=[50, 100]
+
+    Returns
+    -------
+    list of dict
+        The option dicts of the cases
+
+    """
+    base_options = {} if base_options is None else base_options
+    keys = list(axes)
+    return [{**base_options, **dict(zip(keys, values))} for values in itertools.product(*axes.values())]
+
+
+def _to_json(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return repr(obj)
+
+
+def get_case_id(sim_options):
+    """ Identifier of a case: hash of its options. Options that are not JSON-serializable are hashed by repr,
+        which must then be stable across runs (e.g., module-level functions, but not objects printed with
+        their memory address) """
+    options_json = json.dumps(sim_options, sort_keys=True, default=_to_json)
+    return hashlib.sha1(options_json.encode()).hexdigest()[:16]
+
+
+def get_case_seed(case_id, base_seed=0):
+    """ Seed of the random number generators for a case, derived from the case identifier and a base seed """
+    return int(hashlib.sha1(f"{base_seed}-{case_id}".encode()).hexdigest()[:8], 16)
+
+
+def seed_everything(seed):
+    """ Seed the global random number generators of random, numpy and (if imported) torch """
+    random.seed(seed)
+    np.random.seed(seed)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].manual_seed(seed)
+
+
+def _init_worker():
+    # a single thread per worker, the parallelism is over the cases
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(1)
+
+
+def _run_case(sim_fun, sim_options, case_id, seed, output_path, summary_fun):
+    _init_worker()
+    seed_everything(seed)
+    time_start = time.perf_counter()
+    try:
+        simout = sim_fun(sim_options)
+        arrays = {key: np.asarray(val) for key, val in simout.items()
+                  if isinstance(val, (np.ndarray, np.generic, int, float, bool))}
+        tmp_filename = os.path.join(output_path, f"{case_id}.tmp.npz")
+        np.savez_compressed(tmp_filename, **arrays)
+        os.replace(tmp_filename, os.path.join(output_path, f"{case_id}.npz"))
+        summary = summary_fun(simout) if summary_fun is not None else {}
+        status, error = 'done', None
+    except Exception:
+        summary = {}
+        status, error = 'error', traceback.format_exc()
+    return {'case_id': case_id, 'seed': seed, 'status': status, 'time': time.perf_counter() - time_start,
+            'options': sim_options, 'summary': summary, 'error': error}
+
+
+def get_completed_cases(output_path):
+    """ Identifiers of the cases completed successfully in the output directory """
+    completed = set()
+    index_filename = os.path.join(output_path, INDEX_FILENAME)
+    if os.path.exists(index_filename):
+        with open(index_filename) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # truncated line of an interrupted run
+                    continue
+                if record['status'] == 'done' and os.path.exists(os.path.join(output_path, f"{record['case_id']}.npz")):
+                    completed.add(record['case_id'])
+    return completed
+
+
+def run_sweep(sim_fun, cases, output_path, num_workers=None, base_seed=0, summary_fun=None, verbose=True):
+    """ Run a simulation function over a list of cases in a process pool, writing the results incrementally.
+
+        The random number generators of each case are seeded with get_case_seed(case_id, base_seed) before
+        calling sim_fun, in the worker process. Cases completed in a previous (possibly interrupted) run
+        in the same output directory are skipped. Cases raising an exception are recorded with status 'error'
+        and the traceback, and they are run again when the sweep is resumed.
+
+    Parameters
+    ----------
+    sim_fun: function
+              Simulation function sim_fun(sim_options) -> dict. Must be picklable (defined at module level)
+    cases: list of dict
+              The option dicts of the cases (see make_grid)
+    output_path: str
+              Output directory. It is created if it does not exist
+    num_workers: int
+              Number of worker processes. If None, the number of CPUs
+    base_seed: int
+              Base seed of the sweep
+    summary_fun: function
+              Optional function summary_fun(simout) -> dict of scalars, stored in the index
+    verbose: bool
+              If True, print the progress
+
+    Returns
+    -------
+    pandas.DataFrame
+        The index of the sweep (see load_sweep)
+
+    """
+    os.makedirs(output_path, exist_ok=True)
+    completed = get_completed_cases(output_path)
+    case_ids = [get_case_id(sim_options) for sim_options in cases]
+    if len(set(case_ids)) != len(case_ids):
+        raise ValueError("The sweep contains duplicate cases")
+    todo = [(case_id, sim_options) for case_id, sim_options in zip(case_ids, cases) if case_id not in completed]
+    if verbose:
+        print(f"Sweep: {len(cases)} cases, {len(cases) - len(todo)} already completed, {len(todo)} to run")
+
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    ctx = multiprocessing.get_context('spawn')
+    executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx)
+    try:
+        with open(os.path.join(output_path, INDEX_FILENAME), "a") as index_file:
+            futures = [executor.submit(_run_case, sim_fun, sim_options, case_id,
+                                       get_case_seed(case_id, base_seed), output_path, summary_fun)
+                       for case_id, sim_options in todo]
+            for num_done, future in enumerate(as_completed(futures), 1):
+                record = future.result()
+                index_file.write(json.dumps(record, default=_to_json) + "\n")
+                index_file.flush()
+                if verbose:
+                    print(f"[{num_done}/{len(todo)}] case {record['case_id']} {record['status']} "
+                          f"in {record['time']:.1f} s")
+    except BaseException:
+        # interrupted: drop the pending cases, they are run when the sweep is resumed
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    return load_sweep(output_path)
+
+
+def load_sweep(output_path):
+    """ Load the index of a sweep: one row per completed case (the last run of each case), with the columns
+        case_id, seed, status, time, the options (prefixed by 'opt_') and the summary (prefixed by 'sum_') """
+    records = {}
+    with open(os.path.join(output_path, INDEX_FILENAME)) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record['case_id']] = record
+    rows = []
+    for record in records.values():
+        row = {'case_id': record['case_id'], 'seed': record['seed'], 'status': record['status'],
+               'time': record['time']}
+        row.update({f"opt_{key}": val for key, val in record['options'].items()})
+        row.update({f"sum_{key}": val for key, val in record['summary'].items()})
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def load_case(output_path, case_id):
+    """ Load the results of a case as a dict of arrays """
+    with np.load(os.path.join(output_path, f"{case_id}.npz")) as data:
+        return {key: data[key] for key in data.files}
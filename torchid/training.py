@@ -0,0 +1,702 @@
+import os
+import time
+import numpy as np
+import torch
+import torch.optim as optim
+from torchid.util import SubsequenceDataset, get_batch_windows, get_torch_io_regressor, get_torch_regressor_mat, \
+    get_torch_random_batch_start
+from torchid.shooting import MultipleShootingLoss, NodeShootingLoss, get_shooting_nodes
+
+
+class Trainer(object):
+    """ Base class implementing the gradient-based training loop shared by all fitting methods
+
+        Subclasses define the batch extraction (get_batch) and the fit/consistency errors (get_errors).
+        The errors are scaled with respect to the initial ones, the trade-off loss is
+        alpha*loss_fit + (1-alpha)*loss_consistency. The network parameters and the hidden variables
+        are optimized by Adam in two param groups with learning rates lr and lr_hidden. With sparse_hidden=True,
+        the hidden variables must have sparse gradients (only the rows gathered in the batch, see
+        util.get_batch_windows) and they are optimized by a separate torch.optim.SparseAdam, which updates only
+        those rows and their moments (lazy Adam). The cost of an iteration then scales with the batch size,
+        not with the record length. An optional encoder of the initial conditions (see encoders.InitialStateEncoder)
+        is optimized jointly with the network parameters, in the same param group.
+
+        The losses are stored as detached tensors and converted only when printed (every test_freq iterations)
+        or requested with get_loss, thus the training loop does not wait for the device at each iteration.
+
+        With compile=True, the whole training step (batch extraction from the indices drawn by sample_batch,
+        simulation, loss, backward pass and Adam step) is compiled with torch.compile for the shapes of the first
+        batch, i.e., for a fixed (batch_size, seq_len). The backward pass is traced in the same graph as the forward
+        pass, while torch.optim keeps the optimizer step in a separate graph. The first step pays the compilation
+        time. If the batch shapes change afterwards, the step is performed in eager mode, without recompiling.
+        The compile time grows with the number of simulation steps unrolled in the graph (seq_len, or the record
+        length in the 'simerr' mode).
+
+     Attributes
+     ----------
+     model: nn.Module
+            The neural model to be fitted
+     params_hidden: list of Tensor
+            Hidden variables optimized jointly with the model parameters
+     sparse_hidden: bool
+            If True, the hidden variables have sparse gradients and are optimized by optimizer_hidden (SparseAdam)
+     encoder: nn.Module
+            Encoder of the initial conditions from past data. If None, no encoder is used
+     alpha: float
+            Fit/consistency trade-off constant
+     test_freq: int
+            Print a message every test_freq iterations. If 0, nothing is printed
+     checkpoint_freq: int
+            Save a checkpoint to checkpoint_path every checkpoint_freq iterations. If 0, no checkpoint is saved
+     checkpoint_path: str
+            Checkpoint file name
+     hooks: list of callable
+            Functions hook(trainer) called at the end of each iteration
+     compile: bool
+            If True, the training step is compiled with torch.compile. Not supported with sparse_hidden=True
+     timing: dict
+            Cumulated wall-clock time (s) spent in the 'batch', 'forward', 'backward' and 'step' phases, and in the
+            whole 'compiled' steps (including the compilation time).
+            On GPU, the phases are measured on the host side, without synchronization
+     """
+
+    def __init__(self, model, params_hidden=None, alpha=0.5, lr=1e-3, lr_hidden=None, sparse_hidden=False,
+                 encoder=None, compile=False, test_freq=100, checkpoint_freq=0, checkpoint_path="checkpoint.pt"):
+        if compile and sparse_hidden:
+            raise ValueError("The compiled training step does not support sparse hidden variable updates")
+        self.model = model
+        self.encoder = encoder
+        self.params_hidden = params_hidden if params_hidden is not None else []
+        self.sparse_hidden = sparse_hidden
+        self.alpha = alpha
+        self.test_freq = test_freq
+        self.checkpoint_freq = checkpoint_freq
+        self.checkpoint_path = checkpoint_path
+        self.hooks = []
+        self.compile = compile
+        self.compiled_step = None
+        self.compiled_signature = None  # shapes of the batch the step is compiled for
+
+        if lr_hidden is None:
+            lr_hidden = 10*lr
+        params_net = list(model.parameters()) + (list(encoder.parameters()) if encoder is not None else [])
+        param_groups = [{'params': [p for p in params_net if p.requires_grad], 'lr': lr}]
+        self.optimizer_hidden = None
+        if len(self.params_hidden) > 0 and sparse_hidden:
+            self.optimizer_hidden = optim.SparseAdam(self.params_hidden, lr=lr_hidden)
+        elif len(self.params_hidden) > 0:
+            param_groups.append({'params': self.params_hidden, 'lr': lr_hidden})
+        self.optimizer = optim.Adam(param_groups, lr=lr)
+
+        self.itr = 0
+        self.loss_log = []
+        self.timing = {'batch': 0.0, 'forward': 0.0, 'backward': 0.0, 'step': 0.0, 'compiled': 0.0}
+        self.scale_error = None
+        self.scale_consistency = None
+
+    def sample_batch(self):
+        """ Draw the random indices of a batch (None if the batch is not random) """
+        return None
+
+    def get_batch(self, batch_idx=None):
+        """ Extract the data for one training iteration, at the indices batch_idx drawn by sample_batch """
+        raise NotImplementedError
+
+    def get_errors(self, batch):
+        """ Compute the fit error and the consistency error (None if not defined) on a batch """
+        raise NotImplementedError
+
+    def init_scale(self):
+        """ Scale fit and consistency errors with respect to the initial ones """
+        with torch.no_grad():
+            err_fit, err_consistency = self.get_errors(self.get_batch(self.sample_batch()))
+            reduce_dim = tuple(range(err_fit.dim() - 1))
+            self.scale_error = torch.sqrt(torch.mean(err_fit**2, dim=reduce_dim))
+            if err_consistency is not None:
+                if err_consistency.shape[-1] == err_fit.shape[-1]:
+                    self.scale_consistency = self.scale_error
+                else:
+                    self.scale_consistency = torch.mean(self.scale_error)
+
+    def compute_loss(self, batch):
+        """ Compute the scaled trade-off, fit and consistency losses on a batch """
+        err_fit, err_consistency = self.get_errors(batch)
+
+        # Compute fit loss
+        err_fit_scaled = err_fit/self.scale_error
+        loss_fit = torch.mean(err_fit_scaled**2)
+
+        if err_consistency is None:
+            return loss_fit, loss_fit, torch.zeros_like(loss_fit)
+
+        # Compute consistency loss
+        err_consistency_scaled = err_consistency/self.scale_consistency
+        loss_consistency = torch.mean(err_consistency_scaled**2)
+
+        # Compute trade-off loss
+        loss = self.alpha*loss_fit + (1.0-self.alpha)*loss_consistency
+        return loss, loss_fit, loss_consistency
+
+    def get_batch_signature(self, batch_idx):
+        """ Shapes that determine the compiled graph: size of the batch indices and subsequence length """
+        return None if batch_idx is None else tuple(batch_idx.shape), getattr(self, 'seq_len', None)
+
+    def _step(self, batch_idx):
+        """ Training step from the batch indices, compiled when compile=True. Returns the detached losses """
+        loss, loss_fit, loss_consistency = self.compute_loss(self.get_batch(batch_idx))
+        losses = torch.stack((loss.detach(), loss_fit.detach(), loss_consistency.detach()))
+        loss.backward()
+        self.optimizer.step()
+        return losses
+
+    def train_step(self):
+        """ Perform one optimization step. Returns the detached losses """
+        time_start = time.perf_counter()
+        self.optimizer.zero_grad()
+        if self.optimizer_hidden is not None:
+            self.optimizer_hidden.zero_grad()
+        batch_idx = self.sample_batch()
+
+        if self.compile:
+            signature = self.get_batch_signature(batch_idx)
+            if self.compiled_step is None:
+                self.compiled_step = torch.compile(self._step, dynamic=False)
+                self.compiled_signature = signature
+            if signature == self.compiled_signature:
+                if hasattr(torch._dynamo.config, 'trace_autograd_ops'):  # trace the backward pass in the graph
+                    with torch._dynamo.config.patch(trace_autograd_ops=True):
+                        losses = self.compiled_step(batch_idx)
+                else:
+                    losses = self.compiled_step(batch_idx)
+                self.timing['compiled'] += time.perf_counter() - time_start
+                return losses
+
+        batch = self.get_batch(batch_idx)
+        time_batch = time.perf_counter()
+
+        loss, loss_fit, loss_consistency = self.compute_loss(batch)
+        time_forward = time.perf_counter()
+
+        loss.backward()
+        time_backward = time.perf_counter()
+
+        self.optimizer.step()
+        if self.optimizer_hidden is not None:
+            self.optimizer_hidden.step()
+        time_step = time.perf_counter()
+
+        self.timing['batch'] += time_batch - time_start
+        self.timing['forward'] += time_forward - time_batch
+        self.timing['backward'] += time_backward - time_forward
+        self.timing['step'] += time_step - time_backward
+        return torch.stack((loss, loss_fit, loss_consistency)).detach()
+
+    def train(self, num_iter):
+        """ Run num_iter optimization steps """
+        if self.scale_error is None:
+            self.init_scale()
+
+        for _ in range(num_iter):
+            losses = self.train_step()
+            self.loss_log.append(losses)  # no device synchronization here
+
+            if self.test_freq and self.itr % self.test_freq == 0:
+                loss, loss_fit, loss_consistency = losses.tolist()
+                print(f'Iter {self.itr} | Tradeoff Loss {loss:.4f}   '
+                      f'Consistency Loss {loss_consistency:.4f}   Fit Loss {loss_fit:.4f}')
+
+            for hook in self.hooks:
+                hook(self)
+
+            self.itr += 1
+            if self.checkpoint_freq and self.itr % self.checkpoint_freq == 0:
+                self.save_checkpoint(self.checkpoint_path)
+
+    def get_loss(self):
+        """ Loss history. Size: (num_iter, 3). Columns: trade-off loss, fit loss, consistency loss """
+        if len(self.loss_log) == 0:
+            return np.zeros((0, 3), dtype=np.float32)
+        return torch.stack(self.loss_log).cpu().numpy()
+
+    def get_checkpoint(self):
+        """ Model, hidden variables, optimizer state and loss history, as a dictionary """
+        return {
+            'itr': self.itr,
+            'model_state_dict': self.model.state_dict(),
+            'encoder_state_dict': self.encoder.state_dict() if self.encoder is not None else None,
+            'hidden': [p.detach().clone() for p in self.params_hidden],
+            'optimizer_state_dict': self.optimizer.state_dict(),
+            'optimizer_hidden_state_dict': self.optimizer_hidden.state_dict() if self.optimizer_hidden is not None
+            else None,
+            'scale_error': self.scale_error,
+            'scale_consistency': self.scale_consistency,
+            'loss': torch.stack(self.loss_log).cpu() if len(self.loss_log) > 0 else torch.zeros((0, 3)),
+        }
+
+    def set_checkpoint(self, checkpoint):
+        """ Restore a dictionary returned by get_checkpoint """
+        self.itr = checkpoint['itr']
+        self.model.load_state_dict(checkpoint['model_state_dict'])
+        if self.encoder is not None:
+            self.encoder.load_state_dict(checkpoint['encoder_state_dict'])
+        with torch.no_grad():
+            for p, p_saved in zip(self.params_hidden, checkpoint['hidden']):
+                p.copy_(p_saved)
+        self.optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+        if self.optimizer_hidden is not None:
+            self.optimizer_hidden.load_state_dict(checkpoint['optimizer_hidden_state_dict'])
+        self.scale_error = checkpoint['scale_error']
+        self.scale_consistency = checkpoint['scale_consistency']
+        self.loss_log = list(checkpoint['loss'])
+
+    def save_checkpoint(self, path):
+        """ Save model, hidden variables, optimizer state and loss history """
+        torch.save(self.get_checkpoint(), path)
+
+    def load_checkpoint(self, path):
+        """ Restore a checkpoint saved by save_checkpoint and resume training from there """
+        self.set_checkpoint(torch.load(path))
+
+
+class NeuralStateSpaceTrainer(Trainer):
+    """ Trainer for the SS model structure
+
+        Fitting modes:
+         * 'onestep':   one-step prediction error, the full state must be measured (y_idx=None)
+         * 'multistep': multi-step simulation error over random batches of subsequences, with hidden state. If an
+                        encoder is given, the initial state of each subsequence is encoded from the n_k samples
+                        preceding it, and there is no hidden state
+         * 'shooting':  multi-step simulation error over all the shooting segments of the record, with hidden state
+         * 'nodes':     multi-step simulation error over random batches of shooting segments, with hidden state at
+                        the shooting nodes only (see NodeShootingLoss)
+         * 'simerr':    open-loop simulation error over the whole record, from a hidden initial state
+
+     Attributes
+     ----------
+     nn_solution: NeuralStateSpaceSimulator
+                  The simulator of the neural SS model to be fitted
+     u : Tensor. Size: (N, n_u)
+         Input sequence tensor
+     y : Tensor. Size: (N, n_y)
+         Measured output sequence tensor
+     mode : str
+         Fitting mode: 'onestep', 'multistep', 'shooting', 'nodes' or 'simerr'
+     x_hidden : Tensor. Size: (N, n_x)
+         Hidden state sequence. If None, it is initialized with the measured states and zeros elsewhere.
+         In the 'nodes' mode, only its samples at the shooting nodes are kept and optimized. Size: (K + 1, n_x)
+     y_idx : list of int or None
+         Indices of the measured state variables. If None, the full state is measured
+     seq_len : int
+         Subsequence length m for the 'multistep' and 'shooting' modes, number of steps between two shooting
+         nodes for the 'nodes' mode
+     batch_size : int
+         Number of subsequences q for the 'multistep' mode, number of shooting segments for the 'nodes' mode
+         (all the segments if batch_size >= K)
+     batch_first : bool
+         If False, the batches are extracted and simulated in the time-major layout (m, q, n)
+     numpy_sampling : bool
+         If True, the subsequences are drawn with np.random as in get_random_batch_idx (see SubsequenceDataset)
+     """
+
+    def __init__(self, nn_solution, u, y, mode='multistep', x_hidden=None, y_idx=None,
+                 seq_len=64, batch_size=32, batch_first=True, numpy_sampling=False, **kwargs):
+        self.nn_solution = nn_solution
+        self.u = u
+        self.y = y
+        self.mode = mode
+        self.y_idx = y_idx
+        self.seq_len = seq_len
+        self.batch_size = batch_size
+        self.batch_first = batch_first
+        self.numpy_sampling = numpy_sampling
+        self.t_dim = 1 if batch_first else 0  # time dimension of the batches
+        self.num_samples = u.shape[0]
+
+        if mode not in ('onestep', 'multistep', 'shooting', 'nodes', 'simerr'):
+            raise ValueError(f"Unknown fitting mode {mode}")
+        if mode == 'onestep' and y_idx is not None:
+            raise ValueError("One-step prediction error fitting requires the full state to be measured")
+        sparse_hidden = kwargs.get('sparse_hidden', False)
+        if sparse_hidden and mode != 'multistep':
+            raise ValueError("Sparse hidden state updates are only supported in the 'multistep' mode")
+        self.encoder = kwargs.get('encoder', None)
+        if self.encoder is not None and mode != 'multistep':
+            raise ValueError("The initial state encoder is only supported in the 'multistep' mode")
+
+        params_hidden = []
+        if self.encoder is not None:
+            # subsequences of n_k + seq_len samples: n_k past samples for the encoder, seq_len for the fit
+            self.dataset = SubsequenceDataset(u, y, seq_len=self.encoder.n_k + seq_len, batch_size=batch_size,
+                                              numpy_sampling=numpy_sampling, batch_first=batch_first)
+        elif mode != 'onestep':
+            if x_hidden is None and y_idx is None:
+                x_hidden = y
+            elif x_hidden is None:
+                n_x = nn_solution.ss_model.n_x
+                x_hidden = torch.zeros((self.num_samples, n_x), dtype=y.dtype, device=y.device)
+                x_hidden[:, y_idx] = y
+            if mode == 'simerr':
+                x_hidden = x_hidden[0, :]  # only the initial state is optimized
+            if mode == 'nodes':
+                x_hidden = get_shooting_nodes(x_hidden, seq_len)  # only the states at the nodes are optimized
+            x_hidden = x_hidden.detach().clone().requires_grad_(True)  # hidden state is an optimization variable
+            params_hidden = [x_hidden]
+        self.x_hidden = x_hidden
+
+        if mode == 'multistep' and self.encoder is None:
+            self.dataset = SubsequenceDataset(u, y, x_hidden, seq_len=seq_len, batch_size=batch_size,
+                                              numpy_sampling=numpy_sampling, sparse_grad=sparse_hidden,
+                                              batch_first=batch_first)
+        if mode == 'shooting':
+            self.shooting_loss = MultipleShootingLoss(nn_solution, u, y, x_hidden, seq_len=seq_len, y_idx=y_idx,
+                                                      scale_error=1.0, scale_consistency=1.0, batch_first=batch_first)
+        if mode == 'nodes':
+            self.shooting_loss = NodeShootingLoss(nn_solution, u, y, x_hidden, seq_len=seq_len, y_idx=y_idx,
+                                                  scale_error=1.0, scale_consistency=1.0, batch_first=batch_first)
+
+        super(NeuralStateSpaceTrainer, self).__init__(nn_solution.ss_model, params_hidden, **kwargs)
+
+    def sample_batch(self):
+        if self.mode == 'nodes':
+            num_segments = self.shooting_loss.num_segments
+            if self.batch_size >= num_segments:
+                return None  # all the segments
+            return get_torch_random_batch_start(num_segments, self.batch_size, device=self.u.device)
+
+        if self.mode != 'multistep':
+            return None
+        return self.dataset.sample_start()
+
+    def get_batch(self, batch_idx=None):
+        if self.mode == 'nodes':
+            return batch_idx  # indices of the shooting segments
+
+        if self.mode != 'multistep':
+            return None
+
+        if self.encoder is not None:
+            batch_start, (batch_u, batch_y) = self.dataset.get_batch(batch_idx)
+            return batch_u, batch_y
+
+        batch_start, (batch_u, batch_y, batch_x_hidden) = self.dataset.get_batch(batch_idx)
+        batch_x0_hidden = batch_x_hidden.select(self.t_dim, 0)
+        return batch_x0_hidden, batch_u, batch_y, batch_x_hidden
+
+    def output(self, x):
+        return x if self.y_idx is None else x[..., self.y_idx]
+
+    def get_errors(self, batch):
+        if self.mode == 'onestep':
+            x_pred = self.nn_solution.f_onestep(self.y, self.u)
+            return x_pred - self.y, None
+
+        if self.mode == 'simerr':
+            x_sim = self.nn_solution.f_sim(self.x_hidden, self.u)
+            return self.output(x_sim) - self.y, None
+
+        if self.mode == 'shooting':
+            return self.shooting_loss.get_errors()
+
+        if self.mode == 'nodes':
+            return self.shooting_loss.get_errors(batch)
+
+        if self.encoder is not None:
+            batch_u, batch_y = batch
+            n_k = self.encoder.n_k
+            batch_u_past, batch_u = batch_u.split([n_k, self.seq_len], self.t_dim)
+            batch_y_past, batch_y = batch_y.split([n_k, self.seq_len], self.t_dim)
+            if not self.batch_first:
+                batch_y_past, batch_u_past = batch_y_past.transpose(0, 1), batch_u_past.transpose(0, 1)
+            batch_x0 = self.encoder(batch_y_past, batch_u_past)
+            batch_x_sim = self.nn_solution.f_sim_multistep(batch_x0, batch_u, batch_first=self.batch_first)
+            return self.output(batch_x_sim) - batch_y, None
+
+        batch_x0_hidden, batch_u, batch_y, batch_x_hidden = batch
+        batch_x_sim = self.nn_solution.f_sim_multistep(batch_x0_hidden, batch_u, batch_first=self.batch_first)
+        err_fit = self.output(batch_x_sim) - batch_y
+        err_consistency = batch_x_sim - batch_x_hidden
+        return err_fit, err_consistency
+
+
+class NeuralIOTrainer(Trainer):
+    """ Trainer for the IO model structure
+
+        Fitting modes:
+         * 'onestep':   one-step prediction error
+         * 'multistep': multi-step simulation error over random batches of subsequences, with hidden output. If an
+                        encoder is given (with n_x = n_a and n_k >= n_b), the initial output regressor of each
+                        subsequence is encoded from the n_k samples preceding it, and there is no hidden output
+         * 'simerr':    open-loop simulation error over the whole record, from the measured initial regressor
+
+     Attributes
+     ----------
+     io_solution: NeuralIOSimulator
+                  The simulator of the neural IO model to be fitted
+     u : Tensor. Size: (N, 1)
+         Input sequence tensor
+     y : Tensor. Size: (N, 1)
+         Measured output sequence tensor
+     mode : str
+         Fitting mode: 'onestep', 'multistep' or 'simerr'
+     seq_len : int
+         Subsequence length m for the 'multistep' mode
+     batch_size : int
+         Number of subsequences q for the 'multistep' mode
+     batch_first : bool
+         If False, the batches are extracted and simulated in the time-major layout (m, q, n)
+     numpy_sampling : bool
+         If True, the subsequences are drawn with np.random as in get_random_batch_idx (see SubsequenceDataset)
+     """
+
+    def __init__(self, io_solution, u, y, mode='multistep', seq_len=32, batch_size=32, batch_first=True,
+                 numpy_sampling=False, **kwargs):
+        self.io_solution = io_solution
+        self.u = u
+        self.y = y
+        self.mode = mode
+        self.seq_len = seq_len
+        self.batch_size = batch_size
+        self.batch_first = batch_first
+        self.numpy_sampling = numpy_sampling
+        self.t_dim = 1 if batch_first else 0  # time dimension of the batches
+        self.num_samples = u.shape[0]
+        self.n_a = io_solution.io_model.n_a
+        self.n_b = io_solution.io_model.n_b
+        self.n_max = max(self.n_a, self.n_b)
+
+        if mode not in ('onestep', 'multistep', 'simerr'):
+            raise ValueError(f"Unknown fitting mode {mode}")
+        self.sparse_hidden = kwargs.get('sparse_hidden', False)
+        if self.sparse_hidden and mode != 'multistep':
+            raise ValueError("Sparse hidden output updates are only supported in the 'multistep' mode")
+        self.encoder = kwargs.get('encoder', None)
+        if self.encoder is not None and mode != 'multistep':
+            raise ValueError("The initial condition encoder is only supported in the 'multistep' mode")
+        if self.encoder is not None and (self.encoder.n_x != self.n_a or self.encoder.n_k < self.n_b):
+            raise ValueError("The encoder must have n_x = n_a and n_k >= n_b")
+
+        params_hidden = []
+        self.y_hidden = None
+        if mode == 'onestep':
+            self.phi = get_torch_io_regressor(y, u, self.n_a, self.n_b)
+        elif self.encoder is not None:
+            # subsequences of n_k + seq_len samples: n_k past samples for the encoder, seq_len for the fit
+            self.dataset = SubsequenceDataset(u, y, seq_len=self.encoder.n_k + seq_len, batch_size=batch_size,
+                                              numpy_sampling=numpy_sampling, batch_first=batch_first)
+        elif mode == 'multistep':
+            # hidden output, preceded by n_a initial conditions. It is an optimization variable
+            y_pad = torch.zeros((self.n_a, 1), dtype=y.dtype, device=y.device)
+            self.y_hidden = torch.cat((y_pad, y), 0).requires_grad_(True)
+            u_pad = torch.zeros((self.n_b, 1), dtype=u.dtype, device=u.device)
+            self.phi_u = get_torch_regressor_mat(torch.cat((u_pad, u), 0), self.n_b)  # u initial conditions
+            self.dataset = SubsequenceDataset(u, y, seq_len=seq_len, batch_size=batch_size,
+                                              numpy_sampling=numpy_sampling, batch_first=batch_first)
+            params_hidden = [self.y_hidden]
+
+        super(NeuralIOTrainer, self).__init__(io_solution.io_model, params_hidden, **kwargs)
+
+    def sample_batch(self):
+        if self.mode != 'multistep':
+            return None
+        return self.dataset.sample_start()
+
+    def get_batch(self, batch_idx=None):
+        if self.mode != 'multistep':
+            return None
+
+        batch_start, (batch_u, batch_y) = self.dataset.get_batch(batch_idx)
+        if self.encoder is not None:
+            return batch_u, batch_y
+
+        # y_hidden[s:s + n_a] contains y_{s-n_a}, ..., y_{s-1}, the hidden initial condition of a subsequence starting at s
+        batch_y_hidden_initial_cond = get_batch_windows(self.y_hidden, batch_start, self.n_a,
+                                                        sparse_grad=self.sparse_hidden)[..., 0].flip(-1)
+        batch_u_initial_cond = self.phi_u[batch_start]
+        batch_y_hidden = get_batch_windows(self.y_hidden, batch_start + self.n_a, self.seq_len,
+                                           sparse_grad=self.sparse_hidden, batch_first=self.batch_first)
+        return batch_u, batch_y, batch_y_hidden, batch_y_hidden_initial_cond, batch_u_initial_cond
+
+    def get_errors(self, batch):
+        if self.mode == 'onestep':
+            y_pred = self.io_solution.f_onestep(self.phi)
+            return y_pred - self.y[self.n_max:], None
+
+        if self.mode == 'simerr':
+            y_seq = self.y[self.n_max - self.n_a:self.n_max, 0].flip(0)
+            u_seq = self.u[self.n_max - self.n_b:self.n_max, 0].flip(0)
+            y_sim = self.io_solution.f_sim(y_seq, u_seq, self.u[self.n_max:])
+            return y_sim - self.y[self.n_max:], None
+
+        if self.encoder is not None:
+            batch_u, batch_y = batch
+            n_k = self.encoder.n_k
+            batch_u_past, batch_u = batch_u.split([n_k, self.seq_len], self.t_dim)
+            batch_y_past, batch_y = batch_y.split([n_k, self.seq_len], self.t_dim)
+            if not self.batch_first:
+                batch_y_past, batch_u_past = batch_y_past.transpose(0, 1), batch_u_past.transpose(0, 1)
+            batch_y_initial_cond = self.encoder(batch_y_past, batch_u_past)
+            batch_u_initial_cond = batch_u_past[:, n_k - self.n_b:, 0].flip(-1)
+            batch_y_sim = self.io_solution.f_sim_multistep(batch_u, batch_y_initial_cond, batch_u_initial_cond,
+                                                           batch_first=self.batch_first)
+            return batch_y_sim - batch_y, None
+
+        batch_u, batch_y, batch_y_hidden, batch_y_hidden_initial_cond, batch_u_initial_cond = batch
+        batch_y_sim = self.io_solution.f_sim_multistep(batch_u, batch_y_hidden_initial_cond, batch_u_initial_cond,
+                                                       batch_first=self.batch_first)
+        err_fit = batch_y_sim - batch_y
+        err_consistency = batch_y_sim - batch_y_hidden
+        return err_fit, err_consistency
+
+
+class StreamingStateSpaceTrainer(NeuralStateSpaceTrainer):
+    """ Trainer for the SS model structure with multi-step simulation error, for records larger than RAM
+
+        The record is split into chunks of chunk_len samples (the last chunk is aligned to the end of the record,
+        overlapping the previous one, and it owns only the samples after the previous chunk: the overlapping rows
+        are read from disk but written back by the previous chunk only). Training visits one chunk at a time for iters_per_chunk iterations, drawing
+        the batches of subsequences from that chunk only. The input/output chunk is copied to memory from u and y,
+        which may be memory-mapped (see torchid.data). The hidden state and its Adam moments are stored on disk
+        in hidden_path, and only the slices of the current chunk are paged in the optimizer and paged out when
+        moving to the next chunk. The memory used is thus proportional to chunk_len, not to the record length.
+        With sparse_hidden=True, the cost of an iteration is also independent of chunk_len.
+
+     Attributes
+     ----------
+     hidden_path: str
+         Directory of the memory-mapped hidden state (x_hidden.bin) and Adam moments (exp_avg.bin, exp_avg_sq.bin)
+     chunk_len : int
+         Number of samples of a chunk
+     iters_per_chunk : int
+         Number of iterations on a chunk before moving to the next one
+     shuffle : bool
+         If True, the chunks are visited in random order at each pass over the record
+     init_hidden : bool
+         If True, the hidden state is initialized in hidden_path. Otherwise, the hidden state and the Adam moments
+         found in hidden_path are used, e.g. to resume training from a checkpoint in a new process
+     """
+
+    def __init__(self, nn_solution, u, y, hidden_path, chunk_len=100000, iters_per_chunk=100, shuffle=True,
+                 init_hidden=True, y_idx=None, seq_len=64, batch_size=32, **kwargs):
+        if kwargs.get('encoder', None) is not None:
+            raise ValueError("The initial state encoder is not supported by the streaming trainer")
+        self.u_record = u
+        self.y_record = y
+        self.hidden_path = hidden_path
+        self.chunk_len = min(chunk_len, u.shape[0])
+        self.iters_per_chunk = iters_per_chunk
+        self.shuffle = shuffle
+
+        num_samples = u.shape[0]
+        n_x = nn_solution.ss_model.n_x
+        num_chunks = -(-num_samples // self.chunk_len)
+        self.chunk_start = np.minimum(np.arange(num_chunks) * self.chunk_len, num_samples - self.chunk_len)
+        self.chunk_steps = np.zeros(num_chunks, dtype=np.int64)  # Adam step count of the hidden state of each chunk
+        self.chunk_order = []
+        self.chunk = None
+        self.chunk_itr = 0
+
+        # Hidden state on disk, initialized chunk by chunk with the measured states and zeros elsewhere
+        os.makedirs(hidden_path, exist_ok=True)
+        self.x_hidden_disk = self._open_disk("x_hidden.bin", (num_samples, n_x), init_hidden)
+        self.exp_avg_disk = self._open_disk("exp_avg.bin", (num_samples, n_x), init_hidden)
+        self.exp_avg_sq_disk = self._open_disk("exp_avg_sq.bin", (num_samples, n_x), init_hidden)
+        if init_hidden:
+            for start in self.chunk_start:
+                y_chunk = np.asarray(y[start:start + self.chunk_len], dtype=np.float32)
+                if y_idx is None:
+                    self.x_hidden_disk[start:start + self.chunk_len] = y_chunk
+                else:
+                    self.x_hidden_disk[start:start + self.chunk_len, y_idx] = y_chunk
+
+        # In-memory buffers of the current chunk
+        u_chunk = torch.zeros((self.chunk_len, u.shape[1]), dtype=torch.float32)
+        y_chunk = torch.zeros((self.chunk_len, y.shape[1]), dtype=torch.float32)
+        x_hidden_chunk = torch.zeros((self.chunk_len, n_x), dtype=torch.float32)
+        super(StreamingStateSpaceTrainer, self).__init__(nn_solution, u_chunk, y_chunk, mode='multistep',
+                                                         x_hidden=x_hidden_chunk, y_idx=y_idx, seq_len=seq_len,
+                                                         batch_size=batch_size, **kwargs)
+        self.page_in(self._next_chunk())
+
+    def _open_disk(self, filename, shape, init):
+        path = os.path.join(self.hidden_path, filename)
+        if init:
+            with open(path, "wb") as f:
+                f.truncate(int(np.prod(shape)) * 4)  # sparse file of zeros
+        return np.memmap(path, dtype=np.float32, mode='r+', shape=shape)
+
+    def _next_chunk(self):
+        if len(self.chunk_order) == 0:
+            num_chunks = len(self.chunk_start)
+            self.chunk_order = list(np.random.permutation(num_chunks) if self.shuffle else np.arange(num_chunks))
+        return int(self.chunk_order.pop(0))
+
+    def page_in(self, chunk):
+        """ Load input, output, hidden state and its Adam state of a chunk """
+        start = self.chunk_start[chunk]
+        chunk_slice = slice(start, start + self.chunk_len)
+        with torch.no_grad():
+            self.u.copy_(torch.as_tensor(self.u_record[chunk_slice]))
+            self.y.copy_(torch.as_tensor(self.y_record[chunk_slice]))
+            self.x_hidden.copy_(torch.from_numpy(self.x_hidden_disk[chunk_slice]))
+        if self.optimizer_hidden is not None:
+            optimizer, step = self.optimizer_hidden, int(self.chunk_steps[chunk])  # SparseAdam step is an int
+        else:
+            optimizer, step = self.optimizer, torch.tensor(float(self.chunk_steps[chunk]))
+        state = optimizer.state.get(self.x_hidden, {})
+        if self.optimizer_hidden is None and len(state) > 0:
+            # Adam state tensors are updated in place, so that a compiled optimizer step remains valid
+            state['step'].copy_(step)
+            state['exp_avg'].copy_(torch.from_numpy(self.exp_avg_disk[chunk_slice]))
+            state['exp_avg_sq'].copy_(torch.from_numpy(self.exp_avg_sq_disk[chunk_slice]))
+        else:
+            optimizer.state[self.x_hidden] = {
+                'step': step,
+                'exp_avg': torch.from_numpy(np.array(self.exp_avg_disk[chunk_slice])),
+                'exp_avg_sq': torch.from_numpy(np.array(self.exp_avg_sq_disk[chunk_slice])),
+            }
+        self.chunk = chunk
+        self.chunk_itr = 0
+
+    def page_out(self):
+        """ Write the hidden state of the current chunk and its Adam state back to disk """
+        start = self.chunk_start[self.chunk]
+        own_start = self.chunk * self.chunk_len  # the rows before own_start belong to the previous chunk
+        disk_slice = slice(own_start, start + self.chunk_len)
+        own_slice = slice(own_start - start, self.chunk_len)
+        optimizer = self.optimizer_hidden if self.optimizer_hidden is not None else self.optimizer
+        state = optimizer.state[self.x_hidden]
+        self.x_hidden_disk[disk_slice] = self.x_hidden.detach()[own_slice].cpu().numpy()
+        self.exp_avg_disk[disk_slice] = state['exp_avg'][own_slice].cpu().numpy()
+        self.exp_avg_sq_disk[disk_slice] = state['exp_avg_sq'][own_slice].cpu().numpy()
+        self.chunk_steps[self.chunk] = int(state['step'])
+
+    def train_step(self):
+        if self.chunk_itr == self.iters_per_chunk:
+            self.page_out()
+            self.page_in(self._next_chunk())
+        self.chunk_itr += 1
+        return super(StreamingStateSpaceTrainer, self).train_step()
+
+    def get_hidden(self):
+        """ Hidden state of the whole record, as a tensor memory-mapped from disk. Size: (N, n_x) """
+        self.page_out()
+        self.x_hidden_disk.flush()
+        return torch.from_numpy(self.x_hidden_disk)
+
+    def get_checkpoint(self):
+        """ Checkpoint dictionary. The hidden state and its Adam moments are flushed to hidden_path, not copied """
+        self.page_out()
+        for disk in (self.x_hidden_disk, self.exp_avg_disk, self.exp_avg_sq_disk):
+            disk.flush()
+        checkpoint = super(StreamingStateSpaceTrainer, self).get_checkpoint()
+        checkpoint['chunk'] = self.chunk
+        checkpoint['chunk_itr'] = self.chunk_itr
+        checkpoint['chunk_steps'] = torch.from_numpy(self.chunk_steps.copy())
+        return checkpoint
+
+    def set_checkpoint(self, checkpoint):
+        """ Restore a dictionary returned by get_checkpoint, with the hidden state found in hidden_path """
+        super(StreamingStateSpaceTrainer, self).set_checkpoint(checkpoint)
+        self.chunk_steps = checkpoint['chunk_steps'].numpy().copy()
+        self.page_in(checkpoint['chunk'])
+        self.chunk_itr = checkpoint['chunk_itr']
@@ -20,14 +20,200 @@ class RunningAverageMeter(object):
         self.val = val
 
 
+class WriteStep(torch.autograd.Function):
+    """ Differentiable in-place write of one simulation step into a preallocated output tensor.
+
+        Unlike out[idx] = value, whose backward clones the full gradient of out at every step,
+        the backward pass routes the gradient of out unchanged and extracts the slice of value,
+        so that a rollout of N steps costs O(N) in both the forward and the backward pass.
+    """
+
+    @staticmethod
+    def forward(ctx, out, value, idx, dim):
+        ctx.idx = idx
+        ctx.dim = dim
+        out.select(dim, idx).copy_(value)
+        ctx.mark_dirty(out)
+        return out
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        grad_value = grad_out.select(ctx.dim, ctx.idx).clone()
+        return grad_out, grad_value, None, None
+
+
+def write_step(out, idx, value, dim=0):
+    """ Write value into out.select(dim, idx) and return out.
+
+        Under torch.no_grad() this is a plain copy. When gradients are recorded, the write is registered
+        through WriteStep and out may be used as the differentiable output of the rollout.
+    """
+    if torch.is_grad_enabled():
+        return WriteStep.apply(out, value, idx, dim)
+    out.select(dim, idx).copy_(value)
+    return out
+
+
+class StepBuffer(object):
+    """ Collects the steps of a simulation along dimension dim of the output tensor.
+
+        Without gradient recording, or when a preallocated tensor out is given, the steps are written
+        in-place into a single tensor, allocated at the first step if out is None.
+        Otherwise, the steps are collected in a list and stacked at the end, which is faster when the
+        autograd graph is recorded.
+    """
+
+    def __init__(self, seq_len, dim=0, out=None):
+        self.seq_len = seq_len
+        self.dim = dim
+        self.out = out
+        self.idx = 0
+        self.step_list = None
+        if out is None and torch.is_grad_enabled():
+            self.step_list = []
+
+    def append(self, value):
+        if self.step_list is not None:
+            self.step_list += [value]
+        else:
+            if self.out is None:
+                shape = list(value.shape)
+                shape.insert(self.dim, self.seq_len)
+                self.out = torch.empty(shape, dtype=value.dtype, device=value.device)
+            self.out = write_step(self.out, self.idx, value, self.dim)
+        self.idx += 1
+
+    def result(self):
+        if self.step_list is not None:
+            return torch.stack(self.step_list, self.dim)
+        return self.out
+
+
+class RaggedBatch(object):
+    """ Batch of ragged-length (non-empty) sequences, simulated together as one batched rollout.
+
+        The sequences are sorted by decreasing length and zero-padded to the longest one. At step i, only
+        the first num_active[i] sequences of the sorted batch are still running, so that the simulation can shrink
+        the batch instead of computing padded steps. The steps of such a simulation are split back
+        into unpadded per-sequence results, in the original order.
+
+     Attributes
+     ----------
+     order: list of int
+            Indices of the sequences, sorted by decreasing length
+     lengths: list of int
+            Length of each sequence, in the original order
+     padded: Tensor. Size: (E, N_max, n)
+            Sorted and zero-padded sequences
+     num_active: list of int
+            Number of sequences longer than i, for i = 0, ..., N_max - 1
+     """
+
+    def __init__(self, seq_list):
+        self.lengths = [seq.shape[0] for seq in seq_list]
+        self.order = sorted(range(len(seq_list)), key=lambda e: -self.lengths[e])
+        self.padded = torch.nn.utils.rnn.pad_sequence([seq_list[e] for e in self.order], batch_first=True)
+        lengths_ascending = np.sort(self.lengths)
+        num_active = len(seq_list) - np.searchsorted(lengths_ascending, np.arange(self.padded.shape[1]), side='right')
+        self.num_active = num_active.tolist()
+
+    def sort(self, x):
+        """ Sort a tensor of per-sequence values x (e.g., the initial conditions) along its first dimension """
+        return x[self.order]
+
+    def split(self, steps):
+        """ Split the steps of a simulation into per-sequence results
+
+        Parameters
+        ----------
+        steps: list of Tensor. Size: (num_active[i], ...)
+               Simulated value at each step i, for the active sequences
+
+        Returns
+        -------
+        list of Tensor. Size: (lengths[e], ...)
+            Unpadded simulation of each sequence, in the original order
+
+        """
+        num_seq = len(self.order)
+        groups = []
+        i = 0
+        while i < len(steps):  # consecutive steps with the same number of active sequences are stacked together
+            j = i
+            while j < len(steps) and steps[j].shape[0] == steps[i].shape[0]:
+                j += 1
+            group = torch.stack(steps[i:j], 1)
+            pad = [0, 0] * (group.dim() - 1) + [0, num_seq - group.shape[0]]
+            groups.append(torch.nn.functional.pad(group, pad))
+            i = j
+        padded = torch.cat(groups, 1)
+
+        result = [None] * num_seq
+        for rank, e in enumerate(self.order):
+            result[e] = padded[rank, :self.lengths[e]]
+        return result
+
+
 def get_torch_regressor_mat(x, n_a):
-    seq_len = x.shape[0]
-    X = torch.empty((seq_len - n_a + 1, n_a))
-    for idx in range(seq_len - n_a + 1):
-        X[idx] = x[idx:idx + n_a].flip([0])
+    """ Build the regressor matrix with n_a lags of x, most recent sample first.
+
+        Row k contains x[k + n_a - 1], ..., x[k]. For a multi-channel x of size (N, n_ch),
+        lag j occupies columns j*n_ch, ..., (j+1)*n_ch - 1 of the regressor.
+        The lag windows are zero-copy views obtained with unfold, the regressor is filled with a single vectorized copy.
+
+    Parameters
+    ----------
+    x : Tensor. Size: (N) or (N, n_ch)
+        Signal tensor
+
+    n_a : int
+        Number of lags
+
+    Returns
+    -------
+    Tensor. Size: (N - n_a + 1, n_a) or (N - n_a + 1, n_a * n_ch)
+        Regressor matrix
+
+    """
+    x_win = x.unfold(0, n_a, 1)  # (N - n_a + 1, [n_ch], n_a) view, oldest sample first
+    X = x_win.flip(-1)  # most recent sample first
+    if X.ndim == 3:
+        X = X.transpose(1, 2).reshape(X.shape[0], -1)
     return X
 
 
+def get_torch_io_regressor(y, u, n_a, n_b):
+    """ Build the IO regressor phi_k = [y_{k-1}, ..., y_{k-n_a}, u_{k-1}, ..., u_{k-n_b}] for k = n_max, ..., N-1,
+        with n_max = max(n_a, n_b). The corresponding one-step prediction target is y[n_max:]
+
+    Parameters
+    ----------
+    y : Tensor. Size: (N) or (N, n_y)
+        Output sequence tensor
+
+    u : Tensor. Size: (N) or (N, n_u)
+        Input sequence tensor
+
+    n_a : int
+        Number of autoregressive lags in y
+
+    n_b : int
+        Number of autoregressive lags in u
+
+    Returns
+    -------
+    Tensor. Size: (N - n_max, n_a * n_y + n_b * n_u)
+        IO regressor matrix
+
+    """
+    n_max = max(n_a, n_b)
+    N = y.shape[0]
+    phi_y = get_torch_regressor_mat(y[n_max - n_a:N - 1], n_a)
+    phi_u = get_torch_regressor_mat(u[n_max - n_b:N - 1], n_b)
+    phi = torch.cat((phi_y, phi_u), -1)
+    return phi
+
+
 def get_random_batch_idx(num_samples, batch_size, seq_len, batch_first=True):
     batch_start = np.random.choice(np.arange(num_samples - seq_len, dtype=np.int64), batch_size, replace=False) # batch start indices
     batch_idx = batch_start[:,np.newaxis] + np.arange(seq_len) # batch all indices
@@ -36,6 +222,116 @@ def get_random_batch_idx(num_samples, batch_size, seq_len, batch_first=True):
     return batch_start, batch_idx
 
 
+def get_torch_random_batch_start(num_start, batch_size, replace=False, device=None):
+    """ Draw batch_size random subsequence start indices in [0, num_start) with the torch generator
+
+        With replace=True, torch.randint is used. Otherwise, the indices are drawn with torch.randint and the
+        duplicates are redrawn, which costs O(batch_size) when batch_size << num_start.
+    """
+    if replace:
+        return torch.randint(num_start, (batch_size,), device=device)
+    if 4 * batch_size > num_start:
+        return torch.randperm(num_start, device=device)[:batch_size]
+    batch_start = torch.unique(torch.randint(num_start, (batch_size,), device=device))
+    while batch_start.numel() < batch_size:
+        batch_start_new = torch.randint(num_start, (batch_size - batch_start.numel(),), device=device)
+        batch_start = torch.unique(torch.cat((batch_start, batch_start_new)))
+    return batch_start
+
+
+def get_batch_windows(x, batch_start, seq_len, sparse_grad=False, batch_first=True):
+    """ Extract the subsequences x[batch_start[i]:batch_start[i] + seq_len] as a (q, seq_len, n) tensor, or as a
+        contiguous time-major (seq_len, q, n) tensor if batch_first=False.
+
+        The windows of data tensors are indexed from a zero-copy unfold view of x, hence the cost does not depend on
+        the length of x. Tensors that require grad are gathered by index instead, since the backward pass of the
+        unfold view would build a dense (N - seq_len + 1, seq_len, n) gradient. With sparse_grad=True, the rows of x
+        are gathered with torch.nn.functional.embedding(..., sparse=True): the gradient of x is a sparse tensor with
+        the gathered rows only, instead of a dense (N, n) tensor. It is meant for hidden variables optimized by
+        torch.optim.SparseAdam
+    """
+    if sparse_grad or not batch_first or x.requires_grad:
+        batch_start = torch.as_tensor(batch_start, device=x.device)
+        batch_idx = batch_start[:, None] + torch.arange(seq_len, device=x.device)
+        if not batch_first:
+            batch_idx = batch_idx.t()
+        if sparse_grad:
+            return torch.nn.functional.embedding(batch_idx, x, sparse=True)
+        return x[batch_idx]
+    x_win = x.unfold(0, seq_len, 1).transpose(1, 2)  # (N - seq_len + 1, seq_len, n) view
+    return x_win[batch_start]
+
+
+class SubsequenceDataset(object):
+    """ Record of one or more signals, from which random batches of subsequences are extracted.
+
+        The signals are stored once as contiguous tensors (hidden variables may be included and are kept by reference,
+        so that their updates are seen by the following batches). Each batch costs O(batch_size * seq_len),
+        regardless of the record length. With sparse_grad=True, the subsequences of the signals requiring grad are
+        extracted with sparse gradient (see get_batch_windows), so that the backward pass and the optimizer step
+        also cost O(batch_size * seq_len). With batch_first=False, the subsequences are contiguous time-major tensors.
+
+     Attributes
+     ----------
+     signals: list of Tensor. Size: (N, n_i)
+              Signals of the record
+     seq_len: int
+              Length m of the subsequences
+     batch_size: int
+              Number of subsequences q in a batch
+     replace: bool
+              If True, the start indices of a batch are drawn with replacement
+     numpy_sampling: bool
+              If True, the start indices are drawn with numpy through get_random_batch_idx (replace is ignored), which
+              reproduces the batches of the scripts seeded with np.random.seed, at O(N) cost per batch
+     sparse_grad: bool
+              If True, the subsequences of the signals requiring grad have sparse gradient
+     batch_first: bool
+              If True, the subsequences have size (q, m, n_i). Otherwise, (m, q, n_i)
+     """
+
+    def __init__(self, *signals, seq_len=64, batch_size=32, replace=False, numpy_sampling=False, sparse_grad=False,
+                 batch_first=True):
+        self.signals = [s if s.requires_grad else s.contiguous() for s in signals]
+        self.seq_len = seq_len
+        self.batch_size = batch_size
+        self.replace = replace
+        self.numpy_sampling = numpy_sampling
+        self.sparse_grad = sparse_grad
+        self.batch_first = batch_first
+        self.num_samples = self.signals[0].shape[0]
+        self.num_start = self.num_samples - seq_len  # as in get_random_batch_idx
+        self.device = self.signals[0].device
+
+    def sample_start(self):
+        """ Draw the start indices of a batch. Size: (q) """
+        if self.numpy_sampling:
+            batch_start, _ = get_random_batch_idx(self.num_samples, self.batch_size, self.seq_len)
+            return torch.from_numpy(batch_start).to(self.device)
+        return get_torch_random_batch_start(self.num_start, self.batch_size, self.replace, device=self.device)
+
+    def get_batch(self, batch_start=None):
+        """ Extract a batch of subsequences from all the signals
+
+        Parameters
+        ----------
+        batch_start: Tensor. Size: (q), optional
+                     Start indices of the subsequences. If None, they are drawn at random
+
+        Returns
+        -------
+        tuple (Tensor, list of Tensor). Size: (q), (q, m, n_i) or (m, q, n_i) if batch_first=False
+            Start indices and subsequences of each signal
+
+        """
+        if batch_start is None:
+            batch_start = self.sample_start()
+        batch = [get_batch_windows(s, batch_start, self.seq_len, sparse_grad=self.sparse_grad and s.requires_grad,
+                                   batch_first=self.batch_first)
+                 for s in self.signals]
+        return batch_start, batch
+
+
 def get_sequential_batch_idx(num_samples, seq_len, batch_first=True):
     batch_size = num_samples // seq_len
     batch_start = np.arange(0, batch_size, dtype=np.int64) * seq_len
@@ -45,6 +341,34 @@ def get_sequential_batch_idx(num_samples, seq_len, batch_first=True):
     return batch_start, batch_idx
 
 
+def get_shooting_segments(x, seq_len, batch_first=True):
+    """ Split a sequence into consecutive segments sharing their boundary sample.
+
+        Segment k covers samples k*seq_len, ..., (k+1)*seq_len. The result is a zero-copy view of x, or a contiguous
+        time-major copy if batch_first=False.
+
+    Parameters
+    ----------
+    x : Tensor. Size: (N, n)
+        Sequence tensor
+
+    seq_len : int
+        Number of steps in each segment
+
+    batch_first : bool
+        If True, the segments have size (K, seq_len + 1, n). Otherwise, (seq_len + 1, K, n)
+
+    Returns
+    -------
+    Tensor. Size: (K, seq_len + 1, n), or (seq_len + 1, K, n) if batch_first=False, with K = (N - 1) // seq_len
+        Segments of x
+
+    """
+    if not batch_first:
+        return x.unfold(0, seq_len + 1, seq_len).permute(2, 0, 1).contiguous()
+    return x.unfold(0, seq_len + 1, seq_len).transpose(1, 2)
+
+
 if __name__ == '__main__':
 
     N = 10
@@ -52,10 +376,11 @@ if __name__ == '__main__':
     x_np = np.arange(N).reshape(-1, 1).astype(np.float32)
     x = torch.tensor(x_np)
 
+    # Row-by-row construction
     X = torch.empty((N - n_a + 1, n_a))
     for idx_1 in range(N - n_a + 1):
-        X[idx_1] = x[idx_1:idx_1 + n_a].flip([0])
+        X[idx_1] = x[idx_1:idx_1 + n_a, 0].flip([0])
 
-    idx_start = np.arange(3,10, dtype=int)
-    idx_1 = idx_start[:, np.newaxis] - np.arange(3, dtype=int)
-    x[[idx_1]]
+    # Vectorized construction
+    X_vect = get_torch_regressor_mat(x, n_a)
+    assert torch.equal(X, X_vect)